@@ -6,6 +6,7 @@ from src.database import Base, engine
 import src.user.models
 import src.attachment.models
 import src.chat.models
+import src.room.models
 
 config = context.config
 if config.config_file_name is not None:
@@ -14,6 +15,13 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 
+def include_name(name, type_, parent_names):
+    # the FTS5 table and its shadow tables are managed by raw DDL, not by the models
+    if type_ == "table" and name and name.startswith(src.chat.models.MESSAGE_FTS_TABLE):
+        return False
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode."""
     url = config.get_main_option("sqlalchemy.url")
@@ -37,7 +45,7 @@ async def run_migrations_online() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
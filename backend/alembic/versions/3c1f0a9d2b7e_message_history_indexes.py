@@ -0,0 +1,30 @@
+"""message history indexes
+
+Revision ID: 3c1f0a9d2b7e
+Revises: 947e49fff6a3
+Create Date: 2025-10-02 12:04:51.517220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f0a9d2b7e'
+down_revision: Union[str, Sequence[str], None] = '947e49fff6a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_message_user_id_receiver_id_id', 'message', ['user_id', 'receiver_id', 'id'], unique=False)
+    op.create_index(op.f('ix_attachment_message_id'), 'attachment', ['message_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_attachment_message_id'), table_name='attachment')
+    op.drop_index('ix_message_user_id_receiver_id_id', table_name='message')
@@ -0,0 +1,46 @@
+"""attachment blobs
+
+Revision ID: 7d2e4b8c9a10
+Revises: 3c1f0a9d2b7e
+Create Date: 2025-10-03 10:41:18.204611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2e4b8c9a10'
+down_revision: Union[str, Sequence[str], None] = '3c1f0a9d2b7e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('attachment_blob',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('file_path', sa.String(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_attachment_blob_sha256'), 'attachment_blob', ['sha256'], unique=True)
+    with op.batch_alter_table('attachment') as batch_op:
+        batch_op.add_column(sa.Column('blob_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_attachment_blob_id_attachment_blob', 'attachment_blob', ['blob_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_attachment_blob_id'), ['blob_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('attachment') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_attachment_blob_id'))
+        batch_op.drop_constraint('fk_attachment_blob_id_attachment_blob', type_='foreignkey')
+        batch_op.drop_column('blob_id')
+    op.drop_index(op.f('ix_attachment_blob_sha256'), table_name='attachment_blob')
+    op.drop_table('attachment_blob')
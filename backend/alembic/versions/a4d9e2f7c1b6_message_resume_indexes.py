@@ -0,0 +1,30 @@
+"""message resume indexes
+
+Revision ID: a4d9e2f7c1b6
+Revises: f1c7a3e9b2d4
+Create Date: 2025-10-10 11:27:40.318552
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d9e2f7c1b6'
+down_revision: Union[str, Sequence[str], None] = 'f1c7a3e9b2d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_message_user_id_id', 'message', ['user_id', 'id'], unique=False)
+    op.create_index('ix_message_receiver_id_id', 'message', ['receiver_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_receiver_id_id', table_name='message')
+    op.drop_index('ix_message_user_id_id', table_name='message')
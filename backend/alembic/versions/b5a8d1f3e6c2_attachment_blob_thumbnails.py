@@ -0,0 +1,45 @@
+"""attachment blob thumbnails
+
+Revision ID: b5a8d1f3e6c2
+Revises: 7d2e4b8c9a10
+Create Date: 2025-10-04 15:22:37.918034
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5a8d1f3e6c2'
+down_revision: Union[str, Sequence[str], None] = '7d2e4b8c9a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('attachment_blob') as batch_op:
+        batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('thumbnail_path', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('thumbnail_status', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('thumbnail_attempts', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_attachment_blob_thumbnail_status'), ['thumbnail_status'], unique=False)
+    # blobs created by the dedupe tool before thumbnails existed
+    op.execute(
+        "UPDATE attachment_blob SET thumbnail_status = 'pending' WHERE id IN "
+        "(SELECT blob_id FROM attachment WHERE mimetype LIKE 'image/%')"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('attachment_blob') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_attachment_blob_thumbnail_status'))
+        batch_op.drop_column('thumbnail_attempts')
+        batch_op.drop_column('thumbnail_status')
+        batch_op.drop_column('thumbnail_path')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
@@ -0,0 +1,31 @@
+"""widen user hashed_password
+
+Revision ID: c9e1f7a2d4b8
+Revises: b5a8d1f3e6c2
+Create Date: 2025-10-06 09:13:52.640177
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e1f7a2d4b8'
+down_revision: Union[str, Sequence[str], None] = 'b5a8d1f3e6c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # bcrypt (60) and argon2 (~97) hashes do not fit into 50 characters
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('hashed_password', existing_type=sa.String(length=50), type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('hashed_password', existing_type=sa.String(length=255), type_=sa.String(length=50), existing_nullable=False)
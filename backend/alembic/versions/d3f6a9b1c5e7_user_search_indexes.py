@@ -0,0 +1,32 @@
+"""user search indexes
+
+Revision ID: d3f6a9b1c5e7
+Revises: c9e1f7a2d4b8
+Create Date: 2025-10-07 11:48:06.302715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f6a9b1c5e7'
+down_revision: Union[str, Sequence[str], None] = 'c9e1f7a2d4b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_user_first_name_lower', 'user', [sa.text('lower(first_name)')], unique=False)
+    op.create_index('ix_user_last_name_lower', 'user', [sa.text('lower(last_name)')], unique=False)
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_user_email_lower', table_name='user')
+    op.drop_index('ix_user_last_name_lower', table_name='user')
+    op.drop_index('ix_user_first_name_lower', table_name='user')
@@ -0,0 +1,34 @@
+"""reindex user search with unicode lower
+
+Revision ID: e5a1c7d3f9b2
+Revises: c2f8a6d4e9b3
+Create Date: 2025-10-14 10:21:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a1c7d3f9b2'
+down_revision: Union[str, Sequence[str], None] = 'c2f8a6d4e9b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# built with SQLite's ASCII-only lower(), the app registers a Unicode one (src.database)
+INDEXES = ['ix_user_first_name_lower', 'ix_user_last_name_lower', 'ix_user_email_lower']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for index in INDEXES:
+        op.execute(f'REINDEX {index}')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # the indexes stay valid for the Unicode lower() the app keeps registering
+    pass
@@ -0,0 +1,66 @@
+"""conversations
+
+Revision ID: e8b2c4d6f1a3
+Revises: d3f6a9b1c5e7
+Create Date: 2025-10-08 10:21:44.518309
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b2c4d6f1a3'
+down_revision: Union[str, Sequence[str], None] = 'd3f6a9b1c5e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_low_id', sa.Integer(), nullable=False),
+    sa.Column('user_high_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_preview', sa.String(length=100), nullable=False),
+    sa.Column('last_message_at', sa.TIMESTAMP(), nullable=False),
+    sa.Column('last_sender_id', sa.Integer(), nullable=False),
+    sa.Column('low_unread', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('high_unread', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('low_last_read_id', sa.Integer(), nullable=True),
+    sa.Column('high_last_read_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['user_high_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_low_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_low_id', 'user_high_id', name='uq_conversation_pair')
+    )
+    op.create_index('ix_conversation_low_last_message', 'conversation', ['user_low_id', 'last_message_id'], unique=False)
+    op.create_index('ix_conversation_high_last_message', 'conversation', ['user_high_id', 'last_message_id'], unique=False)
+
+    # existing dialogs start fully read, from their newest message
+    op.execute("""
+        INSERT INTO conversation (
+            user_low_id, user_high_id, last_message_id, last_message_preview, last_message_at,
+            last_sender_id, low_unread, high_unread, low_last_read_id, high_last_read_id
+        )
+        SELECT p.low, p.high, m.id, substr(m.message, 1, 100), m.created_at,
+               m.user_id, 0, 0, m.id, m.id
+        FROM (
+            SELECT CASE WHEN user_id < receiver_id THEN user_id ELSE receiver_id END AS low,
+                   CASE WHEN user_id < receiver_id THEN receiver_id ELSE user_id END AS high,
+                   max(id) AS last_id
+            FROM message
+            GROUP BY 1, 2
+        ) p
+        JOIN message m ON m.id = p.last_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversation_high_last_message', table_name='conversation')
+    op.drop_index('ix_conversation_low_last_message', table_name='conversation')
+    op.drop_table('conversation')
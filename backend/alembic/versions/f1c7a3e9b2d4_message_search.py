@@ -0,0 +1,50 @@
+"""message search
+
+Revision ID: f1c7a3e9b2d4
+Revises: e8b2c4d6f1a3
+Create Date: 2025-10-09 14:03:27.964120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c7a3e9b2d4'
+down_revision: Union[str, Sequence[str], None] = 'e8b2c4d6f1a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE INDEX IF NOT EXISTS ix_message_message_tsv ON message "
+                   "USING gin (to_tsvector('simple'::regconfig, message))")
+        return
+
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+               "message, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN "
+               "INSERT INTO message_fts(rowid, message) VALUES (new.id, new.message); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN "
+               "INSERT INTO message_fts(message_fts, rowid, message) VALUES ('delete', old.id, old.message); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF message ON message BEGIN "
+               "INSERT INTO message_fts(message_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+               "INSERT INTO message_fts(rowid, message) VALUES (new.id, new.message); END")
+    # index the messages that already exist
+    op.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_message_message_tsv")
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS message_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS message_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS message_fts_ai")
+    op.execute("DROP TABLE IF EXISTS message_fts")
@@ -1,16 +1,46 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from src.config import settings
 from src.auth.routers import router as auth_router
 from src.user.routers import router as user_router
 from src.chat.routers import router as chat_router
-from src.chat.ws_routers import router as ws_router
+from src.chat.ws_routers import router as ws_router, manager, ephemeral_events, presence_tracker
+from src.attachment.routers import router as attachment_router
+from src.room.routers import router as room_router, room_members_cache
+from src.chat.writer import message_writer
+from src.chat.delivery import delivery_tracker
+from src.attachment.thumbnails import thumbnail_pipeline
+from src.database import dispose_engines
+from src.metrics import MetricsMiddleware, metrics_endpoint, stats_collector
+from src.auth.authentication_config import token_cache
+from src.user.routers import user_cache, user_search_cache
+from src.attachment.routers import attachment_access_cache
+from src.profiling.profiler import ProfilingMiddleware, profiler
+from src.profiling.routers import router as profiling_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start()
+    await message_writer.start()
+    await delivery_tracker.start()
+    await ephemeral_events.start()
+    await presence_tracker.start()
+    await thumbnail_pipeline.start()
+    yield
+    await thumbnail_pipeline.stop()
+    await presence_tracker.stop()
+    await ephemeral_events.stop()
+    await delivery_tracker.stop()
+    await message_writer.stop()
+    await manager.stop()
+    await dispose_engines()
 
-app = FastAPI()
 
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_ROOT), name="uploads")
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -24,11 +54,38 @@ app.add_middleware(
     allow_headers=["*"],         # разрешить все заголовки
 )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+    stats_collector.add(
+        "chat_ws", manager.stats,
+        counters=("enqueued", "sent", "evicted", "coalesced", "slow_disconnects", "send_failures", "idle_reaped"),
+    )
+    stats_collector.add("chat_ws_writer", message_writer.stats)
+    stats_collector.add("chat_delivery", delivery_tracker.stats, counters=("acks", "compacted"))
+    stats_collector.add("chat_ws_ephemeral", ephemeral_events.stats, counters=("forwarded", "coalesced"))
+    stats_collector.add("chat_presence", presence_tracker.stats, counters=("frames",))
+    stats_collector.add("chat_thumbnail", thumbnail_pipeline.stats)
+    for name, cache in (
+        ("auth_token", token_cache),
+        ("user", user_cache),
+        ("user_search", user_search_cache),
+        ("attachment_access", attachment_access_cache),
+        ("room_members", room_members_cache),
+    ):
+        stats_collector.add(f"chat_{name}_cache", cache.stats, counters=("hits", "misses"))
+
+if profiler.enabled:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    app.include_router(profiling_router)
+
 # Switched on routers
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(chat_router)
 app.include_router(ws_router)
+app.include_router(attachment_router)
+app.include_router(room_router)
 
 
 # @app.get("/me")
@@ -0,0 +1,149 @@
+"""
+Move attachments uploaded before deduplication into content-addressed blobs.
+
+    python -m src.attachment.dedupe [--dry-run] [--sweep]
+
+Every attachment without a blob is hashed; the first file with given content becomes
+the blob (hard-linked or copied to blobs/...), the other copies are removed once the
+attachment rows point to the blob. --sweep also removes files under blobs/ that no
+blob row references (left behind by failed uploads). Files modified within the last
+--sweep-grace seconds and temp files (*.part) are kept: they may belong to an upload
+whose transaction has not committed yet.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+
+from pathlib import Path
+
+from sqlalchemy import select
+
+from src.attachment.models import Attachment, AttachmentBlob
+from src.attachment.utils import BLOB_DIR, CHUNK_SIZE, UPLOAD_ROOT, acquire_blob, blob_path, discard_blob_files
+from src.database import async_session_maker
+import src.chat.models  # noqa: F401  (mapper of Attachment.message)
+import src.user.models  # noqa: F401
+
+import logging
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+SWEEP_GRACE_SECONDS = 3600
+
+
+def _hash_file(path: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _link_or_copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+async def dedupe(dry_run: bool = False) -> dict:
+    stats = {"attachments": 0, "missing": 0, "blobs_created": 0, "duplicates": 0, "bytes_freed": 0}
+    seen: dict[str, str] = {}
+    last_id = 0
+    while True:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(Attachment)
+                .where(Attachment.blob_id.is_(None), Attachment.id > last_id)
+                .order_by(Attachment.id)
+                .limit(BATCH_SIZE)
+            )
+            batch = result.scalars().all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            replaced: list[str] = []
+            for att in batch:
+                stats["attachments"] += 1
+                src = os.path.join(UPLOAD_ROOT, att.file_path)
+                if not os.path.exists(src):
+                    logger.warning(f"Attachment {att.id}: {att.file_path} is missing, skipped")
+                    stats["missing"] += 1
+                    continue
+                sha, size = await asyncio.to_thread(_hash_file, src)
+                known = seen.get(sha) or await session.scalar(
+                    select(AttachmentBlob.file_path).where(AttachmentBlob.sha256 == sha)
+                )
+                if known is None:
+                    known = seen[sha] = blob_path(sha, Path(att.file_path).suffix)
+                    stats["blobs_created"] += 1
+                    if not dry_run:
+                        await asyncio.to_thread(_link_or_copy, src, os.path.join(UPLOAD_ROOT, known))
+                else:
+                    stats["duplicates"] += 1
+                    stats["bytes_freed"] += size
+                if dry_run:
+                    continue
+                blob = await acquire_blob(session, sha, known, size, att.mimetype)
+                att.blob_id, att.file_path = blob.id, blob.file_path
+                replaced.append(os.path.relpath(src, UPLOAD_ROOT))
+
+            if dry_run:
+                await session.rollback()
+                continue
+            await session.commit()
+        # the rows point to the blobs now, old copies can go
+        discard_blob_files(replaced)
+    return stats
+
+
+async def sweep(dry_run: bool = False, grace: float = SWEEP_GRACE_SECONDS) -> int:
+    cutoff = time.time() - grace
+    async with async_session_maker() as session:
+        result = await session.execute(select(AttachmentBlob.file_path))
+        referenced = {os.path.normpath(p) for p in result.scalars().all()}
+    removed = 0
+    for root, _, names in os.walk(os.path.join(UPLOAD_ROOT, BLOB_DIR)):
+        for name in names:
+            if name.endswith(".part"):
+                continue  # being written by _write_blob
+            path = os.path.join(root, name)
+            if os.path.normpath(os.path.relpath(path, UPLOAD_ROOT)) in referenced:
+                continue
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue  # its upload may not have committed yet
+                if not dry_run:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without touching anything")
+    parser.add_argument("--sweep", action="store_true", help="remove blob files without a blob row")
+    parser.add_argument("--sweep-grace", type=float, default=SWEEP_GRACE_SECONDS,
+                        help="keep files modified less than this many seconds ago (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stats = await dedupe(dry_run=args.dry_run)
+    if args.sweep:
+        stats["swept"] = await sweep(dry_run=args.dry_run, grace=args.sweep_grace)
+    logger.info(f"Deduplication {'(dry run) ' if args.dry_run else ''}finished: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""
+CPU-bound image work. Runs inside ProcessPoolExecutor workers, so it only
+imports Pillow and the standard library.
+"""
+import os
+import uuid
+
+
+class NotAnImage(Exception):
+    pass
+
+
+def make_thumbnail(src: str, dst: str, max_side: int) -> tuple[int, int]:
+    """
+    Write a WEBP thumbnail of `src` that fits into max_side x max_side to `dst`
+    (temp file + rename). Returns the original (width, height).
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        img = Image.open(src)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise NotAnImage(str(e))
+
+    with img:
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        img.thumbnail((max_side, max_side))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{uuid.uuid4().hex}.part"
+        try:
+            img.save(tmp, format="WEBP", quality=80)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return width, height
@@ -1,9 +1,35 @@
-from sqlalchemy import Integer, String, ForeignKey, CheckConstraint
+from datetime import datetime
+
+from sqlalchemy import Integer, String, ForeignKey, CheckConstraint, TIMESTAMP
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.database import Base
 from src.chat.models import Message
 
+THUMBNAIL_PENDING = "pending"
+THUMBNAIL_READY = "ready"
+THUMBNAIL_FAILED = "failed"
+THUMBNAIL_SKIPPED = "skipped"  # not decodable as an image
+
+
+class AttachmentBlob(Base):
+    """Stored file content, shared by every attachment with the same sha256."""
+    __tablename__ = "attachment_blob"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(length=64), unique=True, index=True, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    file_path: Mapped[str] = mapped_column(String, nullable=False)
+    refcount: Mapped[int] = mapped_column(Integer, default=1, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+    # image preview, filled in by src/attachment/thumbnails.py; status is NULL for non-images
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    thumbnail_path: Mapped[str | None] = mapped_column(String, nullable=True)
+    thumbnail_status: Mapped[str | None] = mapped_column(String(length=16), index=True, nullable=True)
+    thumbnail_attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
+
 class Attachment(Base):
     __tablename__ = "attachment"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -11,10 +37,25 @@ class Attachment(Base):
     mimetype: Mapped[str] = mapped_column(String, nullable=False)
     size: Mapped[int] = mapped_column(Integer, nullable=False)
     file_path: Mapped[str] = mapped_column(String, nullable=False)
+    # NULL for files uploaded before deduplication, see src/attachment/dedupe.py
+    blob_id: Mapped[int | None] = mapped_column(Integer, ForeignKey(AttachmentBlob.id), index=True, nullable=True)
+    blob: Mapped[AttachmentBlob | None] = relationship(AttachmentBlob, lazy="joined")
 
-    message_id: Mapped[int] = mapped_column(Integer, ForeignKey(Message.id), nullable=False)
+    message_id: Mapped[int] = mapped_column(Integer, ForeignKey(Message.id), index=True, nullable=False)
     message: Mapped["Message"] = relationship("Message", back_populates="attachments")
 
     __table_args__ = (
         CheckConstraint("size <= 5242880", name="check_attachment_size"),  # 5 MB
     )
+
+    @property
+    def thumbnail_path(self) -> str | None:
+        return self.blob.thumbnail_path if self.blob else None
+
+    @property
+    def width(self) -> int | None:
+        return self.blob.width if self.blob else None
+
+    @property
+    def height(self) -> int | None:
+        return self.blob.height if self.blob else None
@@ -0,0 +1,219 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.attachment.models import Attachment, AttachmentBlob
+from src.attachment.schemas import AttachmentLink
+from src.auth.authentication_config import decode_token, get_current_user_id_from_token, oauth2_scheme_optional
+from src.cache import TTLCache
+from src.chat.models import Message
+from src.chat.ws_routers import manager
+from src.config import settings
+from src.database import get_async_session
+
+import logging
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/attachments", tags=["Attachment"])
+
+UPLOAD_ROOT = settings.UPLOAD_ROOT
+# stored files never change: a new upload is a new blob
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+ATTACHMENT_PATH = "attachments/{attachment_id}"
+THUMBNAIL_PATH = "attachments/{attachment_id}/thumbnail"
+URL_SIGNING_KEY = hashlib.sha256(f"attachment-url:{settings.AUTH_SECRET_KEY}".encode()).digest()
+
+
+@dataclass(frozen=True)
+class AttachmentAccess:
+    participants: frozenset[int]
+    file_path: str
+    filename: str
+    mimetype: str
+    sha256: str | None
+    thumbnail_path: str | None
+
+
+# attachment id -> AttachmentAccess; entries are dropped in every worker when the message
+# is deleted (through the WS bus)
+attachment_access_cache = TTLCache(
+    maxsize=settings.ATTACHMENT_ACCESS_CACHE_SIZE,
+    ttl=settings.ATTACHMENT_ACCESS_CACHE_TTL,
+)
+
+
+def _invalidate_local(attachment_ids: str):
+    for attachment_id in attachment_ids.split(","):
+        attachment_access_cache.pop(int(attachment_id))
+
+
+manager.bus.add_invalidator("attachment_access", _invalidate_local)
+
+
+async def invalidate_attachment_access(attachment_ids: list[int]):
+    """Called before and after the delete commits, see src.room.routers.invalidate_room_members."""
+    if not attachment_ids:
+        return
+    try:
+        await manager.bus.invalidate("attachment_access", ",".join(map(str, attachment_ids)))
+    except Exception:
+        # dropped in this worker already, the others catch up after ATTACHMENT_ACCESS_CACHE_TTL
+        logger.exception(f"Failed to publish the deletion of attachments {attachment_ids}")
+
+
+async def _get_access(attachment_id: int, session: AsyncSession, need_thumbnail: bool = False) -> AttachmentAccess:
+    access = attachment_access_cache.get(attachment_id)
+    # a thumbnail may have been generated after the entry was cached
+    if access is not None and not (need_thumbnail and access.thumbnail_path is None):
+        return access
+
+    result = await session.execute(
+        select(
+            Message.user_id,
+            Message.receiver_id,
+            Attachment.file_path,
+            Attachment.filename,
+            Attachment.mimetype,
+            AttachmentBlob.sha256,
+            AttachmentBlob.thumbnail_path,
+        )
+        .join(Message, Message.id == Attachment.message_id)
+        .outerjoin(AttachmentBlob, AttachmentBlob.id == Attachment.blob_id)
+        .where(Attachment.id == attachment_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    access = AttachmentAccess(
+        participants=frozenset((row.user_id, row.receiver_id)),
+        file_path=row.file_path,
+        filename=row.filename,
+        mimetype=row.mimetype,
+        sha256=row.sha256,
+        thumbnail_path=row.thumbnail_path,
+    )
+    attachment_access_cache.set(attachment_id, access)
+    return access
+
+
+def _url_signature(path: str, expires: int) -> str:
+    mac = hmac.new(URL_SIGNING_KEY, f"{path}:{expires}".encode(), hashlib.sha256)
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b"=").decode()
+
+
+def signed_url(path: str, expires: int) -> str:
+    """`path` (e.g. "attachments/12/thumbnail") with a signature valid until `expires` (unix time)."""
+    return f"{path}?expires={expires}&signature={_url_signature(path, expires)}"
+
+
+def _signed_or_user(path_format: str):
+    """
+    Dependency: the user of the Authorization header, or None for a valid signed URL of
+    path_format, which grants access to that one path until it expires (GET /attachments/{id}/link).
+    """
+    def authenticate(
+        attachment_id: int,
+        header_token: str | None = Depends(oauth2_scheme_optional),
+        expires: int | None = Query(None),
+        signature: str | None = Query(None),
+    ) -> int | None:
+        if signature is not None and expires is not None:
+            path = path_format.format(attachment_id=attachment_id)
+            if expires >= time.time() and hmac.compare_digest(signature, _url_signature(path, expires)):
+                return None
+            raise HTTPException(status_code=403, detail="Invalid or expired link")
+        if not header_token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        return int(decode_token(header_token, expected_type="access")["sub"])
+    return authenticate
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison against the If-None-Match list (RFC 9110 13.1.2): "*", W/ tags, commas."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def _serve(request: Request, file_path: str, etag: str | None, media_type: str, filename: str | None = None) -> Response:
+    headers = {"cache-control": CACHE_CONTROL}
+    if etag:
+        headers["etag"] = etag
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+
+    if settings.ATTACHMENT_ACCEL_REDIRECT:
+        # nginx sends the file itself (sendfile, Range) from an internal location
+        headers["x-accel-redirect"] = f"{settings.ATTACHMENT_ACCEL_REDIRECT.rstrip('/')}/{file_path}"
+        return Response(headers=headers, media_type=media_type)
+
+    path = os.path.join(UPLOAD_ROOT, file_path)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    # FileResponse answers Range/If-Range requests and uses the server's pathsend (sendfile) when available
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        content_disposition_type="inline",
+        headers=headers,
+    )
+
+
+@router.get("/{attachment_id}/link", response_model=AttachmentLink)
+async def get_attachment_link(
+    attachment_id: int,
+    user_id: int = Depends(get_current_user_id_from_token),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Signed URLs for the browser to open by itself: scoped to this attachment and valid
+    for ATTACHMENT_URL_TTL_SECONDS, so no access token ends up in URLs, logs or Referer.
+    """
+    access = await _get_access(attachment_id, session, need_thumbnail=True)
+    if user_id not in access.participants:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    expires = int(time.time()) + settings.ATTACHMENT_URL_TTL_SECONDS
+    return AttachmentLink(
+        url=signed_url(ATTACHMENT_PATH.format(attachment_id=attachment_id), expires),
+        thumbnail_url=(
+            signed_url(THUMBNAIL_PATH.format(attachment_id=attachment_id), expires) if access.thumbnail_path else None
+        ),
+        expires_at=datetime.fromtimestamp(expires, timezone.utc),
+    )
+
+
+@router.get("/{attachment_id}")
+async def download_attachment(
+    attachment_id: int,
+    request: Request,
+    user_id: int | None = Depends(_signed_or_user(ATTACHMENT_PATH)),
+    session: AsyncSession = Depends(get_async_session),
+):
+    access = await _get_access(attachment_id, session)
+    if user_id is not None and user_id not in access.participants:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    etag = f'"{access.sha256}"' if access.sha256 else None
+    return _serve(request, access.file_path, etag, access.mimetype, access.filename)
+
+
+@router.get("/{attachment_id}/thumbnail")
+async def download_thumbnail(
+    attachment_id: int,
+    request: Request,
+    user_id: int | None = Depends(_signed_or_user(THUMBNAIL_PATH)),
+    session: AsyncSession = Depends(get_async_session),
+):
+    access = await _get_access(attachment_id, session, need_thumbnail=True)
+    if (user_id is not None and user_id not in access.participants) or access.thumbnail_path is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return _serve(request, access.thumbnail_path, f'"{access.sha256}-thumb"', "image/webp")
@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel, Field, field_validator, ConfigDict, field_serializer
 from src.config import settings
 
@@ -21,9 +24,25 @@ class AttachmentRead(AttachmentBase):
     id: int
     message_id: int
     file_path: str
+    # images only, set once the thumbnail is generated
+    thumbnail_path: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
 
+    # files are only served through the access-checked /attachments endpoints
     @field_serializer("file_path")
     def serialize_path(self, v: str) -> str:
-        return f"uploads/{v}"
+        return f"attachments/{self.id}"
+
+    @field_serializer("thumbnail_path")
+    def serialize_thumbnail_path(self, v: Optional[str]) -> Optional[str]:
+        return f"attachments/{self.id}/thumbnail" if v else None
+
+
+class AttachmentLink(BaseModel):
+    """Short-lived URLs of one attachment, usable without the Authorization header."""
+    url: str
+    thumbnail_url: Optional[str] = None
+    expires_at: datetime
@@ -0,0 +1,217 @@
+"""
+Thumbnails and dimensions for image attachments.
+
+Blobs are content-addressed, so every image is processed once however many
+attachments share it. Jobs are blob ids in a bounded queue; the decoding and
+resizing run in a ProcessPoolExecutor and never touch the event loop.
+
+Backfill for files stored before the pipeline existed:
+
+    python -m src.attachment.thumbnails [--retry-failed]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.attachment.imaging import NotAnImage, make_thumbnail
+from src.attachment.models import (
+    AttachmentBlob, THUMBNAIL_FAILED, THUMBNAIL_PENDING, THUMBNAIL_READY, THUMBNAIL_SKIPPED,
+)
+from src.config import settings
+from src.database import async_session_maker
+import src.chat.models  # noqa: F401  (mapper of Attachment.message)
+import src.user.models  # noqa: F401
+
+import logging
+logger = logging.getLogger(__name__)
+
+UPLOAD_ROOT = settings.UPLOAD_ROOT
+THUMBNAIL_DIR = "thumbs"
+
+
+def thumbnail_path(sha256: str, max_side: int) -> str:
+    """thumbs/{sha[:2]}/{sha[2:4]}/{sha}_{max_side}.webp, relative to UPLOAD_ROOT"""
+    return os.path.join(THUMBNAIL_DIR, sha256[:2], sha256[2:4], f"{sha256}_{max_side}.webp")
+
+
+class ThumbnailPipeline:
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        max_side: int,
+        workers: int,
+        queue_size: int,
+        max_attempts: int,
+        retry_delay: float = 5.0,
+    ):
+        self._session_maker = session_maker
+        self.max_side = max_side
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue[int] = asyncio.Queue(maxsize=queue_size)
+        self._executor: ProcessPoolExecutor | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._retries: set[asyncio.Task] = set()  # failed jobs waiting for their next attempt
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: forking a process with a running event loop and threads is unsafe
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def start(self):
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            logger.warning("Pillow is not installed, thumbnails are disabled")
+            return
+        self._executor = self._new_executor()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in (*self._tasks, *self._retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+        self._retries.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, blob_id: int) -> bool:
+        """Queue a blob without waiting. When the queue is full the blob stays pending for the backfill."""
+        if not self.enabled:
+            return False
+        try:
+            self._queue.put_nowait(blob_id)
+        except asyncio.QueueFull:
+            logger.warning(f"Thumbnail queue is full, blob {blob_id} left for backfill")
+            return False
+        return True
+
+    async def put(self, blob_id: int):
+        await self._queue.put(blob_id)
+
+    async def join(self):
+        """Wait until the queue is empty and no job is waiting for a retry."""
+        while True:
+            await self._queue.join()
+            if not self._retries:
+                return
+            await asyncio.gather(*self._retries, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"queue_depth": self._queue.qsize(), "retries_scheduled": len(self._retries)}
+
+    def _schedule_retry(self, blob_id: int, delay: float):
+        task = asyncio.create_task(self._retry(blob_id, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _retry(self, blob_id: int, delay: float):
+        await asyncio.sleep(delay)
+        await self.put(blob_id)
+
+    async def _worker(self):
+        while True:
+            blob_id = await self._queue.get()
+            try:
+                await self._process(blob_id)
+            except Exception:
+                logger.exception(f"Thumbnail job for blob {blob_id} failed")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, blob_id: int):
+        async with self._session_maker() as session:
+            blob = await session.get(AttachmentBlob, blob_id)
+            if blob is None or blob.thumbnail_status != THUMBNAIL_PENDING:
+                return
+            src = os.path.join(UPLOAD_ROOT, blob.file_path)
+            thumb = thumbnail_path(blob.sha256, self.max_side)
+            attempts = blob.thumbnail_attempts
+
+        loop = asyncio.get_running_loop()
+        try:
+            width, height = await loop.run_in_executor(
+                self._executor, make_thumbnail, src, os.path.join(UPLOAD_ROOT, thumb), self.max_side
+            )
+            values = {"width": width, "height": height, "thumbnail_path": thumb, "thumbnail_status": THUMBNAIL_READY}
+        except NotAnImage:
+            values = {"thumbnail_status": THUMBNAIL_SKIPPED}
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # a worker died (e.g. OOM on a hostile image), the pool has to be replaced
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            attempts += 1
+            logger.warning(f"Thumbnail for blob {blob_id} failed (attempt {attempts}/{self.max_attempts}): {e!r}")
+            values = {"thumbnail_attempts": attempts}
+            if attempts >= self.max_attempts:
+                values["thumbnail_status"] = THUMBNAIL_FAILED
+            else:
+                self._schedule_retry(blob_id, self.retry_delay * 2 ** (attempts - 1))
+
+        async with self._session_maker() as session:
+            async with session.begin():
+                await session.execute(update(AttachmentBlob).where(AttachmentBlob.id == blob_id).values(**values))
+
+
+thumbnail_pipeline = ThumbnailPipeline(
+    async_session_maker,
+    max_side=settings.THUMBNAIL_SIZE,
+    workers=settings.THUMBNAIL_WORKERS,
+    queue_size=settings.THUMBNAIL_QUEUE_SIZE,
+    max_attempts=settings.THUMBNAIL_MAX_ATTEMPTS,
+)
+
+
+async def backfill(retry_failed: bool = False) -> int:
+    async with async_session_maker() as session:
+        async with session.begin():
+            if retry_failed:
+                await session.execute(
+                    update(AttachmentBlob)
+                    .where(AttachmentBlob.thumbnail_status == THUMBNAIL_FAILED)
+                    .values(thumbnail_status=THUMBNAIL_PENDING, thumbnail_attempts=0)
+                )
+            result = await session.execute(
+                select(AttachmentBlob.id).where(AttachmentBlob.thumbnail_status == THUMBNAIL_PENDING)
+            )
+            blob_ids = result.scalars().all()
+
+    # join() waits for the retries too: a blob ends up ready, skipped or failed
+    await thumbnail_pipeline.start()
+    if not thumbnail_pipeline.enabled:
+        return 0
+    try:
+        for blob_id in blob_ids:
+            await thumbnail_pipeline.put(blob_id)
+        await thumbnail_pipeline.join()
+    finally:
+        await thumbnail_pipeline.stop()
+    return len(blob_ids)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retry-failed", action="store_true", help="also retry blobs that ran out of attempts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = await backfill(retry_failed=args.retry_failed)
+    logger.info(f"Thumbnail backfill processed {count} blobs")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
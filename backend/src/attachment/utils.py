@@ -1,17 +1,37 @@
+import asyncio
+import hashlib
 import os
+import shutil
+import time
 import uuid
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 
 from fastapi import UploadFile, HTTPException
+from sqlalchemy import select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.attachment.models import Attachment
+from src.attachment.models import Attachment, AttachmentBlob, THUMBNAIL_PENDING
 from src.config import settings
+from src.database import dialect_insert
+from src.metrics import attachment_bytes_deduplicated, attachment_bytes_written, attachment_save_duration
 
 MAX_ATTACHMENT_SIZE = settings.MAX_ATTACHMENT_SIZE
 UPLOAD_ROOT = settings.UPLOAD_ROOT
+BLOB_DIR = "blobs"
+CHUNK_SIZE = 1024 * 1024
+# not starlette's threadpool (up to 40 threads): a few threads keep the event loop responsive
+attachment_io_executor = ThreadPoolExecutor(max_workers=settings.ATTACHMENT_IO_WORKERS, thread_name_prefix="attachment-io")
+
+
+async def _run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(attachment_io_executor, func, *args)
+
 
 def generate_file_path(user_id: int, original_filename: str) -> str:
     """
@@ -49,61 +69,224 @@ def generate_file_path(user_id: int, original_filename: str) -> str:
 def _sanitize_filename(name: str) -> str:
     return "".join(c for c in name if c.isalnum() or c in (" ", ".", "_", "-")).rstrip()
 
-async def save_attachment(file: UploadFile, message_id: int, session: AsyncSession, user_id: int) -> dict:
-    # 1) Form a unique name and path
-    original = _sanitize_filename(file.filename)
-    ext = Path(original).suffix
-    unique_name = f"{uuid.uuid4().hex}{ext or ''}"
-    user_folder = os.path.join(UPLOAD_ROOT, str(user_id))
 
-    os.makedirs(user_folder, exist_ok=True)
-    path = os.path.join(user_folder, unique_name)
+@dataclass
+class StoredFile:
+    sha256: str
+    file_path: str  # relative to UPLOAD_ROOT, shared by every upload of the same content
+    filename: str
+    mimetype: str
+    size: int
+    written: bool = False  # the file was written by this upload, not deduplicated
+    upload: UploadFile | None = field(default=None, repr=False)
+
+
+def blob_path(sha256: str, ext: str = "") -> str:
+    """
+    Content-addressed location of a blob, relative to UPLOAD_ROOT:
+    blobs/{sha[:2]}/{sha[2:4]}/{sha}{ext}
+    """
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+
+def _fsync_dir(path: str):
+    # make the rename itself durable
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 
-    # 2) Stream recording and size calculation
+def _hash_upload(file: UploadFile) -> tuple[str, int]:
+    """
+    Blocking, runs on attachment_io_executor: stream the spooled upload through sha256
+    and enforce the size limit without writing anything.
+    """
+    digest = hashlib.sha256()
     size = 0
+    # move the pointer to the beginning
+    file.file.seek(0)
+    while True:
+        chunk = file.file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_ATTACHMENT_SIZE:
+            raise HTTPException(status_code=400, detail=f"File {file.filename} exceeds maximum size of 5 MB")
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+def _write_blob(file: UploadFile, relative_path: str):
+    """
+    Blocking, runs on attachment_io_executor.
+    The bytes go to a temp file in the target folder which is fsynced and atomically
+    renamed, so a crash never leaves a half-written blob under its final name.
+    """
+    path = os.path.join(UPLOAD_ROOT, relative_path)
+    if os.path.exists(path):
+        return
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
     try:
-        with open(path, "wb") as out_f:
-            chunk_size = 1024 * 64
-            # move the pointer to the beginning
+        with open(tmp_path, "wb") as out_f:
             file.file.seek(0)
-            while True:
-                chunk = file.file.read(chunk_size)
-                if not chunk:
-                    break
-                out_f.write(chunk)
-                size += len(chunk)
-                if size > MAX_ATTACHMENT_SIZE:
-                    # delete partially written file
-                    out_f.close()
-                    os.remove(path)
-                    raise HTTPException(status_code=400, detail=f"File {file.filename} exceeds maximum size of 5 MB")
+            shutil.copyfileobj(file.file, out_f, CHUNK_SIZE)
+            out_f.flush()
+            os.fsync(out_f.fileno())
+        os.replace(tmp_path, path)
     except Exception:
-        # if something went wrong, we confirm the rollback
-        if os.path.exists(path):
+        # if something went wrong, delete partially written file
+        if os.path.exists(tmp_path):
             try:
-                os.remove(path)
+                os.remove(tmp_path)
             except Exception:
                 pass
         raise
+    _fsync_dir(folder)
+
+
+def discard_blob_files(file_paths: list[str]):
+    for file_path in file_paths:
+        try:
+            os.remove(os.path.join(UPLOAD_ROOT, file_path))
+        except OSError:
+            pass
+
+
+async def discard_unreferenced_files(session: AsyncSession, stored: list[StoredFile]):
+    """
+    Remove the files written by save_attachment_files when the transaction that was to
+    reference them failed; files a blob row points to meanwhile (same content uploaded
+    concurrently) are kept.
+    """
+    written = {s.file_path for s in stored if s.written}
+    if not written:
+        return
+    async with session.begin():
+        result = await session.execute(select(AttachmentBlob.file_path).where(AttachmentBlob.file_path.in_(written)))
+        referenced = set(result.scalars().all())
+    discard_blob_files(sorted(written - referenced))
+
+
+async def save_attachment_files(files: list[UploadFile], session: AsyncSession) -> list[StoredFile]:
+    """
+    Hash all uploads concurrently off the event loop, then write only the content
+    that is not stored yet. Call it before opening the write transaction.
+    """
+    if not files:
+        return []
+    started = time.perf_counter()
+    hashes = await asyncio.gather(*(_run_io(_hash_upload, f) for f in files))
+
+    async with session.begin():
+        result = await session.execute(
+            select(AttachmentBlob.sha256, AttachmentBlob.file_path)
+            .where(AttachmentBlob.sha256.in_({sha for sha, _ in hashes}))
+        )
+        known = dict(result.all())
+
+    stored: list[StoredFile] = []
+    to_write: dict[str, UploadFile] = {}
+    for f, (sha, size) in zip(files, hashes):
+        original = _sanitize_filename(f.filename or "")
+        if sha not in known:
+            known[sha] = blob_path(sha, Path(original).suffix)
+            to_write[sha] = f
+        stored.append(StoredFile(
+            sha256=sha,
+            file_path=known[sha],  # только относительный путь
+            filename=original,
+            mimetype=f.content_type or "application/octet-stream",
+            size=size,
+            written=sha in to_write,
+            upload=f,
+        ))
+
+    # duplicates of stored content skip the disk entirely
+    await asyncio.gather(*(_run_io(_write_blob, f, known[sha]) for sha, f in to_write.items()))
+
+    written = sum(size for sha, size in dict(hashes).items() if sha in to_write)
+    attachment_bytes_written.inc(written)
+    attachment_bytes_deduplicated.inc(sum(size for _, size in hashes) - written)
+    attachment_save_duration.observe(time.perf_counter() - started)
+    return stored
 
-    # 3) create an Attachment object (do not commit)
-    # attachment = Attachment(
-    #     message_id=message_id,
-    #     file_path=str(path),
-    #     filename=original,
-    #     mimetype=file.content_type or "application/octet-stream",
-    #     size=size,
-    # )
-    relative_path = os.path.relpath(path, UPLOAD_ROOT)
 
+def is_image(mimetype: str) -> bool:
+    return mimetype.startswith("image/")
+
+
+async def acquire_blob(session: AsyncSession, sha256: str, file_path: str, size: int, mimetype: str) -> AttachmentBlob:
+    """Insert the blob or take one more reference to it."""
+    insert = dialect_insert(session)
+    stmt = (
+        insert(AttachmentBlob)
+        .values(
+            sha256=sha256,
+            file_path=file_path,
+            size=size,
+            refcount=1,
+            created_at=datetime.utcnow(),
+            # images get a thumbnail from src/attachment/thumbnails.py
+            thumbnail_status=THUMBNAIL_PENDING if is_image(mimetype) else None,
+        )
+        .on_conflict_do_update(
+            index_elements=[AttachmentBlob.sha256],
+            set_={"refcount": AttachmentBlob.refcount + 1},
+        )
+        .returning(AttachmentBlob)
+    )
+    result = await session.scalars(stmt, execution_options={"populate_existing": True})
+    return result.one()
+
+
+async def release_blobs(session: AsyncSession, blob_ids: list[int]) -> list[str]:
+    """
+    Drop one reference per id (an id may repeat). Blobs nobody references any more
+    are deleted; their files are returned so the caller removes them after commit.
+    """
+    if not blob_ids:
+        return []
+    for blob_id, count in Counter(blob_ids).items():
+        await session.execute(
+            update(AttachmentBlob)
+            .where(AttachmentBlob.id == blob_id)
+            .values(refcount=AttachmentBlob.refcount - count)
+        )
+    result = await session.execute(
+        delete(AttachmentBlob)
+        .where(AttachmentBlob.id.in_(set(blob_ids)), AttachmentBlob.refcount <= 0)
+        .returning(AttachmentBlob.file_path, AttachmentBlob.thumbnail_path)
+    )
+    return [path for row in result.all() for path in row if path is not None]
+
+
+async def add_attachment(session: AsyncSession, stored: StoredFile, message_id: int) -> Attachment:
+    # create an Attachment object (do not commit)
+    blob = await acquire_blob(session, stored.sha256, stored.file_path, stored.size, stored.mimetype)
+    if blob.refcount == 1 and not (stored.written and os.path.exists(os.path.join(UPLOAD_ROOT, stored.file_path))):
+        # The blob save_attachment_files found was released and deleted meanwhile (its file
+        # is unlinked after that commit, maybe not yet): this insert is a new blob, its
+        # content goes to a path of its own.
+        stored.file_path = blob_path(stored.sha256, f".{uuid.uuid4().hex[:12]}{Path(stored.file_path).suffix}")
+        await _run_io(_write_blob, stored.upload, stored.file_path)
+        stored.written = True
+        blob.file_path = stored.file_path
     attachment = Attachment(
         message_id=message_id,
-        file_path=relative_path,  # ✅ только относительный путь
-        filename=original,
-        mimetype=file.content_type or "application/octet-stream",
-        size=size,
+        blob=blob,
+        file_path=blob.file_path,
+        filename=stored.filename,
+        mimetype=stored.mimetype,
+        size=stored.size,
     )
     session.add(attachment)
-    await session.flush()  # to get id
-
     return attachment
@@ -1,10 +1,17 @@
+import asyncio
+import time
+
 import jwt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+from pwdlib.hashers.bcrypt import BcryptHasher
 
 from fastapi import Depends,HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from src.cache import TTLCache
 from src.config import settings
 
 
@@ -12,15 +19,54 @@ SECRET_KEY = settings.AUTH_SECRET_KEY
 ALGORITHM = settings.AUTH_ALGORITHM
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _build_password_hash() -> PasswordHash:
+    # the first hasher makes new hashes, the others only verify (and trigger a rehash on login)
+    argon2 = Argon2Hasher(
+        time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+        memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+        parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+    )
+    bcrypt = BcryptHasher(rounds=settings.PASSWORD_BCRYPT_ROUNDS)
+    if settings.PASSWORD_HASH_ALGORITHM == "bcrypt":
+        return PasswordHash((bcrypt, argon2))
+    return PasswordHash((argon2, bcrypt))
+
+
+password_hash = _build_password_hash()
+# hashing is CPU bound (~100 ms), keep it off the event loop and cap how much can pile up
+password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_jobs = 0
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# verified claims by token, see _verify_token; hits/misses in token_cache.stats()
+token_cache = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_TOKEN_CACHE_TTL)
+
+async def _run_password_job(func, *args):
+    global _password_jobs
+    if _password_jobs >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent login attempts, try again later",
+        )
+    _password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        _password_jobs -= 1
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Returns (valid, new_hash). new_hash is set when the stored hash was made with another
+    algorithm or other parameters than the current settings and should replace it.
+    """
+    return await _run_password_job(password_hash.verify_and_update, plain_password, hashed_password)
+
+
+async def get_password_hash(password: str) -> str:
+    return await _run_password_job(password_hash.hash, password)
 
 def create_token(data: dict, token_expire: int, token_type: str, expires_delta: timedelta | None = None, ) -> str:
     to_encode = data.copy()
@@ -37,9 +83,25 @@ def create_token(data: dict, token_expire: int, token_type: str, expires_delta:
     return encoded_jwt
 
 
+def _verify_token(token: str) -> dict:
+    """
+    Signature check and claims of a token, cached per token string.
+    A cached entry never outlives the token's exp.
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    expires_at = time.monotonic() + (exp - time.time()) if exp is not None else None
+    token_cache.set(token, payload, expires_at=expires_at)
+    return payload
+
+
 def decode_token(token: str, expected_type: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _verify_token(token)
     except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -78,3 +140,4 @@ def get_current_user_id_from_token(token: str = Depends(oauth2_scheme)) -> int:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
+
@@ -24,8 +24,15 @@ async def login(
     result = await session.execute(stmt)
     user = result.scalar_one_or_none()
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+    valid, new_hash = await verify_password(form_data.password, user.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if new_hash:
+        # hashing settings changed since this password was stored
+        user.hashed_password = new_hash
+        await session.commit()
 
     # access_token
     access_token = create_token(
@@ -0,0 +1,748 @@
+"""
+In-process micro-benchmarks of the chat hot paths.
+
+    python -m src.benchmarks fanout --sockets 10,100,1000,5000
+    python -m src.benchmarks writer --messages 5000 --senders 50
+    python -m src.benchmarks login --logins 200 --concurrency 32
+    python -m src.benchmarks uploads --requests 20 --files 3 --size-mb 4
+    python -m src.benchmarks db --operations 2000 --concurrency 10
+    python -m src.benchmarks search --messages 1000000
+    python -m src.benchmarks room-fanout --members 10,100,1000,5000 [--bus fakeredis]
+    python -m src.benchmarks protocol
+
+    fanout       one message event to N sockets through ConnectionManager (LocalBus):
+                 encoded once and shared vs. encoded per socket, and the time until
+                 every socket's writer has sent it
+    writer       messages sent over WebSockets by concurrent senders: one transaction
+                 per message vs. MessageWriter group commit
+    login        concurrent password verifications: inline on the event loop vs. the
+                 password executor, with the event loop lag seen meanwhile
+    uploads      concurrent multi-MB attachment uploads and image thumbnails: written
+                 and resized on the event loop (before) vs. save_attachment_files
+                 and the thumbnail process pool, with the event loop lag seen meanwhile
+    db           single-row insert transactions, history reads and both at once from
+                 concurrent tasks: the engine as it was (echo, driver defaults,
+                 rollback journal) vs. make_engine (pool and WAL pragmas from Settings)
+    search       full-text search (FTS5) of one user's messages in a table of N
+                 messages vs. a LIKE '%word%' scan, for a common, a rare and a prefix term
+    room-fanout  a room message to N connected members: membership queried and one
+                 publish per member awaited by the request (before) vs. the
+                 room_members cache and one pipelined publish in the background;
+                 time until the response and until every socket sent the frame
+    protocol     bytes per frame and encode/decode CPU of JSON text frames vs. the
+                 chat.msgpack.v1 binary subprotocol (needs msgpack)
+
+Each benchmark prints a table. Databases are temporary SQLite files with the
+pragmas of make_engine; nothing touches the configured database, nor the network
+unless a Redis URL is passed with --bus.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+
+from src.config import settings
+
+import logging
+
+
+def parse_ints(value: str) -> list[int]:
+    try:
+        return [int(v) for v in value.split(",") if v]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma separated integers, got {value!r}")
+
+
+def print_table(headers: list[str], rows: list[list]):
+    widths = [max(len(str(x)) for x in column) for column in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print("  ".join(str(x).rjust(w) for x, w in zip(row, widths)))
+
+
+def median_ms(samples: list[float]) -> str:
+    return f"{statistics.median(samples) * 1000:.3f}"
+
+
+@asynccontextmanager
+async def temp_database():
+    """Session maker of a fresh SQLite database with every table of the app."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    import src.attachment.models, src.chat.models, src.room.models, src.user.models  # noqa: F401 (tables)
+    from src.database import Base, make_engine
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}", "bench")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            yield async_sessionmaker(engine, expire_on_commit=False)
+        finally:
+            await engine.dispose()
+
+
+# --- fanout ---------------------------------------------------------------
+
+class _NullSocket:
+    """Accepts every frame immediately, so only the server side is measured."""
+
+    def __init__(self):
+        self.scope = {"type": "websocket", "subprotocols": []}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame: str):
+        pass
+
+    async def send_bytes(self, frame: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def _fanout(sizes: list[int], rounds: int):
+    from src.chat.bus import LocalBus
+    from src.chat.schemas import MessageRead
+    from src.chat.ws_routers import ConnectionManager
+
+    msg = MessageRead(
+        id=1234567, message="See you at the station at 6, I'll bring the tickets",
+        user_id=1, receiver_id=2, created_at=datetime.utcnow(), attachments=[],
+    )
+    rows = []
+    for n in sizes:
+        manager = ConnectionManager(LocalBus(), max_queue=rounds + 1)
+        await manager.start()
+        conns = [await manager.connect(user_id, _NullSocket()) for user_id in range(n)]
+        user_ids = list(range(n))
+
+        once, per_socket, delivered = [], [], []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            await manager.broadcast(msg.model_dump_json(), user_ids, key=msg.id)
+            once.append(time.perf_counter() - started)
+            for conn in conns:
+                await conn.wait_drained()
+            delivered.append(time.perf_counter() - started)
+
+            # what the fan-out did before: a dict per recipient, re-encoded for every socket
+            started = time.perf_counter()
+            for conn in conns:
+                conn.enqueue(json.dumps(msg.model_dump(mode="json")), msg.id)
+            per_socket.append(time.perf_counter() - started)
+            for conn in conns:
+                await conn.wait_drained()
+
+        for conn in conns:
+            conn.stop()
+        await manager.stop()
+        rows.append([
+            n, median_ms(once), median_ms(per_socket), median_ms(delivered),
+            f"{statistics.median(once) / n * 1e6:.2f}",
+        ])
+    print_table(["sockets", "encode once ms", "encode per socket ms", "all sent ms", "us/socket"], rows)
+
+
+# --- writer ---------------------------------------------------------------
+
+async def _writer(messages: int, senders: int, batch_size: int, flush_interval_ms: int):
+    from src.chat.models import Message
+    from src.chat.writer import MessageWriter
+
+    def new_message(i: int) -> Message:
+        return Message(message=f"message {i}", user_id=i % senders + 1, receiver_id=(i + 1) % senders + 1,
+                       created_at=datetime.utcnow())
+
+    async def run(send) -> float:
+        # every sender sends its messages one after the other, like a socket waiting for its ack
+        async def sender(first: int):
+            for i in range(first, messages, senders):
+                await send(new_message(i))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(first) for first in range(senders)))
+        return time.perf_counter() - started
+
+    rows = []
+    async with temp_database() as session_maker:
+        # what the socket loop did before: a transaction (and an fsync) per message,
+        # one at a time since SQLite has a single writer
+        writer = MessageWriter(session_maker, max_batch=1, flush_interval=0, max_pending=1)
+        lock = asyncio.Lock()
+
+        async def send(msg: Message):
+            async with lock:
+                await writer._insert([msg])
+
+        elapsed = await run(send)
+        rows.append(["per message", 1, f"{elapsed:.2f}", f"{messages / elapsed:.0f}"])
+
+    async with temp_database() as session_maker:
+        writer = MessageWriter(session_maker, max_batch=batch_size, flush_interval=flush_interval_ms / 1000,
+                               max_pending=messages)
+        await writer.start()
+
+        async def send(msg: Message):
+            await (await writer.submit(msg))
+
+        elapsed = await run(send)
+        await writer.stop()
+        rows.append(["group commit", batch_size, f"{elapsed:.2f}", f"{messages / elapsed:.0f}"])
+    print_table(["writer", "max batch", "seconds", "messages/s"], rows)
+
+
+# --- login ----------------------------------------------------------------
+
+LAG_INTERVAL = 0.005
+
+
+async def _event_loop_lag(samples: list[float], interval: float = LAG_INTERVAL):
+    """How late a 5 ms timer fires, i.e. how long the loop was blocked."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - expected)
+
+
+async def _stop_lag_ticker(ticker: asyncio.Task):
+    # a ticker blocked by the work being measured records its late wake-up only once
+    # the loop runs again: give it that turn before cancelling it
+    await asyncio.sleep(2 * LAG_INTERVAL)
+    ticker.cancel()
+
+
+def lag_ms(samples: list[float]) -> list[str]:
+    """p99 and max of event loop lag samples."""
+    samples = sorted(samples) or [0.0]
+    return [f"{samples[int(len(samples) * 0.99)] * 1000:.1f}", f"{samples[-1] * 1000:.1f}"]
+
+
+async def _login(logins: int, concurrency: int):
+    from src.auth.authentication_config import password_hash, verify_password
+
+    password = "Super*Pass1"
+    hashed = password_hash.hash(password)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def inline():
+        # what /login did before: the hash computed right on the event loop
+        assert password_hash.verify(password, hashed)
+
+    async def executor():
+        valid, _ = await verify_password(password, hashed)
+        assert valid
+
+    rows = []
+    for name, verify in (("inline", inline), ("executor", executor)):
+        async def login():
+            async with semaphore:
+                await verify()
+
+        lag: list[float] = []
+        ticker = asyncio.create_task(_event_loop_lag(lag))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        await _stop_lag_ticker(ticker)
+        rows.append([name, f"{logins / elapsed:.1f}", f"{elapsed / logins * 1000:.1f}", *lag_ms(lag)])
+    print(f"{settings.PASSWORD_HASH_ALGORITHM}, {settings.PASSWORD_HASH_WORKERS} hash workers, {concurrency} concurrent logins")
+    print_table(["verify", "logins/s", "ms/login", "loop lag p99 ms", "loop lag max ms"], rows)
+
+
+# --- uploads --------------------------------------------------------------
+
+def _upload(content: bytes, filename: str, mimetype: str):
+    from tempfile import SpooledTemporaryFile
+    from fastapi import UploadFile
+    from starlette.datastructures import Headers
+
+    file = SpooledTemporaryFile(max_size=1024 * 1024)  # spooled to disk like a multipart upload
+    file.write(content)
+    file.seek(0)
+    return UploadFile(file=file, filename=filename, headers=Headers({"content-type": mimetype}))
+
+
+def _write_inline(file, upload_root: str):
+    # what create_message did before: the copy in 64 KiB chunks right on the event loop
+    path = os.path.join(upload_root, f"{os.urandom(8).hex()}.bin")
+    file.file.seek(0)
+    with open(path, "wb") as out_f:
+        while chunk := file.file.read(64 * 1024):
+            out_f.write(chunk)
+
+
+def _sample_image(path: str, width: int, height: int):
+    from PIL import Image
+
+    Image.effect_noise((width, height), 64).convert("RGB").save(path, format="JPEG", quality=90)
+
+
+async def _uploads(requests: int, files: int, size_mb: float, images: int):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from src.attachment import utils
+    from src.attachment.imaging import make_thumbnail
+    from src.attachment.utils import save_attachment_files
+
+    size = int(size_mb * 1024 * 1024)
+
+    async def measure(work) -> list:
+        lag: list[float] = []
+        ticker = asyncio.create_task(_event_loop_lag(lag))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await work()
+        elapsed = time.perf_counter() - started
+        await _stop_lag_ticker(ticker)
+        return [f"{elapsed:.2f}", *lag_ms(lag)]
+
+    def new_uploads() -> list[list]:
+        # distinct content, nothing is deduplicated
+        return [[_upload(os.urandom(size), f"file{f}.bin", "application/octet-stream") for f in range(files)]
+                for _ in range(requests)]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        uploads = new_uploads()
+
+        async def inline():
+            async def request(request_files):
+                for file in request_files:
+                    _write_inline(file, directory)
+            await asyncio.gather(*(request(r) for r in uploads))
+
+        rows.append([f"files, {requests} x {files} x {size_mb:g} MB", "inline", *await measure(inline)])
+
+    async with temp_database() as session_maker:
+        with tempfile.TemporaryDirectory() as directory:
+            uploads = new_uploads()
+            upload_root, utils.UPLOAD_ROOT = utils.UPLOAD_ROOT, directory
+            try:
+                async def offloaded():
+                    async def request(request_files):
+                        async with session_maker() as session:
+                            await save_attachment_files(request_files, session)
+                    await asyncio.gather(*(request(r) for r in uploads))
+
+                rows.append(["", "save_attachment_files", *await measure(offloaded)])
+            finally:
+                utils.UPLOAD_ROOT = upload_root
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("Pillow is not installed, thumbnails are not measured")
+        images = 0
+    if images:
+        with tempfile.TemporaryDirectory() as directory:
+            sources = []
+            for i in range(images):
+                sources.append(os.path.join(directory, f"{i}.jpg"))
+                _sample_image(sources[-1], 4000, 3000)
+
+            async def thumbnails_inline():
+                for i, src in enumerate(sources):
+                    make_thumbnail(src, os.path.join(directory, f"inline_{i}.webp"), settings.THUMBNAIL_SIZE)
+
+            executor = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS,
+                                           mp_context=multiprocessing.get_context("spawn"))
+            loop = asyncio.get_running_loop()
+            # workers spawned before measuring, as in the running server
+            await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(settings.THUMBNAIL_WORKERS)))
+
+            async def thumbnails_executor():
+                await asyncio.gather(*(
+                    loop.run_in_executor(executor, make_thumbnail, src, os.path.join(directory, f"pool_{i}.webp"),
+                                         settings.THUMBNAIL_SIZE)
+                    for i, src in enumerate(sources)
+                ))
+
+            try:
+                rows.append([f"thumbnails, {images} x 4000x3000", "inline", *await measure(thumbnails_inline)])
+                rows.append(["", f"{settings.THUMBNAIL_WORKERS} process workers", *await measure(thumbnails_executor)])
+            finally:
+                executor.shutdown()
+    print_table(["work", "runs", "seconds", "loop lag p99 ms", "loop lag max ms"], rows)
+
+
+# --- db -------------------------------------------------------------------
+
+def _baseline_engine(url: str):
+    # what src.database built before make_engine: defaults, every statement echoed
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(url, echo=True)
+    devnull = open(os.devnull, "w")
+    for handler in logging.getLogger("sqlalchemy.engine.Engine").handlers:
+        handler.setStream(devnull)  # formatted and written, as in production, but not to the terminal
+    return engine
+
+
+async def _db(operations: int, concurrency: int, history: int):
+    from sqlalchemy import or_, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from src.chat.models import Message
+    from src.database import Base, make_engine
+
+    import src.attachment.models, src.room.models, src.user.models  # noqa: F401 (tables)
+
+    pairs = [(a, a + 1) for a in range(1, 20, 2)]
+
+    async def write(session_maker, i: int):
+        user_id, receiver_id = pairs[i % len(pairs)]
+        async with session_maker() as session:
+            async with session.begin():
+                session.add(Message(message=f"message {i}", user_id=user_id, receiver_id=receiver_id,
+                                    created_at=datetime.utcnow()))
+
+    async def read(session_maker, i: int):
+        user_id, receiver_id = pairs[i % len(pairs)]
+        async with session_maker() as session:
+            result = await session.execute(
+                select(Message)
+                .where(or_(Message.user_id == user_id, Message.receiver_id == user_id))
+                .order_by(Message.id.desc())
+                .limit(history)
+            )
+            result.scalars().all()
+
+    async def run(tasks) -> float:
+        # `tasks` coroutine factories, `concurrency` of them at a time
+        queue = list(tasks)
+        started = time.perf_counter()
+
+        async def worker():
+            while queue:
+                await queue.pop()()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    rows = []
+    for name, new_engine in (("baseline (echo, defaults)", _baseline_engine),
+                             ("make_engine (WAL, tuned)", lambda url: make_engine(url, "bench"))):
+        logging.disable(logging.NOTSET if name.startswith("baseline") else logging.INFO)
+        with tempfile.TemporaryDirectory() as directory:
+            engine = new_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}")
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+                writes = await run(partial(write, session_maker, i) for i in range(operations))
+                reads = await run(partial(read, session_maker, i) for i in range(operations))
+                # readers and writers at the same time
+                half = operations // 2
+                mixed = await run(
+                    partial(write if i % 2 else read, session_maker, i) for i in range(2 * half)
+                )
+            finally:
+                await engine.dispose()
+        rows.append([name, f"{operations / writes:.0f}", f"{operations / reads:.0f}", f"{2 * half / mixed:.0f}"])
+    logging.disable(logging.INFO)
+    print(f"SQLite file, {concurrency} concurrent tasks, {operations} operations per phase, "
+          f"reads of {history} messages")
+    print_table(["engine", "writes/s", "reads/s", "mixed ops/s"], rows)
+
+
+# --- search ---------------------------------------------------------------
+
+def _vocabulary(size: int, rng) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words)
+
+
+async def _search(messages: int, users: int, queries: int):
+    import random
+    from sqlalchemy import insert, or_, select
+    from src.chat.models import Message
+    from src.chat.search import search_messages
+
+    rng = random.Random(42)
+    vocabulary = _vocabulary(5000, rng)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]  # Zipf-like, as in real text
+    terms = {"common": vocabulary[0], "rare": vocabulary[-1], "prefix": vocabulary[100][:3]}
+
+    async with temp_database() as session_maker:
+        started = time.perf_counter()
+        async with session_maker() as session:
+            for first in range(0, messages, 10000):
+                rows = [
+                    {
+                        "message": " ".join(rng.choices(vocabulary, weights, k=rng.randint(3, 15))),
+                        "user_id": rng.randint(1, users),
+                        "receiver_id": rng.randint(1, users),
+                        "created_at": datetime.utcnow(),
+                    }
+                    for _ in range(first, min(first + 10000, messages))
+                ]
+                await session.execute(insert(Message), rows)  # the triggers fill message_fts
+                await session.commit()
+        print(f"{messages} messages of {users} users inserted and indexed in {time.perf_counter() - started:.1f} s")
+
+        rows = []
+        async with session_maker() as session:
+            for name, term in terms.items():
+                fts, like = [], []
+                hits = 0
+                for i in range(queries):
+                    user_id = i % users + 1
+                    started = time.perf_counter()
+                    hits = len(await search_messages(session, user_id, term, limit=20))
+                    fts.append(time.perf_counter() - started)
+
+                    # without an index: scan the user's messages for the substring
+                    started = time.perf_counter()
+                    await session.execute(
+                        select(Message.id)
+                        .where(or_(Message.user_id == user_id, Message.receiver_id == user_id))
+                        .where(Message.message.like(f"%{term}%"))
+                        .order_by(Message.id.desc())
+                        .limit(21)
+                    )
+                    like.append(time.perf_counter() - started)
+                rows.append([name, term, hits, median_ms(fts), median_ms(like)])
+    print_table(["term", "query", "hits (page)", "fts ms", "LIKE scan ms"], rows)
+
+
+# --- room-fanout ----------------------------------------------------------
+
+class _Deliveries:
+    """Counts the frames the sockets of a benchmark have sent."""
+
+    def __init__(self):
+        self.count = self.expected = 0
+        self.done = asyncio.Event()
+
+    def expect(self, count: int):
+        self.count, self.expected = 0, count
+        self.done.clear()
+
+    def sent(self):
+        self.count += 1
+        if self.count >= self.expected:
+            self.done.set()
+
+
+class _CountingSocket(_NullSocket):
+    def __init__(self, deliveries: _Deliveries):
+        super().__init__()
+        self.deliveries = deliveries
+
+    async def send_text(self, frame: str):
+        self.deliveries.sent()
+
+
+def _bench_bus(url: str):
+    from src.chat.bus import LocalBus, RedisBus
+
+    if url == "memory":
+        return LocalBus()
+    if url == "fakeredis":
+        import fakeredis
+        return RedisBus("redis://", client=fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()))
+    return RedisBus(url)
+
+
+async def _room_fanout(sizes: list[int], messages: int, bus_url: str):
+    from sqlalchemy import insert, select
+    from src.cache import TTLCache
+    from src.chat.ws_routers import ConnectionManager
+    from src.room.models import Room, RoomMember, RoomMessage
+    from src.room.schemas import RoomMessageEvent
+
+    rows = []
+    async with temp_database() as session_maker:
+        for room_id, n in enumerate(sizes, start=1):
+            now = datetime.utcnow()
+            async with session_maker() as session:
+                await session.execute(insert(Room), [{"id": room_id, "name": f"room {n}", "created_by": 1, "created_at": now}])
+                await session.execute(
+                    insert(RoomMember), [{"room_id": room_id, "user_id": u, "joined_at": now} for u in range(1, n + 1)]
+                )
+                await session.commit()
+
+            manager = ConnectionManager(_bench_bus(bus_url), max_queue=messages + 1)
+            await manager.start()
+            deliveries = _Deliveries()
+            conns = [await manager.connect(user_id, _CountingSocket(deliveries)) for user_id in range(1, n + 1)]
+            cache = TTLCache(maxsize=16, ttl=60)
+
+            async def members_from_db() -> frozenset[int]:
+                async with session_maker() as session:
+                    result = await session.execute(select(RoomMember.user_id).where(RoomMember.room_id == room_id))
+                    return frozenset(result.scalars().all())
+
+            async def before(frame: str):
+                # what the endpoint did before: membership queried per message,
+                # one publish per member awaited before the response
+                for user_id in await members_from_db():
+                    await manager.bus.publish(user_id, frame)
+
+            async def after(frame: str):
+                members = cache.get(room_id)
+                if members is None:
+                    members = await members_from_db()
+                    cache.set(room_id, members)
+                manager.fan_out(frame, members)
+
+            timings = []
+            for send in (before, after):
+                responded, delivered = [], []
+                for i in range(messages):
+                    frame = RoomMessageEvent.model_validate(
+                        RoomMessage(id=i + 1, room_id=room_id, user_id=1, message=f"hello {i}", created_at=now)
+                    ).model_dump_json()
+                    deliveries.expect(n)
+                    started = time.perf_counter()
+                    await send(frame)
+                    responded.append(time.perf_counter() - started)
+                    await asyncio.wait_for(deliveries.done.wait(), timeout=60)
+                    delivered.append(time.perf_counter() - started)
+                timings.append((responded, delivered))
+
+            for conn in conns:
+                conn.stop()
+            await manager.stop()
+            (before_responded, before_delivered), (after_responded, after_delivered) = timings
+            rows.append([
+                n, median_ms(before_responded), median_ms(after_responded),
+                median_ms(before_delivered), median_ms(after_delivered),
+            ])
+    print(f"bus: {bus_url}, every member connected")
+    print_table(["members", "before: response ms", "after: response ms", "before: all sent ms",
+                 "after: all sent ms"], rows)
+
+
+# --- protocol -------------------------------------------------------------
+
+def _sample_frames() -> dict[str, dict]:
+    created_at = "2025-10-13T15:08:56.274931"
+    message = {"id": 1234567, "message": "See you at the station at 6, I'll bring the tickets",
+               "user_id": 1042, "receiver_id": 2077, "created_at": created_at, "attachments": []}
+    attachment = {"id": 88123, "message_id": 1234568, "filename": "IMG_2041.jpg", "mimetype": "image/jpeg",
+                  "size": 482113, "file_path": "attachments/88123", "thumbnail_path": "attachments/88123/thumbnail",
+                  "width": 1280, "height": 960}
+    return {
+        "text message": message,
+        "with attachment": {**message, "id": 1234568, "message": "photos", "attachments": [attachment]},
+        "ack": {"type": "ack", "id": 1234567, "created_at": created_at},
+        "typing": {"type": "typing", "user_id": 1042},
+        "presence": {"type": "presence", "users": [{"user_id": u, "status": "online"} for u in range(1040, 1045)]},
+    }
+
+
+def _per_call_us(func, arg, number: int) -> float:
+    import timeit
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=5)) / number * 1e6
+
+
+def _protocol(number: int):
+    from src.chat import protocol
+
+    if protocol.msgpack is None:
+        raise SystemExit("msgpack is not installed")
+    frames = _sample_frames()
+
+    rows = []
+    for name, data in frames.items():
+        text, binary = json.dumps(data), protocol.encode(data)
+        rows.append([name, len(text.encode()), len(binary), f"{len(binary) / len(text.encode()):.0%}"])
+    print_table(["frame", "JSON bytes", "msgpack bytes", "ratio"], rows)
+    print()
+
+    rows = []
+    for name, data in frames.items():
+        text = json.dumps(data)
+        binary = protocol.encode(data)
+        protocol.binary_frame(text)  # what fan-out pays after the first binary socket
+        rows.append([
+            name,
+            f"{_per_call_us(json.dumps, data, number):.2f}",
+            f"{_per_call_us(protocol.encode, data, number):.2f}",
+            f"{_per_call_us(protocol.binary_frame, text, number):.2f}",
+            f"{_per_call_us(json.loads, text, number):.2f}",
+            f"{_per_call_us(protocol.decode, binary, number):.2f}",
+        ])
+    print_table(["frame", "json.dumps us", "msgpack encode us", "binary_frame cached us", "json.loads us",
+                 "msgpack decode us"], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fanout = commands.add_parser("fanout", help="WebSocket fan-out to N sockets")
+    fanout.add_argument("--sockets", type=parse_ints, default=[10, 100, 1000, 5000])
+    fanout.add_argument("--rounds", type=int, default=20)
+
+    writer = commands.add_parser("writer", help="per-message commits vs. group commit")
+    writer.add_argument("--messages", type=int, default=5000)
+    writer.add_argument("--senders", type=int, default=50)
+    writer.add_argument("--batch-size", type=int, default=settings.WS_WRITER_BATCH_SIZE)
+    writer.add_argument("--flush-interval-ms", type=int, default=settings.WS_WRITER_FLUSH_INTERVAL_MS)
+
+    login = commands.add_parser("login", help="password verification throughput and event loop lag")
+    login.add_argument("--logins", type=int, default=200)
+    login.add_argument("--concurrency", type=int, default=32)
+
+    uploads = commands.add_parser("uploads", help="event loop lag during concurrent uploads and thumbnails")
+    uploads.add_argument("--requests", type=int, default=20, help="concurrent upload requests")
+    uploads.add_argument("--files", type=int, default=3, help="files per request")
+    uploads.add_argument("--size-mb", type=float, default=4)
+    uploads.add_argument("--images", type=int, default=8, help="images to thumbnail, 0 to skip")
+
+    db = commands.add_parser("db", help="engine and SQLite pragmas, baseline vs. make_engine")
+    db.add_argument("--operations", type=int, default=2000, help="operations per phase")
+    db.add_argument("--concurrency", type=int, default=10)
+    db.add_argument("--history", type=int, default=50, help="messages per history read")
+
+    search = commands.add_parser("search", help="full-text search vs. LIKE scan on N messages")
+    search.add_argument("--messages", type=int, default=1000000)
+    search.add_argument("--users", type=int, default=100)
+    search.add_argument("--queries", type=int, default=20)
+
+    room_fanout = commands.add_parser("room-fanout", help="room message fan-out through the WS bus")
+    room_fanout.add_argument("--members", type=parse_ints, default=[10, 100, 1000, 5000])
+    room_fanout.add_argument("--messages", type=int, default=50)
+    room_fanout.add_argument("--bus", default="fakeredis", help="memory, fakeredis or a redis:// URL")
+
+    protocol = commands.add_parser("protocol", help="JSON vs. MessagePack frame size and CPU")
+    protocol.add_argument("--number", type=int, default=20000, help="calls per timing")
+
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # connect/disconnect logs would dominate the timings
+
+    if args.command == "fanout":
+        asyncio.run(_fanout(args.sockets, args.rounds))
+    elif args.command == "writer":
+        asyncio.run(_writer(args.messages, args.senders, args.batch_size, args.flush_interval_ms))
+    elif args.command == "login":
+        asyncio.run(_login(args.logins, args.concurrency))
+    elif args.command == "uploads":
+        asyncio.run(_uploads(args.requests, args.files, args.size_mb, args.images))
+    elif args.command == "db":
+        asyncio.run(_db(args.operations, args.concurrency, args.history))
+    elif args.command == "search":
+        asyncio.run(_search(args.messages, args.users, args.queries))
+    elif args.command == "room-fanout":
+        asyncio.run(_room_fanout(args.members, args.messages, args.bus))
+    elif args.command == "protocol":
+        _protocol(args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import abc
+import asyncio
+from typing import Awaitable, Callable, Iterable
+
+import logging
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[int, str, int | None], Awaitable[None]]
+Invalidate = Callable[[str], None]
+
+
+class BaseBus(abc.ABC):
+    """
+    Routes a pre-encoded frame addressed to a user to the process that holds the user's sockets.
+    `deliver(receiver_id, frame, key)` is called in the process owning the sockets,
+    `key` is the optional coalescing key of the frame (message id).
+
+    It also carries cache invalidations: `invalidate(cache, key)` drops the key from the
+    cache registered under that name with `add_invalidator` in every worker.
+    """
+
+    def __init__(self):
+        self._invalidators: dict[str, Invalidate] = {}
+
+    def add_invalidator(self, cache: str, invalidate: Invalidate):
+        self._invalidators[cache] = invalidate
+
+    async def invalidate(self, cache: str, key: str):
+        self._invalidate_local(cache, key)
+
+    def _invalidate_local(self, cache: str, key: str):
+        invalidate = self._invalidators.get(cache)
+        if invalidate is None:
+            return
+        try:
+            invalidate(key)
+        except Exception:
+            logger.exception(f"Failed to invalidate {key!r} in the {cache} cache")
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, user_id: int):
+        pass
+
+    async def unsubscribe(self, user_id: int):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, receiver_id: int, frame: str, key: int | None = None):
+        ...
+
+    async def publish_many(self, receiver_ids: Iterable[int], frame: str, key: int | None = None):
+        """The same frame to several users."""
+        for receiver_id in receiver_ids:
+            await self.publish(receiver_id, frame, key)
+
+
+class LocalBus(BaseBus):
+    """Single worker: every socket lives in this process, deliver directly."""
+
+    async def publish(self, receiver_id: int, frame: str, key: int | None = None):
+        await self._deliver(receiver_id, frame, key)
+
+
+class RedisBus(BaseBus):
+    """
+    Multiple workers/nodes: one Redis pub/sub channel per user.
+    A worker subscribes to a user's channel while it holds at least one of the user's sockets,
+    so a publish reaches only the workers that can deliver it.
+    """
+
+    CHANNEL_PREFIX = "chat:user:"
+    INVALIDATE_CHANNEL = "chat:invalidate"  # every worker is subscribed
+
+    def __init__(self, url: str, client=None):
+        """`client`: an existing redis.asyncio client to use instead of connecting to `url`."""
+        super().__init__()
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("WS_BUS_URL points to Redis but the 'redis' package is not installed")
+            client = redis.from_url(url)
+        self._redis = client
+        self._pubsub = self._redis.pubsub()
+        self._reader: asyncio.Task | None = None
+
+    def _channel(self, user_id: int) -> str:
+        return f"{self.CHANNEL_PREFIX}{user_id}"
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        await self._pubsub.subscribe(self.INVALIDATE_CHANNEL)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def subscribe(self, user_id: int):
+        await self._pubsub.subscribe(self._channel(user_id))
+
+    async def unsubscribe(self, user_id: int):
+        await self._pubsub.unsubscribe(self._channel(user_id))
+
+    async def publish(self, receiver_id: int, frame: str, key: int | None = None):
+        # "{key}|{frame}", the frame itself is forwarded as is
+        await self._redis.publish(self._channel(receiver_id), f"{'' if key is None else key}|{frame}")
+
+    async def publish_many(self, receiver_ids: Iterable[int], frame: str, key: int | None = None):
+        # one pipelined round trip instead of one per receiver
+        data = f"{'' if key is None else key}|{frame}"
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for receiver_id in receiver_ids:
+                pipe.publish(self._channel(receiver_id), data)
+            await pipe.execute()
+
+    async def invalidate(self, cache: str, key: str):
+        # this worker right away, the others (and this one again) through Redis
+        self._invalidate_local(cache, key)
+        await self._redis.publish(self.INVALIDATE_CHANNEL, f"{cache}|{key}")
+
+    async def _read_loop(self):
+        while True:
+            if not self._pubsub.subscribed:
+                # nobody connected to this worker yet
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis bus read failed")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode()
+            if channel == self.INVALIDATE_CHANNEL:
+                cache, key = data.split("|", 1)
+                self._invalidate_local(cache, key)
+                continue
+            receiver_id = int(channel[len(self.CHANNEL_PREFIX):])
+            key, frame = data.split("|", 1)
+            try:
+                await self._deliver(receiver_id, frame, int(key) if key else None)
+            except Exception:
+                logger.exception("Failed to deliver bus message to %s", receiver_id)
+
+
+def create_bus(url: str) -> BaseBus:
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(url)
+    if url.startswith("memory://"):
+        return LocalBus()
+    raise ValueError(f"Unsupported WS_BUS_URL: {url}")
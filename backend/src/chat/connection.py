@@ -0,0 +1,184 @@
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Literal
+
+from fastapi import WebSocket
+
+from src.chat.protocol import binary_frame, decode, encode
+
+import logging
+logger = logging.getLogger(__name__)
+
+SlowConsumerPolicy = Literal["drop_oldest", "coalesce", "disconnect"]
+
+# close code sent to a client that cannot keep up ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# close code sent to a client that stopped answering heartbeats ("Going Away")
+IDLE_CLOSE_CODE = 1001
+
+
+class ClientConnection:
+    """
+    One accepted socket with a bounded outbound queue drained by its own writer task.
+    Frames are already encoded text, shared by every socket they are fanned out to.
+    `enqueue` never awaits, so a slow client only fills its own queue.
+
+    When the queue is full the policy decides:
+    - drop_oldest: evict the oldest queued frame
+    - coalesce: replace a queued frame with the same key (message id), else evict the oldest
+    - disconnect: close the socket, the client reconnects and reloads history
+
+    While a resumed socket replays missed messages, live frames are held back
+    (`hold`/`release`) so they are sent after the replay, minus the ones it covered.
+
+    Frames are queued as JSON text; sockets on the binary protocol (`binary`) get them
+    converted by src.chat.protocol when they are written.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        max_queue: int,
+        policy: SlowConsumerPolicy,
+        counters: Counter,
+        on_close: Callable[["ClientConnection"], Awaitable[None]],
+    ):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.counters = counters
+        self._on_close = on_close
+        self._queue: deque[tuple[int | None, str]] = deque()
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._held: list[tuple[int | None, str]] | None = None
+        self.device_id: str | None = None  # set when the client acks deliveries
+        self.binary = False  # MessagePack subprotocol negotiated
+        self.held_overflow = False
+        self.presence_subscriptions: frozenset[int] = frozenset()
+        # time.monotonic() of the last frame received, and of the last one that was not a "pong"
+        self.last_seen = self.last_active = time.monotonic()
+        self._closing = False
+        self._writer: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def send_json(self, data):
+        """Send directly, bypassing the queue (replies to the client's own frames)."""
+        if self.binary:
+            await self.websocket.send_bytes(encode(data))
+        else:
+            await self.websocket.send_json(data)
+
+    async def receive_json(self):
+        if self.binary:
+            return decode(await self.websocket.receive_bytes())
+        return await self.websocket.receive_json()
+
+    def touch(self, heartbeat: bool = False):
+        """A frame was received from the client."""
+        self.last_seen = time.monotonic()
+        if not heartbeat:
+            self.last_active = self.last_seen
+
+    def hold(self):
+        """Keep live frames aside until release()."""
+        self._held = []
+        self.held_overflow = False
+
+    def release(self, skip_keys: set[int] = frozenset()):
+        """Queue the held frames, except those whose key was already sent by the replay."""
+        held, self._held = self._held or [], None
+        for key, frame in held:
+            if key is None or key not in skip_keys:
+                self.enqueue(frame, key)
+
+    def enqueue(self, frame: str, key: int | None = None):
+        if self._held is not None:
+            if len(self._held) < self.max_queue:
+                self._held.append((key, frame))
+            else:
+                self.held_overflow = True
+            return
+        self.push(frame, key)
+
+    def push(self, frame: str, key: int | None = None):
+        """Queue a frame, bypassing hold()."""
+        if self._closing:
+            return
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.counters["slow_disconnects"] += 1
+                logger.warning(f"User {self.user_id} socket is too slow, disconnecting")
+                self._closing = True
+                self._ready.set()
+                return
+            if self.policy == "coalesce" and self._coalesce(frame, key):
+                self.counters["coalesced"] += 1
+                return
+            self._queue.popleft()
+            self.counters["evicted"] += 1
+        self._queue.append((key, frame))
+        self.counters["enqueued"] += 1
+        self._ready.set()
+
+    def _coalesce(self, frame: str, key: int | None) -> bool:
+        if key is None:
+            return False
+        for i, (queued_key, _) in enumerate(self._queue):
+            if queued_key == key:
+                self._queue[i] = (key, frame)
+                return True
+        return False
+
+    async def wait_drained(self):
+        """Wait until the writer has sent everything queued so far."""
+        while self._queue and not self._closing:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def stop(self):
+        self._closing = True
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._queue.clear()
+        self._drained.set()
+
+    async def close(self, code: int = 1000):
+        self.stop()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue and not self._closing:
+                    _, frame = self._queue.popleft()
+                    if self.binary:
+                        await self.websocket.send_bytes(binary_frame(frame))
+                    else:
+                        await self.websocket.send_text(frame)
+                    self.counters["sent"] += 1
+                self._drained.set()
+                if self._closing:
+                    await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                    await self._on_close(self)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send message to {self.user_id}: {e}")
+            self.counters["send_failures"] += 1
+            await self._on_close(self)
@@ -0,0 +1,193 @@
+from typing import Iterable
+
+from sqlalchemy import case, delete, func, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.chat.models import Conversation, Message
+from src.chat.schemas import ConversationRead
+from src.database import dialect_insert
+
+PREVIEW_LENGTH = 100
+
+
+def canonical_pair(a: int, b: int) -> tuple[int, int]:
+    a, b = int(a), int(b)  # ids from the token are strings
+    return (a, b) if a <= b else (b, a)
+
+
+def _side(user_id: int, low: int) -> str:
+    return "low" if user_id == low else "high"
+
+
+def _preview(text: str) -> str:
+    return text[:PREVIEW_LENGTH]
+
+
+def conversation_view(conv: Conversation, user_id: int) -> ConversationRead:
+    """The conversation as seen by one of its participants."""
+    side = _side(user_id, conv.user_low_id)
+    return ConversationRead(
+        peer_id=conv.user_high_id if side == "low" else conv.user_low_id,
+        last_message_id=conv.last_message_id,
+        last_message_preview=conv.last_message_preview,
+        last_message_at=conv.last_message_at,
+        last_sender_id=conv.last_sender_id,
+        unread=getattr(conv, f"{side}_unread"),
+        last_read_id=getattr(conv, f"{side}_last_read_id"),
+    )
+
+
+async def record_messages(session: AsyncSession, messages: Iterable[Message]):
+    """
+    Fold freshly inserted messages into their conversations.
+    Must run inside the insert transaction after a flush, so the ids are known.
+    """
+    for msg in messages:
+        await _record_message(session, msg)
+
+
+async def _record_message(session: AsyncSession, msg: Message):
+    low, high = canonical_pair(msg.user_id, msg.receiver_id)
+    sender = _side(int(msg.user_id), low)
+    receiver = None if low == high else ("high" if sender == "low" else "low")
+
+    insert = dialect_insert(session)
+    stmt = insert(Conversation).values(
+        user_low_id=low,
+        user_high_id=high,
+        last_message_id=msg.id,
+        last_message_preview=_preview(msg.message),
+        last_message_at=msg.created_at,
+        last_sender_id=int(msg.user_id),
+        low_unread=1 if receiver == "low" else 0,
+        high_unread=1 if receiver == "high" else 0,
+        **{f"{sender}_last_read_id": msg.id},
+    )
+
+    # a concurrent transaction may have committed a newer message already
+    newer = stmt.excluded.last_message_id > Conversation.last_message_id
+
+    def latest(column: str):
+        return case((newer, stmt.excluded[column]), else_=getattr(Conversation, column))
+
+    sender_read = getattr(Conversation, f"{sender}_last_read_id")
+    set_ = {
+        "last_message_id": latest("last_message_id"),
+        "last_message_preview": latest("last_message_preview"),
+        "last_message_at": latest("last_message_at"),
+        "last_sender_id": latest("last_sender_id"),
+        # replying means the sender has seen the conversation
+        f"{sender}_unread": 0,
+        f"{sender}_last_read_id": case(
+            (sender_read.is_(None) | (sender_read < msg.id), msg.id), else_=sender_read
+        ),
+    }
+    if receiver is not None:
+        set_[f"{receiver}_unread"] = getattr(Conversation, f"{receiver}_unread") + 1
+
+    await session.execute(
+        stmt.on_conflict_do_update(index_elements=["user_low_id", "user_high_id"], set_=set_)
+    )
+
+
+async def message_edited(session: AsyncSession, msg: Message):
+    """Refresh the preview if the edited message is the last one of its conversation."""
+    low, high = canonical_pair(msg.user_id, msg.receiver_id)
+    await session.execute(
+        update(Conversation)
+        .where(
+            Conversation.user_low_id == low,
+            Conversation.user_high_id == high,
+            Conversation.last_message_id == msg.id,
+        )
+        .values(last_message_preview=_preview(msg.message))
+    )
+
+
+async def message_deleted(session: AsyncSession, msg: Message):
+    """
+    Undo a deleted message in its conversation: drop it from the receiver's unread counter
+    and, if it was the last message, fall back to the newest remaining one.
+    Call after the delete is flushed.
+    """
+    low, high = canonical_pair(msg.user_id, msg.receiver_id)
+    conv = (await session.execute(
+        select(Conversation)
+        .where(Conversation.user_low_id == low, Conversation.user_high_id == high)
+        .with_for_update()
+    )).scalar_one_or_none()
+    if conv is None:
+        return
+
+    if low != high:
+        receiver = _side(int(msg.receiver_id), low)
+        last_read = getattr(conv, f"{receiver}_last_read_id")
+        unread = getattr(conv, f"{receiver}_unread")
+        if (last_read is None or msg.id > last_read) and unread > 0:
+            setattr(conv, f"{receiver}_unread", unread - 1)
+
+    if conv.last_message_id != msg.id:
+        return
+
+    def newest(sender: int, receiver: int):
+        return (
+            select(Message)
+            .where(Message.user_id == sender, Message.receiver_id == receiver)
+            .order_by(Message.id.desc())
+            .limit(1)
+        )
+
+    candidates = [(await session.execute(newest(low, high))).scalar_one_or_none()]
+    if low != high:
+        candidates.append((await session.execute(newest(high, low))).scalar_one_or_none())
+    candidates = [m for m in candidates if m is not None]
+    if not candidates:
+        await session.execute(delete(Conversation).where(Conversation.id == conv.id))
+        return
+
+    last = max(candidates, key=lambda m: m.id)
+    conv.last_message_id = last.id
+    conv.last_message_preview = _preview(last.message)
+    conv.last_message_at = last.created_at
+    conv.last_sender_id = last.user_id
+    for side in ("low", "high"):
+        # keep read pointers inside the conversation, ids of deleted rows may be reused
+        if (getattr(conv, f"{side}_last_read_id") or 0) > last.id:
+            setattr(conv, f"{side}_last_read_id", last.id)
+
+
+async def mark_read(session: AsyncSession, user_id: int, peer_id: int, up_to: int) -> Conversation | None:
+    """
+    Move the user's read pointer forward to `up_to` (capped at the last message)
+    and recount what is still unread. The pointer never moves backwards.
+    """
+    low, high = canonical_pair(user_id, peer_id)
+    side = _side(user_id, low)
+    last_read = getattr(Conversation, f"{side}_last_read_id")
+    read_to = case((Conversation.last_message_id < up_to, Conversation.last_message_id), else_=up_to)
+
+    if low == high:
+        unread = literal(0)
+    else:
+        # index range scan on (user_id, receiver_id, id)
+        unread = (
+            select(func.count(Message.id))
+            .where(Message.user_id == peer_id, Message.receiver_id == user_id, Message.id > up_to)
+            .scalar_subquery()
+        )
+
+    await session.execute(
+        update(Conversation)
+        .where(
+            Conversation.user_low_id == low,
+            Conversation.user_high_id == high,
+            last_read.is_(None) | (last_read < read_to),
+        )
+        .values({f"{side}_last_read_id": read_to, f"{side}_unread": unread})
+        .execution_options(synchronize_session=False)
+    )
+    return (await session.execute(
+        select(Conversation)
+        .where(Conversation.user_low_id == low, Conversation.user_high_id == high)
+        .execution_options(populate_existing=True)
+    )).scalar_one_or_none()
@@ -0,0 +1,198 @@
+"""
+Store-and-forward delivery.
+
+Every message gets a pending_delivery row for its receiver in the transaction that
+inserts it. Devices connect with /ws?device_id=<id> and acknowledge what they got with
+{"type": "ack", "up_to": <message id>} (cumulative); on connect the rows after the
+device's cursor are flushed in batches, like a resume (src.chat.resume).
+
+Acks only update memory, the cursors are upserted in one transaction every
+DELIVERY_ACK_FLUSH_MS. A background task deletes, in batches, rows every device of
+the receiver acked, rows older than DELIVERY_RETENTION_HOURS and cursors of devices
+not seen for as long.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from src.chat.models import DeliveryCursor, Message, PendingDelivery
+from src.config import settings
+from src.database import async_session_maker, dialect_insert
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAX_DEVICE_ID_LENGTH = 64
+
+
+async def record_pending(session: AsyncSession, messages: list[Message]):
+    """Log the messages for their receivers, in the caller's transaction (after flush)."""
+    await session.execute(
+        insert(PendingDelivery),
+        [{"user_id": int(msg.receiver_id), "message_id": msg.id, "created_at": msg.created_at} for msg in messages],
+    )
+
+
+async def pending_messages(user_id: int, after: int, limit: int) -> list[Message]:
+    """Logged messages of a receiver after a message id, oldest first (deleted ones are skipped)."""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(Message)
+            .join(PendingDelivery, PendingDelivery.message_id == Message.id)
+            .where(PendingDelivery.user_id == user_id, PendingDelivery.message_id > after)
+            .order_by(PendingDelivery.message_id)
+            .limit(limit)
+            .options(selectinload(Message.attachments))
+        )
+        return list(result.scalars().all())
+
+
+class DeliveryTracker:
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        ack_flush_interval: float,
+        compact_interval: float,
+        compact_batch: int,
+        retention: timedelta,
+    ):
+        self._session_maker = session_maker
+        self.ack_flush_interval = ack_flush_interval
+        self.compact_interval = compact_interval
+        self.compact_batch = compact_batch
+        self.retention = retention
+        self._acks: dict[tuple[int, str], int] = {}  # not flushed yet
+        self._tasks: list[asyncio.Task] = []
+        self.counters: Counter = Counter()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._compact_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    def ack(self, user_id: int, device_id: str, up_to: int):
+        key = (user_id, device_id)
+        if up_to > self._acks.get(key, 0):
+            self._acks[key] = up_to
+        self.counters["acks"] += 1
+
+    async def cursor(self, user_id: int, device_id: str) -> int:
+        """Last message id acked by the device, 0 for a new device (gets everything still logged)."""
+        async with self._session_maker() as session:
+            acked = await session.scalar(
+                select(DeliveryCursor.acked_message_id)
+                .where(DeliveryCursor.user_id == user_id, DeliveryCursor.device_id == device_id)
+            )
+        return max(acked or 0, self._acks.get((user_id, device_id), 0))
+
+    async def flush(self):
+        if not self._acks:
+            return
+        acks, self._acks = self._acks, {}
+        try:
+            await self._store(acks)
+        except Exception:
+            logger.exception(f"Failed to store {len(acks)} delivery cursors, retrying one by one")
+            for key, up_to in acks.items():
+                try:
+                    await self._store({key: up_to})
+                except Exception as e:
+                    # dropped, not retried forever: the device gets these messages again on connect
+                    logger.warning(f"Dropped the delivery cursor of user {key[0]}, device {key[1]!r}: {e!r}")
+
+    async def _store(self, acks: dict[tuple[int, str], int]):
+        now = datetime.utcnow()
+        async with self._session_maker() as session:
+            async with session.begin():
+                # a cursor never points past the newest message
+                newest = await session.scalar(select(func.max(Message.id))) or 0
+                stmt = dialect_insert(session)(DeliveryCursor)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[DeliveryCursor.user_id, DeliveryCursor.device_id],
+                        set_={
+                            # acks of one device may be flushed by two workers out of order
+                            "acked_message_id": case(
+                                (stmt.excluded.acked_message_id > DeliveryCursor.acked_message_id,
+                                 stmt.excluded.acked_message_id),
+                                else_=DeliveryCursor.acked_message_id,
+                            ),
+                            "updated_at": stmt.excluded.updated_at,
+                        },
+                    ),
+                    [
+                        {"user_id": user_id, "device_id": device_id, "acked_message_id": min(up_to, newest),
+                         "updated_at": now}
+                        for (user_id, device_id), up_to in acks.items()
+                    ],
+                )
+
+    async def compact(self) -> int:
+        """Delete acked and expired log rows and stale cursors; returns the number of log rows deleted."""
+        cutoff = datetime.utcnow() - self.retention
+        async with self._session_maker() as session:
+            async with session.begin():
+                await session.execute(delete(DeliveryCursor).where(DeliveryCursor.updated_at < cutoff))
+
+        acked_by_all = PendingDelivery.message_id <= (
+            select(func.min(DeliveryCursor.acked_message_id))
+            .where(DeliveryCursor.user_id == PendingDelivery.user_id)
+            .scalar_subquery()
+        )
+        deleted = 0
+        for condition in (PendingDelivery.created_at < cutoff, acked_by_all):
+            while True:
+                # short transactions, message inserts are not blocked for long
+                async with self._session_maker() as session:
+                    async with session.begin():
+                        keys = (await session.execute(
+                            select(PendingDelivery.user_id, PendingDelivery.message_id)
+                            .where(condition)
+                            .limit(self.compact_batch)
+                        )).all()
+                        if keys:
+                            await session.execute(
+                                delete(PendingDelivery)
+                                .where(tuple_(PendingDelivery.user_id, PendingDelivery.message_id).in_(keys))
+                            )
+                deleted += len(keys)
+                if len(keys) < self.compact_batch:
+                    break
+                await asyncio.sleep(0)
+        self.counters["compacted"] += deleted
+        return deleted
+
+    def stats(self) -> dict:
+        return {"unflushed_acks": len(self._acks), **self.counters}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.ack_flush_interval)
+            await self.flush()
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                deleted = await self.compact()
+                if deleted:
+                    logger.info(f"Compacted {deleted} delivered messages from the delivery log")
+            except Exception:
+                logger.exception("Delivery log compaction failed")
+
+
+delivery_tracker = DeliveryTracker(
+    async_session_maker,
+    ack_flush_interval=settings.DELIVERY_ACK_FLUSH_MS / 1000,
+    compact_interval=settings.DELIVERY_COMPACT_INTERVAL_SECONDS,
+    compact_batch=settings.DELIVERY_COMPACT_BATCH_SIZE,
+    retention=timedelta(hours=settings.DELIVERY_RETENTION_HOURS),
+)
@@ -0,0 +1,123 @@
+"""
+Ephemeral WebSocket events: typing, stop_typing and read receipts.
+
+Typing events are forwarded to the peer through the connection manager at most once per
+WS_TYPING_INTERVAL_MS for a (sender, peer) pair and never stored. "read" events only
+raise an in-memory pointer; every WS_READ_FLUSH_MS the pointers are stored with
+mark_read in one transaction (one per pointer if that fails, so a bad pointer only
+loses itself) and the peers get one receipt per conversation.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.cache import TTLCache
+from src.chat.conversations import canonical_pair, mark_read
+from src.database import mark_written
+
+import logging
+logger = logging.getLogger(__name__)
+
+Send = Callable[[str, int], Awaitable[None]]  # (frame, receiver_id)
+
+MAX_TYPING_PAIRS = 100000
+
+
+class EphemeralEvents:
+    def __init__(self, send: Send, session_maker: async_sessionmaker, typing_interval: float, read_flush_interval: float):
+        self._send = send
+        self._session_maker = session_maker
+        self.typing_interval = typing_interval
+        self.read_flush_interval = read_flush_interval
+        # (sender, peer) -> monotonic time the last typing event was forwarded
+        self._typing = TTLCache(MAX_TYPING_PAIRS, ttl=typing_interval * 3)
+        self._reads: dict[tuple[int, int], int] = {}  # (reader, peer) -> up_to, not stored yet
+        self._task: asyncio.Task | None = None
+        self.counters: Counter = Counter()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush_reads()
+
+    async def typing(self, user_id: int, peer_id: int):
+        now = time.monotonic()
+        last = self._typing.get((user_id, peer_id))
+        if last is not None and now - last < self.typing_interval:
+            self.counters["coalesced"] += 1
+            return
+        self._typing.set((user_id, peer_id), now)
+        await self._forward({"type": "typing", "user_id": user_id}, peer_id)
+
+    async def stop_typing(self, user_id: int, peer_id: int):
+        # the peer shows nothing unless a typing event was forwarded lately
+        if self._typing.get((user_id, peer_id)) is None:
+            self.counters["coalesced"] += 1
+            return
+        self._typing.pop((user_id, peer_id))
+        await self._forward({"type": "stop_typing", "user_id": user_id}, peer_id)
+
+    def read(self, user_id: int, peer_id: int, up_to: int):
+        key = (user_id, peer_id)
+        if up_to > self._reads.get(key, 0):
+            self._reads[key] = up_to
+        else:
+            self.counters["coalesced"] += 1
+
+    async def flush_reads(self):
+        if not self._reads:
+            return
+        reads, self._reads = self._reads, {}
+        try:
+            receipts = await self._store_reads(reads)
+        except Exception:
+            logger.exception(f"Failed to store {len(reads)} read pointers, retrying one by one")
+            receipts = []
+            for key, up_to in reads.items():
+                try:
+                    receipts += await self._store_reads({key: up_to})
+                except Exception as e:
+                    logger.warning(f"Dropped the read pointer of user {key[0]} for peer {key[1]}: {e!r}")
+        for user_id, peer_id, last_read_id in receipts:
+            await mark_written(user_id)
+            await self._forward({"type": "read", "user_id": user_id, "up_to": last_read_id}, peer_id)
+
+    async def _store_reads(self, reads: dict[tuple[int, int], int]) -> list[tuple[int, int, int]]:
+        """mark_read for every pair in one transaction; (reader, peer, stored pointer) per conversation."""
+        receipts = []
+        async with self._session_maker() as session:
+            async with session.begin():
+                for (user_id, peer_id), up_to in reads.items():
+                    conv = await mark_read(session, user_id, peer_id, up_to)
+                    if conv is None:
+                        continue
+                    low, _ = canonical_pair(user_id, peer_id)
+                    side = "low" if user_id == low else "high"
+                    receipts.append((user_id, peer_id, getattr(conv, f"{side}_last_read_id")))
+        return receipts
+
+    def stats(self) -> dict:
+        return {"typing_pairs": len(self._typing), "unflushed_reads": len(self._reads), **self.counters}
+
+    async def _forward(self, event: dict, peer_id: int):
+        self.counters["forwarded"] += 1
+        try:
+            await self._send(json.dumps(event), peer_id)
+        except Exception:
+            logger.exception(f"Failed to forward a {event['type']} event")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.read_flush_interval)
+            await self.flush_reads()
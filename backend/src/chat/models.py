@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, TIMESTAMP, ForeignKey
+from sqlalchemy import DDL, Integer, String, TIMESTAMP, ForeignKey, Index, UniqueConstraint, event
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from datetime import datetime
@@ -19,3 +19,95 @@ class Message(Base):
         back_populates="message",
         cascade="all, delete-orphan",
     )
+
+    __table_args__ = (
+        # keyset pagination of a conversation: (author, receiver) range scan ordered by id
+        Index("ix_message_user_id_receiver_id_id", "user_id", "receiver_id", "id"),
+        # everything a user sent / received after a message id (WebSocket resume)
+        Index("ix_message_user_id_id", "user_id", "id"),
+        Index("ix_message_receiver_id_id", "receiver_id", "id"),
+    )
+
+
+
+# Full-text index of message text, maintained by the database itself.
+# SQLite: external-content FTS5 table kept in sync by triggers.
+# Postgres: GIN index on the tsvector expression used by the search query.
+MESSAGE_FTS_TABLE = "message_fts"
+MESSAGE_TS_CONFIG = "simple"  # no stemming: chats mix languages
+
+MESSAGE_FTS_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "message, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, message) VALUES (new.id, new.message); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, message) VALUES ('delete', old.id, old.message); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF message ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+    "INSERT INTO message_fts(rowid, message) VALUES (new.id, new.message); END",
+]
+MESSAGE_FTS_POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_message_message_tsv ON message "
+    f"USING gin (to_tsvector('{MESSAGE_TS_CONFIG}'::regconfig, message))",
+]
+
+for _statement in MESSAGE_FTS_SQLITE_DDL:
+    event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+event.listen(Message.__table__, "before_drop", DDL("DROP TABLE IF EXISTS message_fts").execute_if(dialect="sqlite"))
+for _statement in MESSAGE_FTS_POSTGRES_DDL:
+    event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+
+
+class Conversation(Base):
+    """
+    Inbox entry of a one-to-one dialog, keyed by the canonical pair user_low_id < user_high_id
+    (equal for notes to self). Maintained in the same transaction as every message insert,
+    so the sidebar is read from here instead of from the message table.
+    """
+    __tablename__ = "conversation"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_low_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), nullable=False)
+    user_high_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), nullable=False)
+
+    last_message_id: Mapped[int] = mapped_column(Integer, nullable=False)  # no FK: kept after deletes until recomputed
+    last_message_preview: Mapped[str] = mapped_column(String(length=100), nullable=False, default="")
+    last_message_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False)
+    last_sender_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    # per participant: messages from the other side not read yet and the last message id read
+    low_unread: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    high_unread: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    low_last_read_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    high_last_read_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_low_id", "user_high_id", name="uq_conversation_pair"),
+        # the inbox of a user is a range scan on each side, newest first
+        Index("ix_conversation_low_last_message", "user_low_id", "last_message_id"),
+        Index("ix_conversation_high_last_message", "user_high_id", "last_message_id"),
+    )
+
+
+class PendingDelivery(Base):
+    """
+    Store-and-forward log: one row per message and receiver, written with the message.
+    Rows up to the lowest delivery cursor of the receiver's devices are compacted away.
+    """
+    __tablename__ = "pending_delivery"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), primary_key=True)  # receiver
+    message_id: Mapped[int] = mapped_column(Integer, primary_key=True)  # no FK: deleted messages are skipped on flush
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_pending_delivery_created_at", "created_at"),
+    )
+
+
+class DeliveryCursor(Base):
+    """Highest message id a device acknowledged over /ws (acks are cumulative)."""
+    __tablename__ = "delivery_cursor"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(length=64), primary_key=True)
+    acked_message_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
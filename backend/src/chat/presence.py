@@ -0,0 +1,128 @@
+"""
+Presence of users: online, away or offline, pushed to the sockets that subscribed to them.
+
+A socket subscribes with {"type": "presence_subscribe", "user_ids": [...]} (at most
+PRESENCE_MAX_SUBSCRIPTIONS ids, each call replaces the previous set) and gets a snapshot
+right away. Afterwards the watched users are sampled every PRESENCE_FLUSH_MS and every
+subscriber gets the changes that concern it in a single {"type": "presence"} frame.
+Sampling instead of reacting to each connect/disconnect is the debounce: a socket that
+reconnects within the interval, or a user who goes offline for less than
+PRESENCE_OFFLINE_GRACE_SECONDS, produces no update at all.
+
+State is derived from the sockets of this worker: online with at least one socket that
+sent something else than a "pong" within PRESENCE_AWAY_AFTER_SECONDS, away with sockets
+that only answer heartbeats.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Iterable, Literal
+
+from src.chat.connection import ClientConnection
+
+import logging
+logger = logging.getLogger(__name__)
+
+PresenceStatus = Literal["online", "away", "offline"]
+
+
+class PresenceTracker:
+    def __init__(
+        self,
+        connections: dict[int, list[ClientConnection]],
+        max_subscriptions: int,
+        flush_interval: float,
+        away_after: float,
+        offline_grace: float,
+    ):
+        self._connections = connections  # ConnectionManager.active_connections
+        self.max_subscriptions = max_subscriptions
+        self.flush_interval = flush_interval
+        self.away_after = away_after
+        self.offline_grace = offline_grace
+        self._watchers: dict[int, set[ClientConnection]] = {}  # watched user -> subscribed sockets
+        self._published: dict[int, PresenceStatus] = {}  # last status sent for a watched user
+        self._last_connected: dict[int, float] = {}  # watched user -> last time seen with a socket
+        self._task: asyncio.Task | None = None
+        self.counters: Counter = Counter()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def status(self, user_id: int, now: float) -> PresenceStatus:
+        conns = self._connections.get(user_id)
+        if conns:
+            self._last_connected[user_id] = now
+            if now - max(conn.last_active for conn in conns) > self.away_after:
+                return "away"
+            return "online"
+        last = self._last_connected.get(user_id)
+        if last is not None and now - last < self.offline_grace:
+            # briefly disconnected: keep what was announced, a reconnect is likely
+            return self._published.get(user_id, "offline")
+        return "offline"
+
+    def subscribe(self, conn: ClientConnection, user_ids: Iterable[int]) -> bool:
+        """Replace the socket's subscriptions and queue a snapshot; False when over the limit."""
+        user_ids = frozenset(user_ids)
+        if len(user_ids) > self.max_subscriptions:
+            return False
+        self.unsubscribe(conn)
+        conn.presence_subscriptions = user_ids
+        for user_id in user_ids:
+            self._watchers.setdefault(user_id, set()).add(conn)
+        now = time.monotonic()
+        snapshot = []
+        for user_id in sorted(user_ids):
+            status = self.status(user_id, now)
+            self._published.setdefault(user_id, status)
+            snapshot.append({"user_id": user_id, "status": status})
+        conn.enqueue(json.dumps({"type": "presence", "users": snapshot}))
+        return True
+
+    def unsubscribe(self, conn: ClientConnection):
+        for user_id in conn.presence_subscriptions:
+            watchers = self._watchers.get(user_id)
+            if watchers is None:
+                continue
+            watchers.discard(conn)
+            if not watchers:
+                del self._watchers[user_id]
+                self._published.pop(user_id, None)
+                self._last_connected.pop(user_id, None)
+        conn.presence_subscriptions = frozenset()
+
+    def flush(self):
+        now = time.monotonic()
+        updates: dict[ClientConnection, list[dict]] = {}
+        for user_id, watchers in self._watchers.items():
+            status = self.status(user_id, now)
+            if self._published.get(user_id) == status:
+                continue
+            self._published[user_id] = status
+            change = {"user_id": user_id, "status": status}
+            for conn in watchers:
+                updates.setdefault(conn, []).append(change)
+        for conn, changes in updates.items():
+            conn.enqueue(json.dumps({"type": "presence", "users": changes}))
+        self.counters["frames"] += len(updates)
+
+    def stats(self) -> dict:
+        return {"watched_users": len(self._watchers), **self.counters}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
@@ -0,0 +1,112 @@
+"""
+Compact binary WebSocket protocol.
+
+Clients that offer the `chat.msgpack.v1` subprotocol on /ws get MessagePack binary
+frames instead of JSON text: keys are replaced by the small integers of FIELD_IDS and
+ISO timestamps by integer milliseconds since the epoch (UTC). They send their frames
+the same way; unknown keys are kept as strings in both directions. Clients that offer
+nothing (or only "chat.json.v1") keep the JSON protocol.
+
+Frames are encoded to JSON once for fan-out, the binary form is derived from that text
+and cached, so a frame going to many binary sockets is converted once per worker.
+
+msgpack is optional: without it the subprotocol is never accepted.
+"""
+import json
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SUBPROTOCOL_MSGPACK = "chat.msgpack.v1"
+SUBPROTOCOL_JSON = "chat.json.v1"
+FRAME_CACHE_SIZE = 1024
+
+# append only: ids are part of the protocol
+FIELD_IDS = {
+    "type": 0,
+    "id": 1,
+    "message": 2,
+    "user_id": 3,
+    "receiver_id": 4,
+    "created_at": 5,
+    "attachments": 6,
+    "error": 7,
+    "details": 8,
+    "up_to": 9,
+    "room_id": 10,
+    "users": 11,
+    "status": 12,
+    "last_message_id": 13,
+    "replayed": 14,
+    "reason": 15,
+    "files": 16,
+    "user_ids": 17,
+    "message_id": 18,
+    "filename": 19,
+    "mimetype": 20,
+    "size": 21,
+    "file_path": 22,
+    "thumbnail_path": 23,
+    "width": 24,
+    "height": 25,
+}
+FIELD_NAMES = {field_id: name for name, field_id in FIELD_IDS.items()}
+TIMESTAMP_FIELDS = frozenset({"created_at", "last_message_at"})
+
+
+def negotiate(offered: list[str]) -> str | None:
+    """Subprotocol to accept among the ones offered by the client."""
+    if msgpack is not None and SUBPROTOCOL_MSGPACK in offered:
+        return SUBPROTOCOL_MSGPACK
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
+
+
+def _epoch_ms(value: str) -> int | str:
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)  # stored as naive UTC
+    return int(dt.timestamp() * 1000)
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            FIELD_IDS.get(key, key): _epoch_ms(item) if key in TIMESTAMP_FIELDS and isinstance(item, str)
+            else _compact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def _expand(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {FIELD_NAMES.get(key, key): _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def encode(data: Any) -> bytes:
+    return msgpack.packb(_compact(data))
+
+
+def decode(raw: bytes) -> Any:
+    return _expand(msgpack.unpackb(raw, strict_map_key=False))
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def binary_frame(frame: str) -> bytes:
+    """The binary form of an encoded JSON frame (cached: fan-out sends the same str to every socket)."""
+    return encode(json.loads(frame))
@@ -0,0 +1,80 @@
+import json
+
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import selectinload
+
+from typing import Awaitable, Callable
+
+from src.chat.connection import ClientConnection
+from src.chat.models import Message
+from src.chat.schemas import MessageRead
+from src.config import settings
+from src.database import async_session_maker
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+async def missed_messages(user_id: int, after: int, limit: int) -> list[Message]:
+    # Sent and received messages are two index range scans, on (user_id, id)
+    # and (receiver_id, id); each side reads at most `limit` rows.
+    def side(column):
+        stmt = select(Message.id).where(column == user_id, Message.id > after).order_by(Message.id).limit(limit)
+        return select(stmt.subquery().c.id)
+
+    ids = union_all(side(Message.user_id), side(Message.receiver_id)).subquery()
+    # always the primary: a lagging replica would leave a gap
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(Message)
+            .where(Message.id.in_(select(ids.c.id)))
+            .order_by(Message.id)
+            .limit(limit)
+            .options(selectinload(Message.attachments))
+        )
+        return list(result.scalars().all())
+
+
+async def replay_missed(
+    conn: ClientConnection,
+    last_seen_message_id: int,
+    fetch: Callable[[int, int, int], Awaitable[list[Message]]] = missed_messages,
+):
+    """
+    Send a resumed socket every message of its user newer than `last_seen_message_id`
+    (as returned by `fetch(user_id, after, limit)`), oldest first, then the live frames held back meanwhile (conn.hold()) that the replay
+    did not already cover, and finally {"type": "resumed"}.
+    The replay waits for each batch to be written before reading the next one.
+    """
+    replayed: set[int] = set()
+    cursor = last_seen_message_id
+    batch_size = settings.WS_RESUME_BATCH_SIZE
+    try:
+        while True:
+            if len(replayed) >= settings.WS_RESUME_MAX_MESSAGES:
+                # cheaper for the client to reload the history than to get everything one by one
+                logger.info(f"User {conn.user_id} missed over {len(replayed)} messages, asking for a resync")
+                conn.release(replayed)
+                conn.push(json.dumps({"type": "resync", "reason": "too_many_missed"}))
+                return
+            messages = await fetch(conn.user_id, cursor, batch_size)
+            for msg in messages:
+                conn.push(MessageRead.model_validate(msg).model_dump_json(), msg.id)
+                replayed.add(msg.id)
+            if messages:
+                cursor = messages[-1].id
+            await conn.wait_drained()
+            if len(messages) < batch_size:
+                break
+    except Exception:
+        logger.exception(f"Resume of user {conn.user_id} failed")
+        conn.release(replayed)
+        conn.push(json.dumps({"type": "resync", "reason": "replay_failed"}))
+        return
+
+    overflow = conn.held_overflow
+    conn.release(replayed)
+    if overflow:
+        conn.push(json.dumps({"type": "resync", "reason": "too_many_live"}))
+        return
+    conn.push(json.dumps({"type": "resumed", "last_message_id": cursor, "replayed": len(replayed)}))
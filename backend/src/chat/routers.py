@@ -1,26 +1,47 @@
-from fastapi import UploadFile, File, Depends, APIRouter, HTTPException, Form
-from typing import List
+from fastapi import UploadFile, File, Depends, APIRouter, HTTPException, Form, Query
+from typing import List, Optional
 from datetime import datetime
 
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from src.attachment.models import THUMBNAIL_PENDING
+from src.attachment.routers import invalidate_attachment_access
 from src.attachment.schemas import AttachmentBase, AttachmentRead
-from src.attachment.utils import save_attachment
+from src.attachment.thumbnails import thumbnail_pipeline
+from src.attachment.utils import (
+    add_attachment, discard_blob_files, discard_unreferenced_files, release_blobs, save_attachment_files,
+)
 
-from src.chat.models import Message
-from src.chat.schemas import MessageCreate, MessageRead, MessageUpdate
+from src.chat.conversations import (
+    conversation_view, mark_read, message_deleted, message_edited, record_messages,
+)
+from src.chat.delivery import record_pending
+from src.chat.models import Conversation, Message
+from src.chat.schemas import (
+    ConversationPage, ConversationRead, MessageCreate, MessageRead, MessageUpdate, MessagePage, ReadMarker,
+    SearchHit, SearchPage,
+)
+from src.chat.search import search_messages
+from src.chat.utils import CURSOR_AFTER, CURSOR_BEFORE, decode_cursor, encode_cursor
 from src.chat.ws_routers import manager
 
-from src.database import get_async_session
-from src.user.manager import get_current_user_id
+from src.database import get_async_session, mark_written
+from src.user.manager import get_current_user_id, get_read_session
 
 
 import logging
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+CONVERSATIONS_PAGE_SIZE = 50
+CONVERSATIONS_MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
 
 @router.post("/messages", response_model=MessageRead)
 async def create_message(
@@ -30,20 +51,33 @@ async def create_message(
     user_id: int = Depends(get_current_user_id),
     session: AsyncSession = Depends(get_async_session),
 ):
-    async with session.begin():
-        msg = Message(
-            message=message,
-            user_id=user_id,
-            receiver_id=receiver_id,
-            created_at=datetime.utcnow(),
-        )
-        session.add(msg)
-        await session.flush()
-
-        attachments: list[AttachmentRead] = []
-        for f in files:
-            att = await save_attachment(f, msg.id, session, user_id)
-            attachments.append(AttachmentRead.model_validate(att))
+    # files are on disk before the write transaction opens
+    stored = await save_attachment_files(files, session)
+    try:
+        async with session.begin():
+            msg = Message(
+                message=message,
+                user_id=user_id,
+                receiver_id=receiver_id,
+                created_at=datetime.utcnow(),
+            )
+            session.add(msg)
+            await session.flush()
+
+            atts = [await add_attachment(session, s, msg.id) for s in stored]
+            await session.flush()  # to get ids
+            await record_messages(session, [msg])
+            await record_pending(session, [msg])
+            attachments: list[AttachmentRead] = [AttachmentRead.model_validate(att) for att in atts]
+    except Exception:
+        # nothing references the files this request wrote
+        await discard_unreferenced_files(session, stored)
+        raise
+
+    await mark_written(user_id)
+    for att in atts:
+        if att.blob.thumbnail_status == THUMBNAIL_PENDING:
+            thumbnail_pipeline.submit(att.blob.id)
 
     msg_read = MessageRead.model_validate({
         "id": msg.id,
@@ -55,8 +89,9 @@ async def create_message(
     })
 
     try:
-        await manager.send_personal_message(data=msg_read.model_dump(), receiver_id=receiver_id)
-        await manager.send_personal_message(data=msg_read.model_dump(), receiver_id=user_id)
+        # encoded once, the same frame goes to every socket of both participants
+        frame = msg_read.model_dump_json()
+        await manager.broadcast(frame, (receiver_id, user_id), key=msg_read.id)
     except Exception:
         logger.exception("WS broadcast failed")
 
@@ -81,8 +116,10 @@ async def update_message(
 
     if message_data.message is not None:
         msg.message = message_data.message
+        await message_edited(session, msg)
 
     await session.commit()
+    await mark_written(user_id)
 
     return MessageRead.model_validate({
         "id": msg.id,
@@ -101,35 +138,162 @@ async def delete_message(
     session: AsyncSession = Depends(get_async_session),
 ):
     result = await session.execute(
-        select(Message).where(Message.id == message_id, Message.user_id == user_id)
+        select(Message)
+        .where(Message.id == message_id, Message.user_id == user_id)
+        .options(selectinload(Message.attachments))
     )
     msg = result.scalar_one_or_none()
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
+    blob_ids = [att.blob_id for att in msg.attachments if att.blob_id is not None]
+    attachment_ids = [att.id for att in msg.attachments]
+    await invalidate_attachment_access(attachment_ids)
     await session.delete(msg)
+    await session.flush()
+    await message_deleted(session, msg)
+    unreferenced = await release_blobs(session, blob_ids)
     await session.commit()
+    await invalidate_attachment_access(attachment_ids)
+    await mark_written(user_id)
+    discard_blob_files(unreferenced)
     return {"status": "deleted", "message_id": message_id}
 
 
-@router.get("/messages/{user_id}", response_model=List[MessageRead])
+@router.get("/search", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    user_id: Optional[int] = Query(None, description="Only the conversation with this user"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    hits = await search_messages(session, int(current_user), q, peer_id=user_id, limit=limit, offset=offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    result = await session.execute(
+        select(Message)
+        .where(Message.id.in_([message_id for message_id, _, _ in hits]))
+        .options(selectinload(Message.attachments))
+    )
+    messages = {m.id: m for m in result.scalars().all()}
+    return SearchPage(
+        items=[
+            SearchHit(message=MessageRead.model_validate(messages[message_id]), snippet=snippet, rank=rank)
+            for message_id, snippet, rank in hits
+            if message_id in messages
+        ],
+        next_offset=offset + limit if has_more else None,
+    )
+
+
+@router.get("/messages/{user_id}", response_model=MessagePage)
 async def get_chat_history(
     user_id: int,
+    before: Optional[int] = Query(None, description="Return messages older than this message id"),
+    after: Optional[int] = Query(None, description="Return messages newer than this message id"),
+    cursor: Optional[str] = Query(None, description="next_cursor from a previous page"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
     current_user: int = Depends(get_current_user_id),
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
+    if cursor is not None:
+        direction, cursor_id = decode_cursor(cursor)
+        before, after = (cursor_id, None) if direction == CURSOR_BEFORE else (None, cursor_id)
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    # Each direction of the conversation is an index range scan on
+    # (user_id, receiver_id, id); only limit + 1 ids are read from each side.
+    def page_ids(sender: int, receiver: int):
+        stmt = select(Message.id).where(Message.user_id == sender, Message.receiver_id == receiver)
+        if after is not None:
+            stmt = stmt.where(Message.id > after).order_by(Message.id.asc())
+        else:
+            if before is not None:
+                stmt = stmt.where(Message.id < before)
+            stmt = stmt.order_by(Message.id.desc())
+        return select(stmt.limit(limit + 1).subquery().c.id)
+
+    ids = union_all(page_ids(current_user, user_id), page_ids(user_id, current_user)).subquery()
+    order = Message.id.asc() if after is not None else Message.id.desc()
     stmt = (
         select(Message)
-        .where(
-            or_(
-                and_(Message.user_id == current_user, Message.receiver_id == user_id),
-                and_(Message.user_id == user_id, Message.receiver_id == current_user),
-            )
-        )
-        .order_by(Message.created_at.asc())
+        .where(Message.id.in_(select(ids.c.id)))
+        .order_by(order)
+        .limit(limit + 1)
         .options(selectinload(Message.attachments))
     )
     result = await session.execute(stmt)
-    messages = result.scalars().unique().all()
+    messages = list(result.scalars().unique().all())
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is not None:
+        messages.reverse()
+
+    next_cursor = None
+    if has_more and messages:
+        if after is not None:
+            next_cursor = encode_cursor(CURSOR_AFTER, messages[0].id)
+        else:
+            next_cursor = encode_cursor(CURSOR_BEFORE, messages[-1].id)
+
+    return MessagePage(
+        items=[MessageRead.model_validate(m) for m in messages],
+        next_cursor=next_cursor,
+    )
+
 
-    return [MessageRead.model_validate(m) for m in messages]
+@router.get("/conversations", response_model=ConversationPage)
+async def get_conversations(
+    before: Optional[int] = Query(None, description="next_before from a previous page"),
+    limit: int = Query(CONVERSATIONS_PAGE_SIZE, ge=1, le=CONVERSATIONS_MAX_PAGE_SIZE),
+    current_user: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """The inbox of the current user, most recent conversation (by last message id) first."""
+    current_user = int(current_user)
+
+    # The user is either the low or the high side of a pair; each side is an index
+    # range scan on (user_*_id, last_message_id) reading at most limit + 1 rows.
+    def page_ids(column):
+        stmt = select(Conversation.id).where(column == current_user)
+        if before is not None:
+            stmt = stmt.where(Conversation.last_message_id < before)
+        stmt = stmt.order_by(Conversation.last_message_id.desc()).limit(limit + 1)
+        return select(stmt.subquery().c.id)
+
+    ids = union_all(page_ids(Conversation.user_low_id), page_ids(Conversation.user_high_id)).subquery()
+    result = await session.execute(
+        select(Conversation)
+        .where(Conversation.id.in_(select(ids.c.id)))
+        .order_by(Conversation.last_message_id.desc())
+        .limit(limit + 1)
+    )
+    conversations = list(result.scalars().all())
+
+    has_more = len(conversations) > limit
+    conversations = conversations[:limit]
+    return ConversationPage(
+        items=[conversation_view(c, current_user) for c in conversations],
+        next_before=conversations[-1].last_message_id if has_more else None,
+    )
+
+
+@router.post("/conversations/{user_id}/read", response_model=ConversationRead)
+async def mark_conversation_read(
+    user_id: int,
+    marker: ReadMarker,
+    current_user: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+):
+    current_user = int(current_user)
+    conv = await mark_read(session, current_user, user_id, marker.up_to)
+    if conv is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    await session.commit()
+    await mark_written(current_user)
+    return conversation_view(conv, current_user)
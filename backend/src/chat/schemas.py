@@ -6,6 +6,8 @@ from datetime import datetime
 
 from src.attachment.schemas import AttachmentRead
 
+MAX_MESSAGE_ID = 2**31 - 1  # message.id is a 32-bit INTEGER
+
 
 class MessageCreate(BaseModel):
     message: str = Form(..., max_length=500)
@@ -29,6 +31,44 @@ class MessageRead(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+class MessagePage(BaseModel):
+    items: List[MessageRead] = []  # newest first
+    next_cursor: Optional[str] = None  # opaque, pass back as ?cursor=
+
+class ConversationRead(BaseModel):
+    peer_id: int
+    last_message_id: int
+    last_message_preview: str
+    last_message_at: datetime
+    last_sender_id: int
+    unread: int = 0
+    last_read_id: Optional[int] = None
+
+    @field_serializer("last_message_at")
+    def serialize_last_message_at(self, value: datetime):
+        return value.isoformat()
+
+
+class ConversationPage(BaseModel):
+    items: List[ConversationRead] = []  # most recent first
+    next_before: Optional[int] = None  # pass back as ?before=
+
+
+class ReadMarker(BaseModel):
+    up_to: int = Field(..., ge=0, le=MAX_MESSAGE_ID)  # id of the newest message the user has seen
+
+
+class SearchHit(BaseModel):
+    message: MessageRead
+    snippet: str  # HTML-escaped text around the match, matches wrapped in <mark>
+    rank: float  # higher is better
+
+
+class SearchPage(BaseModel):
+    items: List[SearchHit] = []  # best match first
+    next_offset: Optional[int] = None  # pass back as ?offset=
+
 # class MessageRead(BaseModel):
 #     id: int
 #     message: str
@@ -62,3 +102,16 @@ class WSMessage(BaseModel):
     receiver_id: Optional[int] = None
     message: Optional[str] = None
     files: Optional[List[str]] = []  # или List[UploadFile] если передаешь через Form
+    # "ack": every message up to this id was received; "read": seen
+    up_to: Optional[int] = Field(None, ge=0, le=MAX_MESSAGE_ID)
+    user_ids: Optional[List[int]] = None  # "presence_subscribe"
+
+
+class WSAck(BaseModel):
+    type: str = Field("ack")
+    id: int
+    created_at: datetime
+
+    @field_serializer("created_at")
+    def serialize_created_at(self, value: datetime):
+        return value.isoformat()
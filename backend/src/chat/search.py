@@ -0,0 +1,131 @@
+"""
+Full-text search over message text.
+
+    python -m src.chat.search --rebuild
+
+SQLite uses the message_fts FTS5 table (kept in sync by triggers), Postgres the GIN
+index on to_tsvector(message). --rebuild creates whatever is missing and reindexes
+every message, e.g. after a bulk import that bypassed the triggers.
+"""
+import argparse
+import asyncio
+import html
+import re
+
+from sqlalchemy import Integer, column, func, literal_column, or_, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.chat.models import (
+    MESSAGE_FTS_POSTGRES_DDL, MESSAGE_FTS_SQLITE_DDL, MESSAGE_FTS_TABLE, MESSAGE_TS_CONFIG, Message,
+)
+from src.database import engine
+import src.attachment.models  # noqa: F401  (mapper of Message.attachments)
+
+import logging
+logger = logging.getLogger(__name__)
+
+SNIPPET_TOKENS = 12
+# sentinels around matches, swapped for <mark> after the rest of the snippet is escaped
+_START, _STOP = "\x02", "\x03"
+
+message_fts = table(MESSAGE_FTS_TABLE, column("rowid", Integer))
+_ts_config = literal_column(f"'{MESSAGE_TS_CONFIG}'::regconfig")
+
+
+def fts5_query(q: str) -> str | None:
+    """
+    User input -> FTS5 MATCH expression: every word is a quoted term (so operators and
+    quotes in the input are never FTS syntax), the last one is a prefix.
+    """
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def _scope(stmt, user_id: int, peer_id: int | None):
+    if peer_id is None:
+        return stmt.where(or_(Message.user_id == user_id, Message.receiver_id == user_id))
+    return stmt.where(or_(
+        (Message.user_id == user_id) & (Message.receiver_id == peer_id),
+        (Message.user_id == peer_id) & (Message.receiver_id == user_id),
+    ))
+
+
+async def search_messages(
+    session: AsyncSession,
+    user_id: int,
+    q: str,
+    peer_id: int | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> list[tuple[int, str, float]]:
+    """
+    Best matches first among the messages the user sent or received (optionally with one peer).
+    Returns up to limit + 1 (message id, highlighted snippet, rank) rows, higher rank is better.
+    """
+    if session.bind.dialect.name == "postgresql":
+        tsv = func.to_tsvector(_ts_config, Message.message)
+        tsq = func.websearch_to_tsquery(_ts_config, q)
+        rank = func.ts_rank(tsv, tsq)
+        snippet = func.ts_headline(
+            _ts_config, Message.message, tsq,
+            f"StartSel={_START}, StopSel={_STOP}, MaxWords={SNIPPET_TOKENS * 2}, MinWords={SNIPPET_TOKENS // 2}",
+        )
+        stmt = select(Message.id, snippet, rank).where(tsv.op("@@")(tsq)).order_by(rank.desc(), Message.id.desc())
+    else:
+        match = fts5_query(q)
+        if match is None:
+            return []
+        fts = literal_column(MESSAGE_FTS_TABLE)
+        # bm25 is lower for better matches
+        rank = func.bm25(fts)
+        snippet = func.snippet(fts, 0, _START, _STOP, "…", SNIPPET_TOKENS)
+        stmt = (
+            select(Message.id, snippet, -rank)
+            .select_from(message_fts)
+            .join(Message, Message.id == message_fts.c.rowid)
+            .where(fts.op("MATCH")(match))
+            .order_by(rank, Message.id.desc())
+        )
+
+    stmt = _scope(stmt, user_id, peer_id).limit(limit + 1).offset(offset)
+    result = await session.execute(stmt)
+    return [(message_id, highlight(s or ""), float(r)) for message_id, s, r in result.all()]
+
+
+async def rebuild():
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            for statement in MESSAGE_FTS_POSTGRES_DDL:
+                await conn.execute(text(statement))
+            await conn.execute(text("REINDEX INDEX ix_message_message_tsv"))
+        else:
+            for statement in MESSAGE_FTS_SQLITE_DDL:
+                await conn.execute(text(statement))
+            await conn.execute(text(f"INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}) VALUES ('rebuild')"))
+            await conn.execute(text(f"INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}) VALUES ('optimize')"))
+    logger.info("Message search index rebuilt")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="create the index if missing and reindex all messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        await rebuild()
+    else:
+        parser.print_help()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,26 @@
+import base64
+import binascii
+
+from fastapi import HTTPException
+
+CURSOR_BEFORE = "b"
+CURSOR_AFTER = "a"
+
+
+def encode_cursor(direction: str, message_id: int) -> str:
+    """
+    Opaque history cursor: urlsafe base64 of "{direction}:{message_id}"
+    """
+    raw = f"{direction}:{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, message_id = base64.urlsafe_b64decode(padded).decode().split(":", 1)
+        if direction not in (CURSOR_BEFORE, CURSOR_AFTER):
+            raise ValueError(direction)
+        return direction, int(message_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
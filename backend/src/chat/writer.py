@@ -0,0 +1,116 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.chat.conversations import record_messages
+from src.chat.delivery import record_pending
+from src.chat.models import Message
+from src.config import settings
+from src.database import async_session_maker
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Group commit for messages coming from WebSockets.
+    Messages from all sockets are collected for `flush_interval` seconds (or until
+    `max_batch` are queued) and inserted in one transaction. The future returned by
+    `submit` resolves with the persisted Message once its batch is committed.
+    When a batch fails, its messages are retried one transaction each, so only the
+    offending message fails its future.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, max_batch: int, flush_interval: float, max_pending: int):
+        self._session_maker = session_maker
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[tuple[Message, asyncio.Future]] = asyncio.Queue(maxsize=max_pending)
+        self._task: asyncio.Task | None = None
+        self._committing: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._committing:
+            await self._committing  # the batch _run held when cancelled
+        # commit whatever is still pending
+        while not self._queue.empty():
+            await self._commit(self._drain([]))
+
+    async def submit(self, msg: Message) -> asyncio.Future:
+        committed = asyncio.get_running_loop().create_future()
+        # waits only when max_pending messages are already queued
+        await self._queue.put((msg, committed))
+        return committed
+
+    def stats(self) -> dict:
+        return {"pending": self._queue.qsize()}
+
+    def _drain(self, batch: list) -> list:
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                if self._queue.qsize() < self.max_batch - 1:
+                    await asyncio.sleep(self.flush_interval)
+            finally:
+                # in a task of its own: cancelled by stop(), the batch is still committed
+                self._committing = asyncio.create_task(self._commit(self._drain(batch)))
+            await asyncio.shield(self._committing)
+
+    async def _insert(self, messages: list[Message]):
+        async with self._session_maker() as session:
+            async with session.begin():
+                session.add_all(messages)
+                await session.flush()
+                await record_messages(session, messages)
+                await record_pending(session, messages)
+
+    async def _commit(self, batch: list[tuple[Message, asyncio.Future]]):
+        try:
+            await self._insert([msg for msg, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(f"Failed to commit a batch of {len(batch)} messages, retrying one by one: {e!r}")
+                for msg, committed in batch:
+                    await self._commit([(_resubmitted(msg), committed)])
+                return
+            logger.exception("Failed to commit a message")
+            msg, committed = batch[0]
+            if not committed.done():
+                committed.set_exception(e)
+            return
+
+        for msg, committed in batch:
+            if not committed.done():
+                committed.set_result(msg)
+
+
+def _resubmitted(msg: Message) -> Message:
+    """
+    A new Message with the submitted values. The rolled back flush left its id on `msg`;
+    other writers may have taken that id since.
+    """
+    values = {column.key: getattr(msg, column.key) for column in Message.__table__.columns if not column.primary_key}
+    return Message(**values, attachments=[])
+
+
+message_writer = MessageWriter(
+    async_session_maker,
+    max_batch=settings.WS_WRITER_BATCH_SIZE,
+    flush_interval=settings.WS_WRITER_FLUSH_INTERVAL_MS / 1000,
+    max_pending=settings.WS_WRITER_MAX_PENDING,
+)
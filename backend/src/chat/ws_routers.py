@@ -1,149 +1,358 @@
-from typing import List, Dict
+import asyncio
+import json
+import time
+from collections import Counter
+from functools import partial
+from typing import List, Dict, Iterable
 
-import jwt
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends, HTTPException
 from datetime import datetime
 
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import ValidationError
+from starlette.websockets import WebSocketState
 
-from src.attachment.schemas import AttachmentRead
-from src.attachment.utils import save_attachment
-from src.chat.schemas import WSMessage, MessageRead
-from src.database import get_async_session
+from src.chat.bus import BaseBus, create_bus
+from src.chat.connection import IDLE_CLOSE_CODE, ClientConnection, SlowConsumerPolicy
+from src.chat.delivery import MAX_DEVICE_ID_LENGTH, delivery_tracker, pending_messages
+from src.chat.ephemeral import EphemeralEvents
+from src.chat.presence import PresenceTracker
+from src.chat.protocol import SUBPROTOCOL_MSGPACK, negotiate
+from src.chat.resume import replay_missed
+from src.chat.schemas import MessageRead, WSMessage, WSAck
 from src.chat.models import Message
+from src.chat.writer import message_writer
+from src.auth.authentication_config import decode_token
 from src.config import settings
+from src.database import async_session_maker, mark_written
+from src.metrics import ws_fanout_duration, ws_fanout_failures
+from src.profiling.profiler import profiler
+from src.user.manager import get_current_user_id
 
 import logging
 logger = logging.getLogger(__name__)
 
-SECRET_KEY=settings.AUTH_SECRET_KEY
-ALGORITHM=settings.AUTH_ALGORITHM
-
 router = APIRouter()
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    def __init__(
+        self,
+        bus: BaseBus,
+        max_queue: int = 256,
+        policy: SlowConsumerPolicy = "drop_oldest",
+        ping_interval: float = 20,
+        idle_timeout: float = 60,
+    ):
+        self.active_connections: Dict[int, List[ClientConnection]] = {}
+        self.bus = bus
+        self.max_queue = max_queue
+        self.policy = policy
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.counters: Counter = Counter()
+        self._heartbeat: asyncio.Task | None = None
+        self._fanouts: set[asyncio.Task] = set()  # fan_out() tasks, referenced until they finish
+
+    async def start(self):
+        await self.bus.start(self._deliver_local)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+        # frames already committed still go out
+        await asyncio.gather(*self._fanouts, return_exceptions=True)
+        await self.bus.stop()
 
-    async def connect(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.setdefault(user_id, []).append(websocket)
+    async def connect(
+        self, user_id: int, websocket: WebSocket, hold: bool = False, device_id: str | None = None,
+    ) -> ClientConnection:
+        """`hold`: keep live frames back until conn.release(), used while replaying missed messages."""
+        subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        conn = ClientConnection(user_id, websocket, self.max_queue, self.policy, self.counters, self._drop)
+        conn.device_id = device_id
+        conn.binary = subprotocol == SUBPROTOCOL_MSGPACK
+        if hold:
+            conn.hold()
+        conn.start()
+        conns = self.active_connections.setdefault(user_id, [])
+        conns.append(conn)
+        if len(conns) == 1:
+            await self.bus.subscribe(user_id)
         logger.info(f"User {user_id} connected via WS. Active: {list(self.active_connections.keys())}")
+        return conn
 
-    def disconnect(self, user_id: int, websocket: WebSocket):
-        conns = self.active_connections.get(user_id)
-        if conns and websocket in conns:
-            conns.remove(websocket)
-        if not conns:
-            self.active_connections.pop(user_id, None)
+    async def disconnect(self, user_id: int, websocket: WebSocket):
+        for conn in self.active_connections.get(user_id, []):
+            if conn.websocket is websocket:
+                conn.stop()
+                await self._drop(conn)
+                break
         logger.info(f"User {user_id} disconnected from WS. Active: {list(self.active_connections.keys())}")
 
-    async def send_personal_message(self, data: dict, receiver_id: int):
-        websockets = self.active_connections.get(receiver_id, [])
-        logger.info(f"Trying to send to {receiver_id}. Active: {list(self.active_connections.keys())}")
-        if not websockets:
-            logger.warning(f"No active WS connections for user {receiver_id}")
-            return
-        for ws in websockets:
+    async def _drop(self, conn: ClientConnection):
+        conns = self.active_connections.get(conn.user_id)
+        if conns and conn in conns:
+            conns.remove(conn)
+        if not conns and self.active_connections.pop(conn.user_id, None) is not None:
+            await self.bus.unsubscribe(conn.user_id)
+
+    async def send_personal_message(self, frame: str, receiver_id: int, key: int | None = None):
+        # the receiver may be connected to another worker, route through the bus
+        await self.bus.publish(receiver_id, frame, key)
+
+    async def broadcast(self, frame: str, user_ids: Iterable[int], key: int | None = None):
+        """Fan one pre-encoded frame out to every socket of the given users."""
+        with ws_fanout_duration.time():
             try:
-                await ws.send_json(data)
-                logger.info(f"Message sent to user {receiver_id}")
-            except Exception as e:
-                logger.error(f"Failed to send message to {receiver_id}: {e}")
-                self.disconnect(receiver_id, ws)
+                await self.bus.publish_many(dict.fromkeys(user_ids), frame, key)
+            except Exception:
+                ws_fanout_failures.inc()
+                raise
+
+    def fan_out(self, frame: str, user_ids: Iterable[int], key: int | None = None):
+        """broadcast() in the background: the caller (a request, an ack callback) does not wait for the bus."""
+        task = asyncio.create_task(self._fan_out(frame, tuple(user_ids), key))
+        self._fanouts.add(task)
+        task.add_done_callback(self._fanouts.discard)
+
+    async def _fan_out(self, frame: str, user_ids: tuple[int, ...], key: int | None):
+        try:
+            await self.broadcast(frame, user_ids, key)
+        except Exception:
+            logger.exception("WS broadcast failed")
+
+    async def _deliver_local(self, receiver_id: int, frame: str, key: int | None = None):
+        conns = self.active_connections.get(receiver_id, [])
+        if not conns:
+            # the usual case for most members of a room
+            logger.debug(f"No active WS connections for user {receiver_id}")
+            return
+        # only queues the frame, each socket's writer task does the actual send
+        for conn in conns:
+            conn.enqueue(frame, key)
+
+    async def _heartbeat_loop(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            deadline = time.monotonic() - self.idle_timeout
+            for conns in list(self.active_connections.values()):
+                for conn in list(conns):
+                    if conn.last_seen >= deadline:
+                        conn.push(ping)
+                        continue
+                    # no frame, not even a pong: the peer is gone without closing the connection
+                    logger.info(f"Closing idle WS connection of user {conn.user_id}")
+                    self.counters["idle_reaped"] += 1
+                    try:
+                        await conn.close(code=IDLE_CLOSE_CODE)
+                        await self._drop(conn)
+                    except Exception:
+                        # e.g. the bus failed to unsubscribe: the other sockets still get reaped and pinged
+                        logger.exception(f"Failed to reap the idle WS connection of user {conn.user_id}")
+
+    def stats(self) -> dict:
+        depths = [conn.queue_depth for conns in self.active_connections.values() for conn in conns]
+        return {
+            "users": len(self.active_connections),
+            "sockets": len(depths),
+            "sockets_per_user_max": max(map(len, self.active_connections.values()), default=0),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            **self.counters,
+        }
+
+manager = ConnectionManager(
+    create_bus(settings.WS_BUS_URL),
+    max_queue=settings.WS_SEND_QUEUE_SIZE,
+    policy=settings.WS_SLOW_CONSUMER_POLICY,
+    ping_interval=settings.WS_PING_INTERVAL_SECONDS,
+    idle_timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+)
+presence_tracker = PresenceTracker(
+    manager.active_connections,
+    max_subscriptions=settings.PRESENCE_MAX_SUBSCRIPTIONS,
+    flush_interval=settings.PRESENCE_FLUSH_MS / 1000,
+    away_after=settings.PRESENCE_AWAY_AFTER_SECONDS,
+    offline_grace=settings.PRESENCE_OFFLINE_GRACE_SECONDS,
+)
+ephemeral_events = EphemeralEvents(
+    manager.send_personal_message,
+    async_session_maker,
+    typing_interval=settings.WS_TYPING_INTERVAL_MS / 1000,
+    read_flush_interval=settings.WS_READ_FLUSH_MS / 1000,
+)
+
+
+@router.get("/ws/stats")
+async def websocket_stats(user_id: int = Depends(get_current_user_id)):
+    return manager.stats()
+
+
+# acks started from done-callbacks, referenced until they finish
+_ack_tasks: set[asyncio.Task] = set()
+
+
+def _send_ack(conn: ClientConnection, committed: asyncio.Future):
+    if committed.cancelled() or committed.exception() is not None:
+        conn.enqueue(json.dumps({"error": "db_error"}))
+        return
+    task = asyncio.create_task(_acknowledge(conn, committed.result()))
+    _ack_tasks.add(task)
+    task.add_done_callback(_ack_tasks.discard)
+
+
+async def _acknowledge(conn: ClientConnection, msg: Message):
+    # before the ack: the client's next read may be served by another worker
+    await mark_written(conn.user_id)
+    conn.enqueue(WSAck(id=msg.id, created_at=msg.created_at).model_dump_json())
+
+    # --- Отправляем сообщения через WS ---
+    # encoded once, the same frame goes to every socket of both participants
+    frame = MessageRead.model_validate(msg).model_dump_json()
+    manager.fan_out(frame, (msg.receiver_id, msg.user_id), msg.id)
+
+
+async def _handle_frame(conn: ClientConnection, user_id: int, data):
+    # --- Валидация WSMessage ---
+    try:
+        ws_msg = WSMessage.model_validate(data)
+    except Exception as e:
+        await conn.send_json({"error": "invalid_message", "details": str(e)})
+        return
+
+    if ws_msg.type == "pong":
+        return
+
+    if ws_msg.type == "presence_subscribe":
+        if not presence_tracker.subscribe(conn, ws_msg.user_ids or ()):
+            await conn.send_json({
+                "error": "too_many_subscriptions",
+                "details": f"at most {presence_tracker.max_subscriptions} user ids"
+            })
+        return
+
+    if ws_msg.type == "ack":
+        if conn.device_id is None or ws_msg.up_to is None:
+            await conn.send_json({
+                "error": "missing_fields",
+                "details": "connect with device_id and send up_to to acknowledge deliveries"
+            })
+            return
+        delivery_tracker.ack(user_id, conn.device_id, ws_msg.up_to)
+        return
+
+    if ws_msg.type in ("typing", "stop_typing", "read"):
+        if ws_msg.receiver_id is None or (ws_msg.type == "read" and ws_msg.up_to is None):
+            await conn.send_json({
+                "error": "missing_fields",
+                "details": "receiver_id is required (and up_to for read)"
+            })
+            return
+        if ws_msg.type == "typing":
+            await ephemeral_events.typing(user_id, ws_msg.receiver_id)
+        elif ws_msg.type == "stop_typing":
+            await ephemeral_events.stop_typing(user_id, ws_msg.receiver_id)
+        else:
+            ephemeral_events.read(user_id, ws_msg.receiver_id, ws_msg.up_to)
+        return
+
+    if ws_msg.type == "message":
+        if ws_msg.receiver_id is None or ws_msg.message is None:
+            await conn.send_json({
+                "error": "missing_fields",
+                "details": "receiver_id and message are required"
+            })
+            return
+
+        if ws_msg.files:
+            await conn.send_json({
+                "error": "files_not_supported",
+                "details": "upload attachments with POST /chat/messages"
+            })
+            return
+
+        # --- Сохраняем сообщение в БД (one transaction with other sockets' messages) ---
+        msg = Message(
+            message=ws_msg.message,
+            user_id=user_id,
+            receiver_id=ws_msg.receiver_id,
+            created_at=datetime.utcnow(),
+            attachments=[],
+        )
+        committed = await message_writer.submit(msg)
+        # keep reading frames, the ack is queued once the batch commits
+        committed.add_done_callback(partial(_send_ack, conn))
 
-manager = ConnectionManager()
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, session: AsyncSession = Depends(get_async_session)):
+async def websocket_endpoint(websocket: WebSocket):
     # --- Получаем токен вручную ---
     token = websocket.query_params.get("token")
     if not token:
         await websocket.close(code=1008)
         return
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, expected_type="access")
         user_id = int(payload.get("sub"))
-    except jwt.PyJWTError:
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    # reconnecting clients send the last message id they got, missed messages are replayed;
+    # without it a device that acks deliveries gets what it has not acked yet
+    last_seen = websocket.query_params.get("last_seen_message_id")
+    device_id = websocket.query_params.get("device_id") or None
+    if (last_seen is not None and not last_seen.isdigit()) or (
+        device_id is not None and len(device_id) > MAX_DEVICE_ID_LENGTH
+    ):
         await websocket.close(code=1008)
         return
 
-    await manager.connect(user_id, websocket)
+    resume = last_seen is not None or device_id is not None
+    conn = await manager.connect(user_id, websocket, hold=resume, device_id=device_id)
+    if last_seen is not None:
+        await replay_missed(conn, int(last_seen))
+    elif device_id is not None:
+        await replay_missed(conn, await delivery_tracker.cursor(user_id, device_id), fetch=pending_messages)
+    # frames of this socket are all profiled when the admin token came with the handshake;
+    # only as a header: query strings end up in access logs
+    profile_all = profiler.enabled and profiler.requested(websocket.headers.get("x-profile"))
 
     try:
         while True:
             try:
-                data = await websocket.receive_json()
+                data = await conn.receive_json()
             except WebSocketDisconnect:
                 break
             except Exception as e:
+                if websocket.application_state == WebSocketState.DISCONNECTED:
+                    break  # closed by the server (idle or slow consumer)
                 logger.exception("Failed to receive WS data: %s", e)
                 try:
-                    await websocket.send_json({"error": "invalid_json", "details": str(e)})
+                    await conn.send_json({"error": "invalid_json", "details": str(e)})
                 except Exception:
                     pass
                 continue
+            conn.touch(heartbeat=isinstance(data, dict) and data.get("type") == "pong")
 
-            # --- Валидация WSMessage ---
-            try:
-                ws_msg = WSMessage.model_validate(data)
-            except Exception as e:
-                await websocket.send_json({"error": "invalid_message", "details": str(e)})
+            if not (profiler.enabled and (profile_all or profiler.sampled())):
+                await _handle_frame(conn, user_id, data)
                 continue
-
-            if ws_msg.type == "message":
-                if ws_msg.receiver_id is None or ws_msg.message is None:
-                    await websocket.send_json({
-                        "error": "missing_fields",
-                        "details": "receiver_id and message are required"
-                    })
-                    continue
-
-                # --- Сохраняем сообщение в БД ---
-                try:
-                    async with session.begin():
-                        msg = Message(
-                            message=ws_msg.message,
-                            user_id=user_id,
-                            receiver_id=ws_msg.receiver_id,
-                            created_at=datetime.utcnow(),
-                        )
-                        session.add(msg)
-                        await session.flush()
-
-                        # --- Сохраняем вложения ---
-                        attachments: List[AttachmentRead] = []
-                        for f in ws_msg.files or []:
-                            att = await save_attachment(f, msg.id, session, user_id)
-                            attachments.append(AttachmentRead.model_validate(att))
-                except Exception:
-                    logger.exception("DB error while saving message")
-                    await websocket.send_json({"error": "db_error"})
-                    continue
-
-                # --- Формируем payload
-                attachments_data = [AttachmentRead.from_orm(att) for att in attachments]
-                msg_dict = jsonable_encoder(
-                    MessageRead(
-                        id=msg.id,
-                        message=msg.message,
-                        user_id=msg.user_id,
-                        receiver_id=msg.receiver_id,
-                        created_at=msg.created_at,
-                        attachments=attachments_data
-                    )
-                )
-
-
-                # --- Отправляем сообщения через WS ---
-                # try:
-                #     await manager.send_personal_message(msg_dict, receiver_id=msg.receiver_id)
-                #     # await manager.send_personal_message(data=payload, receiver_id=msg.receiver_id)
-                #     # await manager.send_personal_message(data=payload, receiver_id=msg.user_id)
-                # except Exception:
-                #     logger.exception("WS broadcast failed")
+            frame_type = data.get("type") if isinstance(data, dict) else None
+            profile = profiler.start("ws", f"WS {frame_type}")
+            status = "error"
+            try:
+                await _handle_frame(conn, user_id, data)
+                status = "ok"
+            finally:
+                profiler.finish(profile, status)
 
     finally:
-        manager.disconnect(user_id, websocket)
+        presence_tracker.unsubscribe(conn)
+        await manager.disconnect(user_id, websocket)
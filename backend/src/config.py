@@ -1,12 +1,33 @@
 from pathlib import Path
-from typing import ClassVar
+from typing import ClassVar, Literal
 from pydantic_settings import BaseSettings
 
 BASE_DIR: Path = Path(__file__).resolve().parent.parent
 
 class Settings(BaseSettings):
-    # DB
+    # DB: sqlite+aiosqlite:///... or postgresql+asyncpg://...
     DB_URL: str
+    # Read-only replicas for history, search and user listing, JSON list in env:
+    # DB_REPLICA_URLS='["postgresql+asyncpg://replica1/chat", "postgresql+asyncpg://replica2/chat"]'
+    DB_REPLICA_URLS: list[str] = []
+    # After a write a user reads from the primary for this long (replication lag budget);
+    # with a Redis WS_BUS_URL the marker is shared there, so it holds across workers
+    DB_READ_YOUR_WRITES_SECONDS: float = 5.0
+    DB_ASYNCPG_STATEMENT_CACHE_SIZE: int = 256  # prepared statements per asyncpg connection
+    DB_ECHO: bool = False  # log every statement, for debugging only
+    DB_SLOW_QUERY_MS: int | None = None  # log statements slower than this
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 500  # compiled SQL cache per engine
+    # Applied to every new SQLite connection
+    DB_SQLITE_JOURNAL_MODE: str = "WAL"
+    DB_SQLITE_SYNCHRONOUS: str = "NORMAL"
+    DB_SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    DB_SQLITE_MMAP_SIZE: int = 268435456  # 256 MB
+    DB_SQLITE_CACHE_SIZE: int = -65536  # negative = KiB, 64 MB
 
     # Secret keys
     JWT_SECRET_KEY: str
@@ -17,6 +38,89 @@ class Settings(BaseSettings):
     AUTH_ALGORITHM: str = "HS256"
     AUTH_ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     AUTH_REFRESH_TOKEN_EXPIRE_MINUTES: int = 60
+    # Password hashing; stored hashes made with other settings are upgraded on login
+    PASSWORD_HASH_ALGORITHM: Literal["argon2", "bcrypt"] = "argon2"
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST: int = 65536  # KiB
+    PASSWORD_ARGON2_PARALLELISM: int = 4
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    # Cache of verified tokens (entries also expire with the token)
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL: int = 300
+
+    # WebSocket fan-out: "memory://" for a single worker, "redis://host:6379/0" for several
+    WS_BUS_URL: str = "memory://"
+    # Per-socket outbound queue and what to do when a client cannot keep up
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: Literal["drop_oldest", "coalesce", "disconnect"] = "drop_oldest"
+    # Group commit of messages sent over WebSockets
+    WS_WRITER_BATCH_SIZE: int = 100
+    WS_WRITER_FLUSH_INTERVAL_MS: int = 5
+    WS_WRITER_MAX_PENDING: int = 10000
+    # Resume: /ws?last_seen_message_id= replays missed messages in batches;
+    # past WS_RESUME_MAX_MESSAGES the client gets {"type": "resync"} and reloads history
+    WS_RESUME_BATCH_SIZE: int = 100
+    WS_RESUME_MAX_MESSAGES: int = 1000
+    # Store-and-forward: devices connecting with /ws?device_id= get what they have not
+    # acked ({"type": "ack", "up_to": <message id>}) on connect
+    DELIVERY_ACK_FLUSH_MS: int = 200
+    DELIVERY_COMPACT_INTERVAL_SECONDS: int = 60
+    DELIVERY_COMPACT_BATCH_SIZE: int = 5000
+    DELIVERY_RETENTION_HOURS: int = 72  # undelivered messages and idle devices are dropped after
+    # Ephemeral events over /ws: typing / stop_typing are never stored, "read" pointers are
+    # stored in batches
+    WS_TYPING_INTERVAL_MS: int = 2000  # at most one typing event per (sender, peer)
+    WS_READ_FLUSH_MS: int = 1000
+    # Heartbeats: {"type": "ping"} every WS_PING_INTERVAL_SECONDS, clients answer {"type": "pong"};
+    # sockets that sent nothing for WS_IDLE_TIMEOUT_SECONDS are closed (half-open connections)
+    WS_PING_INTERVAL_SECONDS: int = 20
+    WS_IDLE_TIMEOUT_SECONDS: int = 60
+    # Presence subscriptions: changes are sampled and batched every PRESENCE_FLUSH_MS
+    PRESENCE_MAX_SUBSCRIPTIONS: int = 500
+    PRESENCE_FLUSH_MS: int = 1000
+    PRESENCE_AWAY_AFTER_SECONDS: int = 300  # connected but only answering pings
+    PRESENCE_OFFLINE_GRACE_SECONDS: int = 10  # reconnects within this are not announced
+
+    # Image thumbnails (need Pillow)
+    THUMBNAIL_SIZE: int = 320
+    THUMBNAIL_WORKERS: int = 2
+    THUMBNAIL_QUEUE_SIZE: int = 1000
+    THUMBNAIL_MAX_ATTEMPTS: int = 3
+
+    # Attachment uploads: hashing and writes run on a few threads of their own;
+    # many threads hashing at once starve the event loop of the GIL
+    ATTACHMENT_IO_WORKERS: int = 2
+
+    # Attachment downloads
+    ATTACHMENT_ACCESS_CACHE_SIZE: int = 10000
+    ATTACHMENT_ACCESS_CACHE_TTL: int = 300
+    # Internal nginx location mapped to UPLOAD_ROOT, e.g. "/protected-uploads/";
+    # when set nginx streams the file (X-Accel-Redirect) instead of the app
+    ATTACHMENT_ACCEL_REDIRECT: str | None = None
+    # Lifetime of the signed URLs of GET /attachments/{id}/link (for <a href>, <img src>)
+    ATTACHMENT_URL_TTL_SECONDS: int = 300
+
+    # User directory cache
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 60
+    # Room membership cache used by the fan-out (dropped on join/leave)
+    ROOM_MEMBERS_CACHE_SIZE: int = 10000
+    ROOM_MEMBERS_CACHE_TTL: int = 60
+
+    # Prometheus metrics on GET /metrics, off by default: the app port is public.
+    # With METRICS_TOKEN set scrapes need "Authorization: Bearer <METRICS_TOKEN>".
+    METRICS_ENABLED: bool = False
+    METRICS_TOKEN: str | None = None
+
+    # Request profiling, off unless enabled. Requests with "X-Profile: <PROFILING_TOKEN>"
+    # are always profiled, others with probability PROFILING_SAMPLE_RATE.
+    PROFILING_ENABLED: bool = False
+    PROFILING_TOKEN: str | None = None
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL_MS: float = 5
+    PROFILING_KEEP: int = 50  # slowest profiles kept for GET /admin/profiles
 
     # App const
     MAX_ATTACHMENT_SIZE: ClassVar[int] = 5242880  # 5 MB
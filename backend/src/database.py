@@ -1,21 +1,192 @@
+import itertools
+import time
 from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from src.cache import TTLCache
 from src.config import settings
+from src.metrics import TimedQueuePool, instrument_engine
+from src.profiling.profiler import profiler
+
+import logging
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.DB_URL
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+
+def _is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.DB_SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.DB_SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.DB_SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.DB_SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.DB_SQLITE_CACHE_SIZE)}")
+    cursor.close()
+    # SQLite's own lower() only folds ASCII: "Иван" would never match the prefix "ив".
+    # Same results as str.lower() in queries and in the lower(...) indexes built with it.
+    dbapi_connection.create_function("lower", 1, _unicode_lower, deterministic=True)
+
+
+def _unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _log_slow_queries(engine: AsyncEngine, threshold_ms: int):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+        if elapsed_ms >= threshold_ms:
+            logger.warning(f"Slow query ({elapsed_ms:.1f} ms): {' '.join(statement.split())[:1000]}")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _failed(context):
+        # after_cursor_execute is not called for a failed statement
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+def make_engine(url: str, name: str = "primary") -> AsyncEngine:
+    """Engine with the pool, cache and per-connection settings from Settings; `name` labels its metrics."""
+    parsed = make_url(url)
+    kwargs = dict(
+        echo=settings.DB_ECHO,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        query_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+    )
+    if not _is_sqlite_memory(parsed):
+        # an in-memory SQLite database lives in a single connection (StaticPool)
+        kwargs.update(
+            # checkout waits are only timed for /metrics
+            poolclass=TimedQueuePool if settings.METRICS_ENABLED else AsyncAdaptedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    if parsed.get_driver_name() == "asyncpg":
+        kwargs["connect_args"] = {"prepared_statement_cache_size": settings.DB_ASYNCPG_STATEMENT_CACHE_SIZE}
+    new_engine = create_async_engine(url, **kwargs)
+
+    if parsed.get_backend_name() == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    if settings.DB_SLOW_QUERY_MS is not None:
+        _log_slow_queries(new_engine, settings.DB_SLOW_QUERY_MS)
+    if settings.METRICS_ENABLED:
+        instrument_engine(new_engine, name)
+    if profiler.enabled:
+        profiler.instrument_engine(new_engine)
+    return new_engine
+
+
+engine = make_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+# Read-only traffic is spread over the replicas; without replicas it stays on the primary
+replica_engines = [make_engine(url, f"replica{i}") for i, url in enumerate(settings.DB_REPLICA_URLS)]
+replica_session_makers = [async_sessionmaker(e, expire_on_commit=False) for e in replica_engines]
+_next_replica = itertools.cycle(replica_session_makers)
+
+
+class RecentWriters:
+    """
+    Users who wrote recently, their reads go to the primary until the replicas catch up.
+    Kept in this process and, with a Redis URL, as expiring Redis keys: a write served
+    by one worker also sends the reads served by the others to the primary.
+    """
+
+    KEY_PREFIX = "db:recent_writer:"
+
+    def __init__(self, ttl: float, url: str | None = None, client=None):
+        """`client`: an existing redis.asyncio client to use instead of connecting to `url`."""
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=100000, ttl=ttl)
+        if client is None and url is not None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self._redis = client
+
+    async def mark(self, user_id: int):
+        self._local.set(user_id, True)
+        if self._redis is not None:
+            try:
+                await self._redis.set(f"{self.KEY_PREFIX}{user_id}", 1, px=int(self.ttl * 1000))
+            except Exception:
+                logger.exception(f"Failed to share the recent write of user {user_id}")
+
+    async def contains(self, user_id: int) -> bool:
+        if self._local.get(user_id):
+            return True
+        if self._redis is None:
+            return False
+        try:
+            return bool(await self._redis.exists(f"{self.KEY_PREFIX}{user_id}"))
+        except Exception as e:
+            # unknown: the primary is always up to date
+            logger.warning(f"Failed to look up the recent writes of user {user_id}: {e!r}")
+            return True
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+
+
+# the workers share the WS bus Redis, if any; without replicas every read is on the primary anyway
+recent_writers = RecentWriters(
+    settings.DB_READ_YOUR_WRITES_SECONDS,
+    url=settings.WS_BUS_URL if replica_engines and settings.WS_BUS_URL.startswith(("redis://", "rediss://", "unix://"))
+    else None,
+)
+
 class Base(DeclarativeBase):
     pass
 
+def dialect_insert(session: AsyncSession):
+    """INSERT construct of the session's dialect, for ON CONFLICT upserts."""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
 
+async def mark_written(user_id: int):
+    """Send the user's reads to the primary for DB_READ_YOUR_WRITES_SECONDS, in every worker."""
+    if replica_session_makers:
+        await recent_writers.mark(int(user_id))
+
+async def read_session_maker(user_id: int | None = None) -> async_sessionmaker:
+    if not replica_session_makers or (user_id is not None and await recent_writers.contains(int(user_id))):
+        return async_session_maker
+    return next(_next_replica)
+
+async def get_read_session(user_id: int | None = None) -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only endpoints, see src.user.manager.get_read_session for the dependency."""
+    async with (await read_session_maker(user_id))() as session:
+        yield session
+
+async def dispose_engines():
+    for e in (engine, *replica_engines):
+        await e.dispose()
+    await recent_writers.close()
+
 async def create_db_and_tables():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
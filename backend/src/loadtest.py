@@ -0,0 +1,350 @@
+"""
+End-to-end load generator for the chat API.
+
+    python -m src.loadtest --url http://127.0.0.1:8000 --users 50 --duration 30 \\
+        --mix post=40,post_file=5,ws=40,history=15 --output results.json
+
+Registers (or reuses) --users synthetic accounts, logs them in, keeps one /ws socket
+per user open and runs --concurrency workers for --duration seconds. Every operation
+picks a random user and peer:
+
+    post       POST /chat/messages
+    post_file  POST /chat/messages with one --file-size attachment
+    ws         {"type": "message"} frame on the user's socket, latency until its ack
+    history    GET /chat/messages/{peer}
+
+Posted messages carry a sequence number, so the peer's socket reports delivery
+latency (POST sent -> frame received). --spawn starts uvicorn on --url's port for the run.
+The results (config, commit, per-operation p50/p95/p99, throughput and error rates)
+are written as JSON to --output or stdout; a summary table goes to stderr.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import httpx
+import websockets
+
+OPERATIONS = ("post", "post_file", "ws", "history")
+DEFAULT_MIX = "post=40,post_file=5,ws=40,history=15"
+PASSWORD = "Load*Test1"
+
+
+@dataclass
+class LoadUser:
+    id: int
+    email: str
+    token: str
+    socket: object = None
+    ws_sent: deque = field(default_factory=deque)  # send times of frames waiting for an ack
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class Recorder:
+    """Latencies in ms and errors per operation."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, Counter] = defaultdict(Counter)
+
+    def ok(self, op: str, started: float):
+        self.latencies[op].append((time.perf_counter() - started) * 1000)
+
+    def error(self, op: str, reason: str):
+        self.errors[op][reason] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[op])
+            errors = sum(self.errors[op].values())
+            total = len(values) + errors
+            result[op] = {
+                "count": len(values),
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "throughput": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": round(values[-1], 2) if values else None,
+                "error_reasons": dict(self.errors[op]),
+            }
+        return result
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return round(values[int(rank) - 1], 2)
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[op] = int(weight or 1)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one operation with a positive weight")
+    return weights
+
+
+def token_user_id(token: str) -> int:
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return int(json.loads(base64.urlsafe_b64decode(payload))["sub"])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, timeout=5,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.ws_url = self.base_url.replace("http", "ws", 1) + "/ws"
+        self.mix = args.mix
+        self.run_id = uuid.uuid4().hex[:8]
+        self.recorder = Recorder()
+        self.users: list[LoadUser] = []
+        self.sent_at: dict[int, float] = {}  # sequence number -> send time
+        self._seq = 0
+        self._readers: list[asyncio.Task] = []
+
+    def _next_message(self) -> tuple[int, str]:
+        self._seq += 1
+        return self._seq, f"lt {self.run_id} {self._seq}"
+
+    async def setup(self, client: httpx.AsyncClient):
+        semaphore = asyncio.Semaphore(self.args.setup_concurrency)
+
+        async def create(i: int) -> LoadUser:
+            email = f"{self.args.email_prefix}{i}@example.com"
+            async with semaphore:
+                r = await client.post("/register", json={
+                    "first_name": "Load", "last_name": f"User{i}", "email": email, "password": PASSWORD,
+                })
+                if r.status_code not in (200, 400):  # 400: registered by a previous run
+                    r.raise_for_status()
+                r = await client.post("/login", data={"username": email, "password": PASSWORD})
+                r.raise_for_status()
+            token = r.json()["access_token"]
+            return LoadUser(id=token_user_id(token), email=email, token=token)
+
+        self.users = list(await asyncio.gather(*(create(i) for i in range(self.args.users))))
+        if "ws" in self.mix or self.args.deliveries:
+            for user in self.users:
+                user.socket = await websockets.connect(f"{self.ws_url}?token={user.token}", max_queue=None)
+                self._readers.append(asyncio.create_task(self._read(user)))
+
+    async def _read(self, user: LoadUser):
+        prefix = f"lt {self.run_id} "
+        try:
+            async for raw in user.socket:
+                received = time.perf_counter()
+                try:
+                    frame = json.loads(raw)
+                except ValueError:
+                    self.recorder.error("ws_receive", "invalid_json")
+                    continue
+                if frame.get("type") == "ping":
+                    # heartbeat: the server closes sockets that stay silent
+                    await user.socket.send(json.dumps({"type": "pong"}))
+                    continue
+                if frame.get("type") == "ack":
+                    if user.ws_sent:
+                        self.recorder.latencies["ws"].append((received - user.ws_sent.popleft()) * 1000)
+                    continue
+                if "error" in frame:
+                    if user.ws_sent:
+                        user.ws_sent.popleft()
+                    self.recorder.error("ws", str(frame["error"]))
+                    continue
+                text = frame.get("message") or ""
+                if frame.get("receiver_id") == user.id and frame.get("user_id") != user.id and text.startswith(prefix):
+                    started = self.sent_at.pop(int(text[len(prefix):]), None)
+                    if started is not None:
+                        self.recorder.latencies["delivery"].append((received - started) * 1000)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _pair(self) -> tuple[LoadUser, LoadUser]:
+        if len(self.users) == 1:
+            return self.users[0], self.users[0]
+        return tuple(random.sample(self.users, 2))
+
+    async def _operation(self, client: httpx.AsyncClient, op: str):
+        user, peer = self._pair()
+        started = time.perf_counter()
+        if op in ("post", "post_file"):
+            seq, text = self._next_message()
+            files = None
+            if op == "post_file":
+                files = [("files", ("load.bin", os.urandom(self.args.file_size), "application/octet-stream"))]
+            self.sent_at[seq] = started
+            r = await client.post(
+                "/chat/messages", data={"message": text, "receiver_id": str(peer.id)}, files=files,
+                headers=user.headers,
+            )
+            if r.status_code != 200:
+                self.sent_at.pop(seq, None)
+                self.recorder.error(op, f"http_{r.status_code}")
+                return
+        elif op == "ws":
+            _, text = self._next_message()
+            user.ws_sent.append(started)
+            await user.socket.send(json.dumps({"type": "message", "receiver_id": peer.id, "message": text}))
+            return  # latency is recorded when the ack arrives
+        else:
+            r = await client.get(f"/chat/messages/{peer.id}", params={"limit": 50}, headers=user.headers)
+            if r.status_code != 200:
+                self.recorder.error(op, f"http_{r.status_code}")
+                return
+        self.recorder.ok(op, started)
+
+    async def _worker(self, client: httpx.AsyncClient, deadline: float):
+        ops, weights = zip(*self.mix.items())
+        while time.perf_counter() < deadline:
+            op = random.choices(ops, weights)[0]
+            try:
+                await self._operation(client, op)
+            except Exception as e:
+                self.recorder.error(op, type(e).__name__)
+            if self.args.think_time:
+                await asyncio.sleep(self.args.think_time / 1000)
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.args.timeout) as client:
+            await self.setup(client)
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(*(self._worker(client, deadline) for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+            # late acks and deliveries
+            await asyncio.sleep(self.args.drain)
+            for user in self.users:
+                if user.ws_sent:
+                    self.recorder.errors["ws"]["no_ack"] += len(user.ws_sent)
+                if user.socket is not None:
+                    await user.socket.close()
+            for reader in self._readers:
+                reader.cancel()
+            await asyncio.gather(*self._readers, return_exceptions=True)
+
+        return {
+            "run_id": self.run_id,
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                "url": self.base_url,
+                "users": self.args.users,
+                "concurrency": self.args.concurrency,
+                "duration": self.args.duration,
+                "mix": self.mix,
+                "file_size": self.args.file_size,
+            },
+            "elapsed": round(elapsed, 3),
+            "undelivered": len(self.sent_at) if self.args.deliveries else None,
+            "operations": self.recorder.summary(elapsed),
+        }
+
+
+def print_table(results: dict):
+    print(f"{'operation':<12}{'count':>8}{'err%':>8}{'ops/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}", file=sys.stderr)
+    for op, s in results["operations"].items():
+        cells = [f"{s[k]:.1f}" if s[k] is not None else "-" for k in ("p50", "p95", "p99")]
+        print(
+            f"{op:<12}{s['count']:>8}{s['error_rate'] * 100:>8.2f}{s['throughput']:>10.1f}"
+            f"{cells[0]:>10}{cells[1]:>10}{cells[2]:>10}",
+            file=sys.stderr,
+        )
+    if results["undelivered"]:
+        print(f"undelivered messages: {results['undelivered']}", file=sys.stderr)
+
+
+def spawn_server(url: str) -> subprocess.Popen:
+    parsed = urlparse(url)
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", parsed.hostname, "--port", str(parsed.port or 80)],
+        cwd=backend,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{url.rstrip('/')}/docs", timeout=1)
+            return server
+        except httpx.TransportError:
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=None, help="parallel workers, defaults to --users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"weights per operation (default {DEFAULT_MIX})")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="attachment bytes for post_file")
+    parser.add_argument("--think-time", type=float, default=0, help="ms each worker waits between operations")
+    parser.add_argument("--timeout", type=float, default=30, help="HTTP timeout in seconds")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for late acks and deliveries")
+    parser.add_argument("--setup-concurrency", type=int, default=10, help="parallel register/login requests")
+    parser.add_argument("--email-prefix", default="loadtest-")
+    parser.add_argument("--no-deliveries", dest="deliveries", action="store_false",
+                        help="do not open sockets for delivery latency unless ws is in the mix")
+    parser.add_argument("--spawn", action="store_true", help="start uvicorn main:app for the run")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or args.users
+
+    server = spawn_server(args.url) if args.spawn else None
+    try:
+        results = asyncio.run(LoadTest(args).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
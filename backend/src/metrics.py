@@ -0,0 +1,216 @@
+"""
+Prometheus metrics, served on GET /metrics when METRICS_ENABLED (behind METRICS_TOKEN if set).
+
+Hot paths only touch pre-created metric children: label values come from small fixed
+sets (route templates, HTTP methods, status classes, statement kinds, engine names)
+and the children are looked up in plain dicts. Gauges that describe current state
+(sockets, queue depths, cache sizes) are read from the components at scrape time.
+"""
+import hmac
+import time
+from typing import Callable, Iterable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, disable_created_metrics, generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.responses import Response
+from starlette.routing import Match
+
+from src.config import settings
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+STATEMENT_KINDS = ("select", "insert", "update", "delete", "other")
+UNMATCHED_ROUTE = "unmatched"
+HTTP_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+# no *_created series, they double the output without telling anything at scrape time
+disable_created_metrics()
+
+# buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+http_request_duration = Histogram(
+    "chat_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+ws_fanout_duration = Histogram(
+    "chat_ws_fanout_duration_seconds", "Time to hand one frame to the bus for all its receivers",
+    buckets=DB_BUCKETS,
+)
+ws_fanout_failures = Counter("chat_ws_fanout_failures_total", "Frames that could not be fanned out")
+attachment_bytes_written = Counter("chat_attachment_bytes_written_total", "Attachment bytes written to disk")
+attachment_bytes_deduplicated = Counter(
+    "chat_attachment_bytes_deduplicated_total", "Uploaded bytes not written because the content was stored already",
+)
+attachment_save_duration = Histogram(
+    "chat_attachment_save_duration_seconds", "Hashing and storing the attachments of one message",
+    buckets=LATENCY_BUCKETS,
+)
+db_query_duration = Histogram(
+    "chat_db_query_duration_seconds", "Statement execution time",
+    ["engine", "kind"], buckets=DB_BUCKETS,
+)
+db_query_errors = Counter("chat_db_query_errors_total", "Statements that raised", ["engine"])
+db_pool_checkout_wait = Histogram(
+    "chat_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    ["engine"], buckets=DB_BUCKETS,
+)
+
+
+def _status_class(status: int) -> str:
+    return STATUS_CLASSES[min(max(status // 100, 1), 5) - 1]
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing HTTP requests by route template (never by raw path).
+    The children for every route/method/status class are created on first use of
+    the app, so a request does two dict lookups and one observe().
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._children: dict[tuple[str, str, str], object] = {}
+        self._routes: list | None = None
+
+    def _prepare(self, scope):
+        self._routes = [r for r in scope["app"].routes if getattr(r, "methods", None)]
+        label_sets = [(method, route.path) for route in self._routes for method in route.methods]
+        label_sets += [(method, UNMATCHED_ROUTE) for method in HTTP_METHODS]
+        for method, path in label_sets:
+            for status in STATUS_CLASSES:
+                self._children[(method, path, status)] = http_request_duration.labels(method, path, status)
+
+    def _child(self, method: str, route: str, status: str):
+        child = self._children.get((method, route, status))
+        if child is None:
+            # unknown methods are folded into one label value to keep the series bounded
+            key = (method if (method, route, "2xx") in self._children else "OTHER", route, status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = http_request_duration.labels(*key)
+        return child
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._routes is None:
+            self._prepare(scope)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            if path is None:
+                path = self._match(scope)
+            self._child(scope["method"], path, _status_class(status)).observe(time.perf_counter() - started)
+
+    def _match(self, scope) -> str:
+        # mounts and 404s do not set scope["route"]
+        for route in self._routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return UNMATCHED_ROUTE
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool reporting how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_metrics_engine("primary")
+
+    def set_metrics_engine(self, name: str):
+        self._metrics_engine = name
+        self._checkout_wait = db_pool_checkout_wait.labels(name)
+
+    def recreate(self):
+        # engine.dispose() swaps the pool, keep its label
+        pool = super().recreate()
+        pool.set_metrics_engine(self._metrics_engine)
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self._checkout_wait.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine: AsyncEngine, name: str):
+    """Statement timings and errors of one engine, labelled with `name`."""
+    sync_engine = engine.sync_engine
+    if isinstance(sync_engine.pool, TimedQueuePool):
+        sync_engine.pool.set_metrics_engine(name)
+    children = {kind: db_query_duration.labels(name, kind) for kind in STATEMENT_KINDS}
+    errors = db_query_errors.labels(name)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+        kind = statement.lstrip()[:6].lower()
+        children.get(kind, children["other"]).observe(elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        errors.inc()
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_start"):
+            conn.info["metrics_start"].pop()
+
+
+class StatsCollector:
+    """
+    Exposes the stats() dicts the components already keep (connection manager,
+    caches, queues) at scrape time. Keys listed in `counters` are monotonic.
+    """
+
+    def __init__(self):
+        self._sources: list[tuple[str, Callable[[], dict], frozenset]] = []
+
+    def add(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = ()):
+        self._sources.append((prefix, stats, frozenset(counters)))
+
+    def collect(self):
+        for prefix, stats, counters in self._sources:
+            for key, value in stats().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                if key in counters:
+                    yield CounterMetricFamily(name, f"{prefix} {key}", value=value)
+                else:
+                    yield GaugeMetricFamily(name, f"{prefix} {key}", value=value)
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+async def metrics_endpoint(request) -> Response:
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+            return Response(status_code=401, headers={"www-authenticate": "Bearer"})
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,241 @@
+"""
+Opt-in request profiling.
+
+A profiled HTTP request or WebSocket frame records its SQL statements with timings
+and a sampling profile: a background thread looks at the event loop thread's stack
+every PROFILING_INTERVAL_MS and counts its stack whenever the profiled request's task
+is the one running (collapsed "file:function:line;..." keys, flamegraph compatible).
+Matching on the task rather than on frames also covers the ORM work SQLAlchemy runs
+in greenlets. While a profile is active the GIL switch interval is lowered, so the
+sampler gets to run in the middle of CPU-bound stretches, not only when the loop idles. Time spent awaiting I/O does not show up in the samples, it shows up
+in the SQL timings.
+
+Requests (and WebSocket handshakes) are profiled when they carry the
+`X-Profile: <PROFILING_TOKEN>` header or are picked by PROFILING_SAMPLE_RATE. The slowest
+PROFILING_KEEP profiles are kept in memory for GET /admin/profiles.
+
+With PROFILING_ENABLED off nothing is installed: no middleware, no engine listeners,
+no sampler thread; WebSocket frames only check `profiler.enabled`.
+"""
+import asyncio
+import heapq
+import hmac
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+MAX_STACK_DEPTH = 64
+MAX_SQL_STATEMENTS = 500
+MAX_STACKS = 50
+SAMPLING_SWITCH_INTERVAL = 0.0005  # seconds
+
+_current: ContextVar["Profile | None"] = ContextVar("profile", default=None)
+
+
+class Profile:
+    def __init__(self, profile_id: int, kind: str, name: str, task: asyncio.Task):
+        self.id = profile_id
+        self.kind = kind  # "http" or "ws"
+        self.name = name
+        self.task = task  # a sample counts when this task is running
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self.status: int | str | None = None
+        self.sql: list[tuple[str, float]] = []
+        self.samples: Counter = Counter()
+        self.context_token = None
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 2),
+            "status": self.status,
+            "sql_count": len(self.sql),
+            "sql_ms": round(sum(ms for _, ms in self.sql), 2),
+            "samples": sum(self.samples.values()),
+        }
+
+    def detail(self) -> dict:
+        return {
+            **self.summary(),
+            "sql": [{"statement": s, "ms": round(ms, 3)} for s, ms in self.sql],
+            "stacks": [{"stack": stack, "samples": n} for stack, n in self.samples.most_common(MAX_STACKS)],
+        }
+
+
+class Profiler:
+    def __init__(self, enabled: bool, token: str | None, sample_rate: float, interval_ms: float, keep: int):
+        self.enabled = enabled
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._active: list[Profile] = []
+        self._slowest: list[tuple[float, int, Profile]] = []  # min-heap on duration
+        self._wake = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._switch_interval: float | None = None
+
+    def requested(self, value: str | None) -> bool:
+        """The admin token was sent with the request."""
+        return bool(value and self.token and hmac.compare_digest(value, self.token))
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def should_profile(self, requested: str | None) -> bool:
+        return self.requested(requested) or self.sampled()
+
+    def start(self, kind: str, name: str) -> Profile:
+        """Profile the current task until finish()."""
+        profile = Profile(next(self._ids), kind, name, asyncio.current_task())
+        profile.context_token = _current.set(profile)
+        with self._lock:
+            if not self._active:
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch_interval, SAMPLING_SWITCH_INTERVAL))
+            self._active.append(profile)
+        if self._sampler is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        self._wake.set()
+        return profile
+
+    def finish(self, profile: Profile, status: int | str | None = None):
+        profile.duration_ms = (time.perf_counter() - profile.started) * 1000
+        profile.status = status
+        _current.reset(profile.context_token)
+        with self._lock:
+            self._active.remove(profile)
+            if not self._active:
+                self._wake.clear()
+                sys.setswitchinterval(self._switch_interval)
+            entry = (profile.duration_ms, profile.id, profile)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+        profile.task = None
+
+    def slowest(self) -> list[Profile]:
+        with self._lock:
+            return [p for _, _, p in sorted(self._slowest, reverse=True)]
+
+    def get(self, profile_id: int) -> Profile | None:
+        with self._lock:
+            return next((p for _, i, p in self._slowest if i == profile_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._slowest.clear()
+
+    def _sample_loop(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            running = asyncio.current_task(self._loop)
+            frame = sys._current_frames().get(self._loop_thread)
+            if running is None or frame is None:
+                continue
+            with self._lock:
+                profile = next((p for p in self._active if p.task is running), None)
+                if profile is None:
+                    continue
+                keys = []
+                while frame is not None and len(keys) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    keys.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                profile.samples[";".join(reversed(keys))] += 1
+            del frame
+
+    def instrument_engine(self, engine: AsyncEngine):
+        """Record statements executed while a profile is active in the current context."""
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def _start(conn, cursor, statement, parameters, context, executemany):
+            if _current.get() is not None:
+                conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def _stop(conn, cursor, statement, parameters, context, executemany):
+            profile = _current.get()
+            if profile is None or not conn.info.get("profile_start"):
+                return
+            elapsed_ms = (time.perf_counter() - conn.info["profile_start"].pop()) * 1000
+            if len(profile.sql) < MAX_SQL_STATEMENTS:
+                profile.sql.append((" ".join(statement.split()), elapsed_ms))
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware profiling the HTTP requests picked by the profiler."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                requested = value.decode("latin-1")
+                break
+        if not self.profiler.should_profile(requested):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start("http", f"{scope['method']} {scope['path']}")
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-profile-id", str(profile.id).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                profile.name = f"{scope['method']} {route.path}"
+            self.profiler.finish(profile, status)
+
+
+profiler = Profiler(
+    enabled=settings.PROFILING_ENABLED,
+    token=settings.PROFILING_TOKEN,
+    sample_rate=settings.PROFILING_SAMPLE_RATE,
+    interval_ms=settings.PROFILING_INTERVAL_MS,
+    keep=settings.PROFILING_KEEP,
+)
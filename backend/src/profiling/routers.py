@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import get_async_session
+from src.profiling.profiler import profiler
+from src.user.manager import get_current_user_id
+from src.user.models import User
+
+router = APIRouter(prefix="/admin/profiles", tags=["Admin"])
+
+
+async def require_superuser(
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+) -> int:
+    user = await session.get(User, int(user_id))
+    if user is None or not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user.id
+
+
+@router.get("")
+async def list_profiles(admin_id: int = Depends(require_superuser)):
+    """Slowest profiled requests and WebSocket frames first."""
+    return [p.summary() for p in profiler.slowest()]
+
+
+@router.get("/{profile_id}")
+async def get_profile(profile_id: int, admin_id: int = Depends(require_superuser)):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.detail()
+
+
+@router.delete("")
+async def clear_profiles(admin_id: int = Depends(require_superuser)):
+    profiler.clear()
+    return {"status": "cleared"}
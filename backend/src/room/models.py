@@ -0,0 +1,40 @@
+from sqlalchemy import Integer, String, TIMESTAMP, ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from datetime import datetime
+from src.user.models import User
+from src.database import Base
+
+
+class Room(Base):
+    __tablename__ = "room"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(length=100), nullable=False)
+    created_by: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+
+class RoomMember(Base):
+    __tablename__ = "room_member"
+    room_id: Mapped[int] = mapped_column(Integer, ForeignKey(Room.id), primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), primary_key=True)
+    joined_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # rooms of a user; members of a room are the primary key range
+        Index("ix_room_member_user_id", "user_id"),
+    )
+
+
+class RoomMessage(Base):
+    __tablename__ = "room_message"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    room_id: Mapped[int] = mapped_column(Integer, ForeignKey(Room.id), nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey(User.id), nullable=False)  # автор
+    message: Mapped[str] = mapped_column(String(length=500), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # keyset pagination of a room's history
+        Index("ix_room_message_room_id_id", "room_id", "id"),
+    )
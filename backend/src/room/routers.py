@@ -0,0 +1,188 @@
+from typing import List, Optional
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.cache import TTLCache
+from src.chat.ws_routers import manager
+from src.config import settings
+from src.database import async_session_maker, dialect_insert, get_async_session, mark_written
+from src.room.models import Room, RoomMember, RoomMessage
+from src.room.schemas import (
+    RoomCreate, RoomMessageCreate, RoomMessageEvent, RoomMessagePage, RoomMessageRead, RoomRead,
+)
+from src.user.manager import get_current_user_id, get_read_session
+
+import logging
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/rooms", tags=["Rooms"])
+
+ROOM_HISTORY_PAGE_SIZE = 50
+ROOM_HISTORY_MAX_PAGE_SIZE = 200
+
+# room id -> frozenset of member ids, dropped in every worker on join/leave (through the WS bus)
+room_members_cache = TTLCache(maxsize=settings.ROOM_MEMBERS_CACHE_SIZE, ttl=settings.ROOM_MEMBERS_CACHE_TTL)
+manager.bus.add_invalidator("room_members", lambda room_id: room_members_cache.pop(int(room_id)))
+
+
+async def room_members(room_id: int) -> frozenset[int]:
+    members = room_members_cache.get(room_id)
+    if members is None:
+        # always from the primary: a lagging replica would get cached for ROOM_MEMBERS_CACHE_TTL
+        async with async_session_maker() as session:
+            result = await session.execute(select(RoomMember.user_id).where(RoomMember.room_id == room_id))
+            members = frozenset(result.scalars().all())
+        room_members_cache.set(room_id, members)
+    return members
+
+
+async def require_member(room_id: int, user_id: int):
+    if user_id not in await room_members(room_id):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+
+async def invalidate_room_members(room_id: int):
+    """
+    Called before and after a membership change commits: a lookup running between
+    the two may cache the old members again, the second call drops them.
+    """
+    try:
+        await manager.bus.invalidate("room_members", str(room_id))
+    except Exception:
+        # dropped in this worker already, the others catch up after ROOM_MEMBERS_CACHE_TTL
+        logger.exception(f"Failed to publish the membership change of room {room_id}")
+
+
+@router.post("", response_model=RoomRead)
+async def create_room(
+    room_data: RoomCreate,
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = int(user_id)
+    async with session.begin():
+        room = Room(name=room_data.name, created_by=user_id, created_at=datetime.utcnow())
+        session.add(room)
+        await session.flush()
+        # a lookup of the id before the room existed may have cached no members
+        await invalidate_room_members(room.id)
+        session.add(RoomMember(room_id=room.id, user_id=user_id, joined_at=room.created_at))
+    await invalidate_room_members(room.id)
+    await mark_written(user_id)
+    return room
+
+
+@router.get("", response_model=List[RoomRead])
+async def get_my_rooms(
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    result = await session.execute(
+        select(Room)
+        .join(RoomMember, RoomMember.room_id == Room.id)
+        .where(RoomMember.user_id == int(user_id))
+        .order_by(Room.id)
+    )
+    return result.scalars().all()
+
+
+@router.post("/{room_id}/join", response_model=RoomRead)
+async def join_room(
+    room_id: int,
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = int(user_id)
+    room = await session.get(Room, room_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    await invalidate_room_members(room_id)
+    insert = dialect_insert(session)
+    await session.execute(
+        insert(RoomMember)
+        .values(room_id=room_id, user_id=user_id, joined_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[RoomMember.room_id, RoomMember.user_id])
+    )
+    await session.commit()
+    await invalidate_room_members(room_id)
+    await mark_written(user_id)
+    return room
+
+
+@router.post("/{room_id}/leave")
+async def leave_room(
+    room_id: int,
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = int(user_id)
+    await invalidate_room_members(room_id)
+    await session.execute(
+        delete(RoomMember).where(RoomMember.room_id == room_id, RoomMember.user_id == user_id)
+    )
+    await session.commit()
+    await invalidate_room_members(room_id)
+    await mark_written(user_id)
+    return {"status": "left", "room_id": room_id}
+
+
+@router.get("/{room_id}/members", response_model=List[int])
+async def get_room_members(
+    room_id: int,
+    user_id: int = Depends(get_current_user_id),
+):
+    await require_member(room_id, int(user_id))
+    return sorted(await room_members(room_id))
+
+
+@router.post("/{room_id}/messages", response_model=RoomMessageRead)
+async def create_room_message(
+    room_id: int,
+    message_data: RoomMessageCreate,
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = int(user_id)
+    # members come from the cache: no membership query per message
+    members = await room_members(room_id)
+    if user_id not in members:
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+    msg = RoomMessage(room_id=room_id, user_id=user_id, message=message_data.message, created_at=datetime.utcnow())
+    session.add(msg)
+    await session.commit()
+    await mark_written(user_id)
+
+    msg_read = RoomMessageRead.model_validate(msg)
+    # encoded once, the same frame goes to every socket of every member;
+    # published in the background, the response does not wait for the bus
+    manager.fan_out(RoomMessageEvent.model_validate(msg).model_dump_json(), members)
+    return msg_read
+
+
+@router.get("/{room_id}/messages", response_model=RoomMessagePage)
+async def get_room_history(
+    room_id: int,
+    before: Optional[int] = Query(None, description="next_before from a previous page"),
+    limit: int = Query(ROOM_HISTORY_PAGE_SIZE, ge=1, le=ROOM_HISTORY_MAX_PAGE_SIZE),
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    await require_member(room_id, int(user_id))
+
+    # index range scan on (room_id, id)
+    stmt = select(RoomMessage).where(RoomMessage.room_id == room_id)
+    if before is not None:
+        stmt = stmt.where(RoomMessage.id < before)
+    result = await session.execute(stmt.order_by(RoomMessage.id.desc()).limit(limit + 1))
+    messages = list(result.scalars().all())
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    return RoomMessagePage(
+        items=[RoomMessageRead.model_validate(m) for m in messages],
+        next_before=messages[-1].id if has_more and messages else None,
+    )
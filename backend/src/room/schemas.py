@@ -0,0 +1,49 @@
+from typing import Optional, List
+
+from pydantic import BaseModel, Field, ConfigDict, field_serializer
+from datetime import datetime
+
+
+class RoomCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+
+
+class RoomRead(BaseModel):
+    id: int
+    name: str
+    created_by: int
+    created_at: datetime
+
+    @field_serializer("created_at")
+    def serialize_created_at(self, value: datetime):
+        return value.isoformat()
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RoomMessageCreate(BaseModel):
+    message: str = Field(..., min_length=1, max_length=500)
+
+
+class RoomMessageRead(BaseModel):
+    id: int
+    room_id: int
+    user_id: int
+    message: str
+    created_at: datetime
+
+    @field_serializer("created_at")
+    def serialize_created_at(self, value: datetime):
+        return value.isoformat()
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RoomMessageEvent(RoomMessageRead):
+    """WS frame of a new room message."""
+    type: str = Field("room_message")
+
+
+class RoomMessagePage(BaseModel):
+    items: List[RoomMessageRead] = []  # newest first
+    next_before: Optional[int] = None  # pass back as ?before=
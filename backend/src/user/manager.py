@@ -1,11 +1,13 @@
-from typing import Optional
+from typing import AsyncGenerator, Optional
 
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, IntegerIDMixin
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.authentication_config import oauth2_scheme, decode_token
 from src.user.models import User, get_user_db
 from src.config import settings
+from src.database import get_read_session as _get_read_session
 
 
 SECRET = settings.USER_MANAGER_SECRET_KEY
@@ -36,3 +38,12 @@ def get_current_user_id(token: str = Depends(oauth2_scheme)):
     payload = decode_token(token, expected_type="access")
     user_id: str = payload.get("sub")
     return user_id
+
+
+async def get_read_session(user_id: str = Depends(get_current_user_id)) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only endpoints: a replica, unless the current user wrote
+    something recently (read-your-writes), then the primary.
+    """
+    async for session in _get_read_session(int(user_id)):
+        yield session
@@ -2,7 +2,7 @@ from fastapi import Depends
 from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable
 
-from sqlalchemy import Integer, String, TIMESTAMP, Boolean
+from sqlalchemy import Integer, String, TIMESTAMP, Boolean, Index, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -17,12 +17,19 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     first_name: Mapped[str] = mapped_column(String(length=50), nullable=False)
     last_name: Mapped[str] = mapped_column(String(length=50), nullable=False)
     email: Mapped[str] = mapped_column(String(length=50), unique=True, index=True, nullable=False)
-    hashed_password: Mapped[str] = mapped_column(String(length=50), nullable=False)
+    hashed_password: Mapped[str] = mapped_column(String(length=255), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     is_superuser: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     is_verified: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     registered_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # case-insensitive prefix search of the user directory
+        Index("ix_user_first_name_lower", func.lower(first_name)),
+        Index("ix_user_last_name_lower", func.lower(last_name)),
+        Index("ix_user_email_lower", func.lower(email)),
+    )
+
 
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
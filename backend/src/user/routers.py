@@ -1,17 +1,40 @@
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
-from sqlalchemy import select
+from sqlalchemy import select, or_, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.cache import TTLCache
+from src.chat.ws_routers import manager
+from src.config import settings
 from src.database import get_async_session
 from src.auth.authentication_config import get_password_hash
 from src.user import schemas, models
-from src.user.manager import get_current_user_id
+from src.user.manager import get_current_user_id, get_read_session
 
+import logging
+logger = logging.getLogger(__name__)
 router = APIRouter(tags=["user"])
 
+USERS_PAGE_SIZE = 50
+USERS_MAX_PAGE_SIZE = 200
+
+# UserRead by id, and (q, after, limit, caller) -> (ids, next_after); both dropped in every
+# worker on register/update (through the WS bus)
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+user_search_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+def _invalidate_local(user_id: str):
+    if user_id:
+        user_cache.pop(int(user_id))
+    # any search page may now be missing or showing the user
+    user_search_cache.clear()
+
+
+manager.bus.add_invalidator("users", _invalidate_local)
+
 
 @router.post("/register", response_model=schemas.UserRead)
 async def register(user: schemas.UserCreate, session: AsyncSession = Depends(get_async_session)):
@@ -24,11 +47,12 @@ async def register(user: schemas.UserCreate, session: AsyncSession = Depends(get
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
-        hashed_password=get_password_hash(user.password)
+        hashed_password=await get_password_hash(user.password)
     )
     session.add(db_user)
     await session.commit()
     await session.refresh(db_user)
+    await invalidate_user_cache(db_user.id)
     return db_user
 
 
@@ -43,20 +67,89 @@ async def update_user(user: schemas.UserUpdate, session: AsyncSession = Depends(
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
-        hashed_password=get_password_hash(user.password)
+        hashed_password=await get_password_hash(user.password)
     )
     session.add(db_user)
     await session.commit()
     await session.refresh(db_user)
+    await invalidate_user_cache(db_user.id)
     return db_user
 
 
-@router.get("/users", response_model=List[schemas.UserRead])
+async def invalidate_user_cache(user_id: int | None = None):
+    try:
+        await manager.bus.invalidate("users", "" if user_id is None else str(user_id))
+    except Exception:
+        # dropped in this worker already, the others catch up after USER_CACHE_TTL
+        logger.exception(f"Failed to publish the change of user {user_id}")
+
+
+async def _get_users_by_ids(user_ids: list[int], session: AsyncSession) -> dict[int, schemas.UserRead]:
+    found: dict[int, schemas.UserRead] = {}
+    missing = []
+    for user_id in user_ids:
+        user = user_cache.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = user
+    if missing:
+        result = await session.execute(select(models.User).where(models.User.id.in_(missing)))
+        for db_user in result.scalars().all():
+            user = schemas.UserRead.model_validate(db_user, from_attributes=True)
+            user_cache.set(user.id, user)
+            found[user.id] = user
+    return found
+
+
+def _prefix_filter(q: str):
+    # range instead of LIKE so the lower(...) indexes are used on SQLite and Postgres alike
+    prefix = q.lower()
+    upper = prefix + "\uffff"
+    return or_(*(
+        and_(func.lower(column) >= prefix, func.lower(column) < upper)
+        for column in (models.User.first_name, models.User.last_name, models.User.email)
+    ))
+
+
+@router.get("/users", response_model=schemas.UserPage)
 async def get_users(
+    q: Optional[str] = Query(None, max_length=50, description="Prefix of first name, last name or email"),
+    ids: Optional[str] = Query(None, description="Comma separated user ids, returns just these users"),
+    after: Optional[int] = Query(None, description="next_after from the previous page"),
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
     user_id: int = Depends(get_current_user_id),
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
-    stmt = select(models.User).where(models.User.id != user_id)
-    result = await session.execute(stmt)
-    users = result.scalars().all()
-    return users
+    if ids is not None:
+        try:
+            user_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma separated integers")
+        if len(user_ids) > USERS_MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"At most {USERS_MAX_PAGE_SIZE} ids per request")
+        found = await _get_users_by_ids(user_ids, session)
+        return schemas.UserPage(items=[found[i] for i in user_ids if i in found])
+
+    me = int(user_id)
+    key = (q.lower() if q else None, after, limit, me)
+    page = user_search_cache.get(key)
+    if page is None:
+        # the caller is left out by the query, pages stay full
+        stmt = select(models.User.id).where(models.User.id != me)
+        if q:
+            stmt = stmt.where(_prefix_filter(q))
+        if after is not None:
+            stmt = stmt.where(models.User.id > after)
+        result = await session.execute(stmt.order_by(models.User.id).limit(limit + 1))
+        page_ids = list(result.scalars().all())
+        next_after = page_ids[limit - 1] if len(page_ids) > limit else None
+        page = (page_ids[:limit], next_after)
+        user_search_cache.set(key, page)
+
+    page_ids, next_after = page
+    found = await _get_users_by_ids(page_ids, session)
+    return schemas.UserPage(
+        items=[found[i] for i in page_ids if i in found],
+        next_after=next_after,
+    )
@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 from fastapi_users import schemas
-from pydantic import EmailStr, Field, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 from src.user.utils import validate_password_complexity
 
@@ -14,6 +14,11 @@ class UserRead(schemas.BaseUser[int]):
     is_verified: bool
 
 
+class UserPage(BaseModel):
+    items: List[UserRead] = []
+    next_after: Optional[int] = None  # pass back as ?after=
+
+
 class UserCreate(schemas.BaseUserCreate):
     first_name: str = Field(..., max_length=50)
     last_name: str = Field(..., max_length=50)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import time
+
+import fakeredis
+import pytest
+
+from src.chat.bus import RedisBus
+from src.chat.ws_routers import ConnectionManager
+
+# a real Redis for the multi-process test, which is skipped when it cannot be reached
+TEST_REDIS_URL = os.environ.get("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.scope = {"type": "websocket", "subprotocols": []}
+        self.sent: list[str] = []
+        self.received = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame: str):
+        self.sent.append(frame)
+        self.received.set()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def test_redis_bus_delivers_across_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        # two workers: separate managers and buses, one Redis
+        workers = [
+            ConnectionManager(RedisBus("redis://", client=fakeredis.aioredis.FakeRedis(server=server)))
+            for _ in range(2)
+        ]
+        for manager in workers:
+            await manager.start()
+        try:
+            receiver_socket, sender_socket = FakeWebSocket(), FakeWebSocket()
+            await workers[0].connect(1, receiver_socket)
+            await workers[1].connect(2, sender_socket)
+            await asyncio.sleep(0.1)  # let the subscriptions settle
+
+            await workers[1].broadcast('{"id": 7}', (1, 2), key=7)
+            await asyncio.wait_for(receiver_socket.received.wait(), timeout=5)
+            await asyncio.wait_for(sender_socket.received.wait(), timeout=5)
+            assert receiver_socket.sent == ['{"id": 7}']
+            assert sender_socket.sent == ['{"id": 7}']
+
+            # nobody connected for user 3: nothing is delivered anywhere
+            await workers[0].send_personal_message('{"id": 8}', 3)
+            await asyncio.sleep(0.2)
+            assert receiver_socket.sent == ['{"id": 7}']
+        finally:
+            for manager in workers:
+                await manager.stop()
+
+    asyncio.run(run())
+
+
+def _worker_process(url: str, user_id: int, frames: int, ready, results):
+    """One worker: its own event loop, ConnectionManager and Redis connection, one socket of `user_id`."""
+    async def run():
+        manager = ConnectionManager(RedisBus(url))
+        await manager.start()
+        socket = FakeWebSocket()
+        await manager.connect(user_id, socket)
+        await asyncio.sleep(0.1)  # let the subscription settle
+        ready.set()
+        received = []
+        try:
+            while len(received) < frames:
+                await asyncio.wait_for(socket.received.wait(), timeout=10)
+                socket.received.clear()
+                now = time.time()
+                while socket.sent:
+                    frame = json.loads(socket.sent.pop(0))
+                    received.append((frame["id"], now - frame["sent_at"]))
+        finally:
+            results.put((user_id, received))
+            await manager.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_bus_delivers_across_worker_processes():
+    import redis.asyncio as redis
+
+    async def ping():
+        client = redis.from_url(TEST_REDIS_URL)
+        try:
+            await client.ping()
+        finally:
+            await client.aclose()
+
+    try:
+        asyncio.run(ping())
+    except Exception as e:
+        pytest.skip(f"no Redis at {TEST_REDIS_URL}: {e!r}")
+
+    frames = 50
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = []
+    for user_id in (1, 2):
+        ready = context.Event()
+        process = context.Process(target=_worker_process, args=(TEST_REDIS_URL, user_id, frames, ready, results))
+        process.start()
+        workers.append((process, ready))
+
+    async def send():
+        # a third worker: publishes only, holds no socket
+        bus = RedisBus(TEST_REDIS_URL)
+        await bus.start(deliver=None)
+        try:
+            for i in range(frames):
+                frame = json.dumps({"id": i, "sent_at": time.time()})
+                await bus.publish_many((1, 2), frame, key=i)
+                await asyncio.sleep(0.01)
+        finally:
+            await bus.stop()
+
+    try:
+        for process, ready in workers:
+            assert ready.wait(timeout=30), "worker did not start"
+        asyncio.run(send())
+        received = dict(results.get(timeout=30) for _ in workers)
+    finally:
+        for process, _ in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    for user_id in (1, 2):
+        ids = [frame_id for frame_id, _ in received[user_id]]
+        latencies = [latency for _, latency in received[user_id]]
+        assert ids == list(range(frames))  # every frame, in order
+        assert statistics.median(latencies) < 0.05
+        assert max(latencies) < 0.5
+
+
+def test_redis_bus_invalidates_caches_across_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        buses = [RedisBus("redis://", client=fakeredis.aioredis.FakeRedis(server=server)) for _ in range(2)]
+        caches = [{"7": "members", "8": "members"} for _ in buses]
+        for bus, cache in zip(buses, caches):
+            bus.add_invalidator("room_members", lambda key, cache=cache: cache.pop(key, None))
+            await bus.start(deliver=None)
+        try:
+            await asyncio.sleep(0.1)
+            await buses[0].invalidate("room_members", "7")
+            assert "7" not in caches[0]  # right away in the publishing worker
+            for _ in range(50):
+                if "7" not in caches[1]:
+                    break
+                await asyncio.sleep(0.05)
+            assert caches[1] == {"8": "members"}
+        finally:
+            for bus in buses:
+                await bus.stop()
+
+    asyncio.run(run())
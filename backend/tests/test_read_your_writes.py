@@ -0,0 +1,64 @@
+import asyncio
+import itertools
+import os
+
+import fakeredis
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src import database
+from src.database import RecentWriters, make_engine
+
+
+def test_reads_go_to_the_replica_unless_the_user_wrote_recently(monkeypatch, tmp_path):
+    async def run():
+        # two SQLite files: the primary and a stand-in replica, told apart by their content
+        engines = {}
+        for name in ("primary", "replica"):
+            engines[name] = make_engine(f"sqlite+aiosqlite:///{os.path.join(tmp_path, name + '.db')}", name)
+            async with engines[name].begin() as conn:
+                await conn.execute(text("CREATE TABLE node (name TEXT)"))
+                await conn.execute(text("INSERT INTO node VALUES (:name)"), {"name": name})
+        primary = async_sessionmaker(engines["primary"], expire_on_commit=False)
+        replica = async_sessionmaker(engines["replica"], expire_on_commit=False)
+        monkeypatch.setattr(database, "async_session_maker", primary)
+        monkeypatch.setattr(database, "replica_session_makers", [replica])
+        monkeypatch.setattr(database, "_next_replica", itertools.cycle([replica]))
+        monkeypatch.setattr(database, "recent_writers", RecentWriters(ttl=0.5))
+
+        async def read_from(user_id: int) -> str:
+            async for session in database.get_read_session(user_id):
+                return await session.scalar(text("SELECT name FROM node"))
+
+        try:
+            assert await read_from(1) == "replica"
+            await database.mark_written(1)
+            assert await read_from(1) == "primary"
+            assert await read_from(2) == "replica"  # only the writer
+            await asyncio.sleep(0.6)
+            assert await read_from(1) == "replica"  # the replicas caught up
+        finally:
+            for engine in engines.values():
+                await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_recent_writes_are_shared_between_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        # two workers, one Redis
+        workers = [
+            RecentWriters(ttl=0.5, client=fakeredis.aioredis.FakeRedis(server=server)) for _ in range(2)
+        ]
+        try:
+            await workers[0].mark(1)
+            assert await workers[1].contains(1)
+            assert not await workers[1].contains(2)
+            await asyncio.sleep(0.6)
+            assert not await workers[1].contains(1)
+        finally:
+            for worker in workers:
+                await worker.close()
+
+    asyncio.run(run())
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import src.attachment.models, src.room.models, src.user.models  # noqa: F401 (tables)
+from src.chat import writer as writer_module
+from src.chat.models import Message
+from src.chat.writer import MessageWriter
+from src.database import Base, make_engine
+
+
+def test_poisoned_message_does_not_lose_its_batch(monkeypatch, tmp_path):
+    record_pending = writer_module.record_pending
+
+    async def failing_record_pending(session, messages):
+        # fails after the flush: the messages already have ids when the batch rolls back
+        if any(msg.message == "poison" for msg in messages):
+            raise RuntimeError("poisoned")
+        await record_pending(session, messages)
+
+    monkeypatch.setattr(writer_module, "record_pending", failing_record_pending)
+
+    async def run():
+        engine = make_engine(f"sqlite+aiosqlite:///{os.path.join(tmp_path, 'writer.db')}", "test")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = MessageWriter(
+            async_sessionmaker(engine, expire_on_commit=False), max_batch=10, flush_interval=0.05, max_pending=100,
+        )
+        insert = writer._insert
+        failures = []
+
+        async def insert_after_concurrent_write(messages):
+            if len(failures) == 1:
+                # between the failed batch and its retries another writer (POST /chat/messages)
+                # commits and takes the ids the batch had before it rolled back
+                failures.append(None)
+                async with engine.begin() as conn:
+                    await conn.execute(Message.__table__.insert().values(
+                        message="http", user_id=3, receiver_id=4, created_at=datetime.utcnow(),
+                    ))
+            try:
+                await insert(messages)
+            except Exception:
+                failures.append(None)
+                raise
+
+        writer._insert = insert_after_concurrent_write
+        await writer.start()
+        try:
+            texts = ["m0", "m1", "poison", "m3", "m4"]
+            futures = [
+                await writer.submit(Message(message=text, user_id=1, receiver_id=2, created_at=datetime.utcnow(),
+                                            attachments=[]))
+                for text in texts
+            ]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        finally:
+            await writer.stop()
+
+        try:
+            assert isinstance(results[2], Exception)
+            committed = [results[i] for i in (0, 1, 3, 4)]
+            assert [msg.message for msg in committed] == ["m0", "m1", "m3", "m4"]
+
+            async with engine.connect() as conn:
+                rows = (await conn.execute(select(Message.id, Message.message).order_by(Message.id))).all()
+            assert [text for _, text in rows] == ["http", "m0", "m1", "m3", "m4"]
+            # the futures carry the ids the rows got
+            assert [msg.id for msg in committed] == [row_id for row_id, _ in rows[1:]]
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import AxiosInstance from "../../api/AxiosInstance";
 import { Paperclip, SquarePen, Trash2, Check } from "lucide-react";
 import Cookies from "js-cookie";
@@ -34,6 +34,11 @@ type Message = {
 
 export default function ChatPage() {
   const [users, setUsers] = useState<User[]>([]);
+  const [userQuery, setUserQuery] = useState("");
+  const [usersNextAfter, setUsersNextAfter] = useState<number | null>(null);
+  const [loadingUsers, setLoadingUsers] = useState(false);
+  // ответы на устаревший поиск игнорируются
+  const userQueryRef = useRef("");
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
   const [socket, setSocket] = useState<WebSocket | null>(null);
@@ -67,6 +72,12 @@ export default function ChatPage() {
       const data = JSON.parse(event.data);
       if (!data) return;
 
+      // Heartbeat: без ответа сервер закрывает соединение
+      if (data.type === "ping") {
+        ws.send(JSON.stringify({ type: "pong" }));
+        return;
+      }
+
       // Обработка нового сообщения
       if (data.user_id && data.receiver_id && selectedUser) {
         const isRelevant =
@@ -96,15 +107,45 @@ export default function ChatPage() {
     };
   }, [token]);
 
-  // Загружаем список пользователей
+  // Загружаем список пользователей страницами: ?q= ищет по префиксу, ?after= — следующая страница
+  const loadUsers = useCallback(
+    async (q: string, after: number | null) => {
+      if (!token) return;
+      setLoadingUsers(true);
+      try {
+        const res = await AxiosInstance.get("/users", {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { q: q || undefined, after: after ?? undefined },
+        });
+        if (userQueryRef.current !== q) return;
+        setUsers((prev) => (after === null ? res.data.items : [...prev, ...res.data.items]));
+        setUsersNextAfter(res.data.next_after ?? null);
+      } catch (err) {
+        console.error(err);
+      } finally {
+        if (userQueryRef.current === q) setLoadingUsers(false);
+      }
+    },
+    [token]
+  );
+
+  // Первая страница при входе и при каждом новом поиске (с задержкой, пока пользователь печатает)
   useEffect(() => {
-    if (!token) return;
-    AxiosInstance.get("/users", {
-      headers: { Authorization: `Bearer ${token}` },
-    })
-      .then((res) => setUsers(res.data))
-      .catch(console.error);
-  }, [token]);
+    const q = userQuery.trim();
+    userQueryRef.current = q;
+    const timer = setTimeout(() => loadUsers(q, null), 300);
+    return () => clearTimeout(timer);
+  }, [userQuery, loadUsers]);
+
+  const loadMoreUsers = () => {
+    if (usersNextAfter === null || loadingUsers) return;
+    loadUsers(userQueryRef.current, usersNextAfter);
+  };
+
+  const handleUsersScroll = (e: React.UIEvent<HTMLUListElement>) => {
+    const el = e.currentTarget;
+    if (el.scrollHeight - el.scrollTop - el.clientHeight < 100) loadMoreUsers();
+  };
 
   // Загружаем историю сообщений при смене пользователя
   useEffect(() => {
@@ -113,7 +154,8 @@ export default function ChatPage() {
     AxiosInstance.get(`/chat/messages/${selectedUser.id}`, {
       headers: { Authorization: `Bearer ${token}` },
     })
-      .then((res) => setMessages(res.data))
+      // история приходит страницами, новые сообщения первыми
+      .then((res) => setMessages([...res.data.items].reverse()))
       .catch(console.error);
   }, [selectedUser, token]);
 
@@ -157,6 +199,24 @@ export default function ChatPage() {
     }
   };
 
+  // Токен не попадает в URL: сервер выдаёт короткоживущую ссылку только на это вложение.
+  // Окно открывается сразу, иначе его заблокирует браузер, адрес подставляется после запроса.
+  const openAttachment = async (a: Attachment) => {
+    const win = window.open("", "_blank");
+    try {
+      const res = await AxiosInstance.get(`/${a.file_path}/link`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (win) {
+        win.opener = null;
+        win.location.href = `${API_URL}/${res.data.url}`;
+      }
+    } catch (err) {
+      win?.close();
+      console.error(err);
+    }
+  };
+
   const startEditing = (m: Message) => {
     setEditingMessageId(m.id);
     setEditingText(m.message || "");
@@ -193,9 +253,17 @@ export default function ChatPage() {
   return (
     <div className="flex h-screen">
       {/* Список пользователей */}
-      <div className="w-1/4 border-r p-4 border-gray-200">
+      <div className="w-1/4 border-r p-4 border-gray-200 flex flex-col">
         <h2 className="text-lg font-bold mb-4">Users</h2>
-        <ul>
+        <input
+          type="search"
+          value={userQuery}
+          onChange={(e) => setUserQuery(e.target.value)}
+          placeholder="Search users..."
+          maxLength={50}
+          className="border rounded p-2 mb-2"
+        />
+        <ul className="flex-1 overflow-y-auto" onScroll={handleUsersScroll}>
           {users.map((u) => (
             <li
               key={u.id}
@@ -207,6 +275,21 @@ export default function ChatPage() {
               {u.first_name} {u.last_name}
             </li>
           ))}
+          {usersNextAfter !== null && (
+            <li>
+              <button
+                type="button"
+                onClick={loadMoreUsers}
+                disabled={loadingUsers}
+                className="w-full p-2 text-sm text-gray-500 hover:text-gray-800 disabled:opacity-50"
+              >
+                {loadingUsers ? "Loading..." : "Load more"}
+              </button>
+            </li>
+          )}
+          {!loadingUsers && users.length === 0 && (
+            <li className="p-2 text-sm text-gray-500">No users found</li>
+          )}
         </ul>
       </div>
 
@@ -247,17 +330,16 @@ export default function ChatPage() {
                       )}
 
                       {m.attachments?.map((a, i) => (
-                        <a
+                        <button
                           key={i}
-                          href={`${API_URL}/${a.file_path}`}
-                          target="_blank"
-                          rel="noopener noreferrer"
-                          className={`text-sm underline block mt-1 ${
+                          type="button"
+                          onClick={() => openAttachment(a)}
+                          className={`text-sm underline block mt-1 text-left ${
                             isMine ? "text-purple-200" : "text-blue-600"
                           }`}
                         >
                           📎 {a.filename}
-                        </a>
+                        </button>
                       ))}
 
                       <span className="text-xs text-gray-400 block mt-1 text-right">